@@ -0,0 +1,123 @@
+"""
+Benchmark reactor latency while teams are created and joined.
+
+Creates T teams at once, then has 1000 bots join them at once (spread evenly
+over the teams), and reports how long each took and the longest and mean
+time the reactor went without getting a turn.  This is done with
+FileStoredPasswords, which does its sqlite work in a thread of its own with
+batched commits and caches password hashes, and with a store that queries
+sqlite on the reactor thread and commits each team as it's made (as
+FileStoredPasswords used to).  Both hash with the same pool, using cheaper
+scrypt parameters than the default so that the run is short.
+
+Usage: python bench/auth.py [teams] [joins]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from twisted.internet import defer, reactor, task
+from twisted.python.threadpool import ThreadPool
+from txscrypt.wrapper import Wrapper, DEFAULT_SALT_LENGTH
+
+from xatro.auth import FileStoredPasswords, HashingPool, _PasswordStore
+from xatro.error import NotFound
+from xatro.world import World
+from xatro.action import CreateTeam, JoinTeam
+
+from stall import StallMeter
+
+
+
+class ReactorThreadPasswords(_PasswordStore):
+    """
+    A password store which uses sqlite from the reactor thread.
+    """
+
+    def __init__(self, filename, hashing):
+        _PasswordStore.__init__(self, hashing)
+        self.db = sqlite3.connect(filename)
+        self.db.execute('create table if not exists entity '
+                        '(name blob primary key, pw blob)')
+
+
+    def _get(self, name):
+        c = self.db.cursor()
+        c.execute('select pw from entity where name=?', (buffer(name),))
+        row = c.fetchone()
+        if not row:
+            raise NotFound(name)
+        return str(row[0])
+
+
+    def _set(self, name, pw_hash):
+        self.db.execute('insert into entity (name, pw) values (?, ?)',
+                        (buffer(name), buffer(pw_hash)))
+        self.db.commit()
+
+
+
+@defer.inlineCallbacks
+def measure(make_requests):
+    meter = StallMeter()
+    meter.start()
+    yield task.deferLater(reactor, 0, lambda: None)
+    start = time.time()
+    yield defer.gatherResults(make_requests())
+    elapsed = time.time() - start
+    yield task.deferLater(reactor, 0, lambda: None)
+    meter.stop()
+    defer.returnValue((elapsed,) + meter.report())
+
+
+@defer.inlineCallbacks
+def run(name, auth, teams, joins):
+    world = World(lambda ev: None, auth=auth)
+    bots = [world.create('bot')['id'] for i in xrange(joins)]
+    team_names = ['team%d' % (i,) for i in xrange(teams)]
+
+    result = yield measure(lambda: [
+        CreateTeam(bots[0], team, 'password').execute(world)
+        for team in team_names])
+    print '%8s %14s %10.2f %14.1f %14.2f' % ((name, 'create %d' % teams)
+                                             + result)
+
+    result = yield measure(lambda: [
+        JoinTeam(bot, team_names[i % teams], 'password').execute(world)
+        for i, bot in enumerate(bots)])
+    print '%8s %14s %10.2f %14.1f %14.2f' % ((name, 'join %d' % joins)
+                                             + result)
+
+
+@defer.inlineCallbacks
+def main(teams, joins):
+    pool = ThreadPool(4, 4)
+    wrapper = Wrapper(reactor, pool, DEFAULT_SALT_LENGTH, N=2 ** 12)
+    hashing = HashingPool(4, teams + joins, wrapper)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print '%8s %14s %10s %14s %14s' % ('store', 'requests', 'time (s)',
+                                           'max stall (ms)',
+                                           'mean stall (ms)')
+        auth = ReactorThreadPasswords(os.path.join(tmpdir, 'reactor.db'),
+                                      hashing)
+        yield run('reactor', auth, teams, joins)
+        auth = FileStoredPasswords(os.path.join(tmpdir, 'thread.db'),
+                                   hashing)
+        yield run('thread', auth, teams, joins)
+        yield auth.db.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    teams = (args[0:1] or [100])[0]
+    joins = (args[1:2] or [1000])[0]
+    d = main(teams, joins)
+    d.addErrback(lambda err: err.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
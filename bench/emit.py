@@ -0,0 +1,77 @@
+"""
+Benchmark event emission.
+
+cascade: one emission whose receiver emits N more events.  The time per
+    queued event should stay flat as N grows.
+
+crowded square: a single Move into a square that already holds N bots.  Every
+    occupant receives the events emitted by the square, so the time per
+    occupant should stay flat as the square gets more crowded.
+
+Usage: python bench/emit.py [occupants ...]
+"""
+import sys
+import time
+
+from xatro.world import World
+from xatro.action import Move
+
+
+
+def timeCascade(events):
+    world = World(lambda ev: None)
+    source = world.create('source')['id']
+    sink = world.create('sink')['id']
+    def burst(ev):
+        for i in xrange(events):
+            world.emit(('burst', i), sink)
+    world.receiveFor(source, burst)
+
+    start = time.time()
+    world.emit('go', source)
+    return time.time() - start
+
+
+def crowdedSquare(occupants):
+    world = World(lambda ev: None)
+    square = world.create('square')['id']
+    for i in xrange(occupants):
+        bot = world.create('bot')['id']
+        Move(bot, square).execute(world)
+    return world, square
+
+
+def timeMove(world, square, repeat=3):
+    best = None
+    for i in xrange(repeat):
+        bot = world.create('bot')['id']
+        start = time.time()
+        Move(bot, square).execute(world)
+        elapsed = time.time() - start
+        Move(bot, None).execute(world)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(occupant_counts):
+    print 'cascade'
+    print '%10s %12s %16s' % ('events', 'total (ms)', 'per event (us)')
+    for events in [1000, 2000, 4000, 8000]:
+        elapsed = timeCascade(events)
+        print '%10d %12.2f %16.2f' % (events, elapsed * 1000,
+                                      elapsed * 1e6 / events)
+
+    print
+    print 'crowded square'
+    print '%10s %12s %16s' % ('occupants', 'move (ms)', 'per occupant (us)')
+    for occupants in occupant_counts:
+        world, square = crowdedSquare(occupants)
+        elapsed = timeMove(world, square)
+        print '%10d %12.2f %16.2f' % (occupants, elapsed * 1000,
+                                      elapsed * 1e6 / occupants)
+
+
+if __name__ == '__main__':
+    counts = [int(x) for x in sys.argv[1:]] or [500, 1000, 2000, 4000]
+    main(counts)
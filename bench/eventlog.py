@@ -0,0 +1,57 @@
+"""
+Benchmark event emission with and without an event log.
+
+Emits a stream of AttrSet events (plus the odd Created and ItemAdded) into a
+world with no subscribers, once with no event log and once logging to a
+temporary file, and prints events per second for each.  The log is synced
+when the run is done, and that time is included.
+
+Usage: python bench/eventlog.py [events]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from xatro.world import World
+from xatro.eventlog import EventLog, readEvents
+from xatro.event import Created, AttrSet, ItemAdded
+
+
+
+def run(world, count):
+    start = time.time()
+    for i in xrange(count):
+        if i % 10 == 0:
+            world.emit(Created(str(i)), str(i))
+        elif i % 10 == 1:
+            world.emit(ItemAdded(str(i - 1), 'contents', 'x'), str(i - 1))
+        else:
+            world.emit(AttrSet(str(i - i % 10), 'hp', i), str(i - i % 10))
+    if world.event_log:
+        world.event_log.close()
+    return time.time() - start
+
+
+def main(count):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print '%10s %12s %14s %12s' % ('log', 'time (s)', 'events/s',
+                                       'log (bytes)')
+        elapsed = run(World(lambda ev: None), count)
+        print '%10s %12.2f %14d %12s' % ('off', elapsed, count / elapsed, '-')
+
+        path = os.path.join(tmpdir, 'events.log')
+        # a long sync interval so that only the buffer size triggers writes
+        event_log = EventLog(path, sync_interval=3600)
+        elapsed = run(World(lambda ev: None, event_log=event_log), count)
+        print '%10s %12.2f %14d %12d' % ('on', elapsed, count / elapsed,
+                                         os.path.getsize(path))
+        assert sum(1 for x in readEvents(path)) == count
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(int((sys.argv[1:] or [200000])[0]))
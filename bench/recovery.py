@@ -0,0 +1,85 @@
+"""
+Benchmark recovering a world after a crash.
+
+Plays a game of bots wandering a 4x4 board for N events, logging every
+event, with a snapshot taken shortly before the end (as the periodic
+snapshotter would).  Then times recovering a fresh world from the snapshot
+plus the tail of the log, and from the whole log without a snapshot.
+
+Usage: python bench/recovery.py [events] [tail events]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from xatro.world import World
+from xatro.eventlog import EventLog
+from xatro.recovery import writeSnapshot, recover
+from xatro.action import Move
+
+
+
+def play(world, events, snapshot_at, snapshot_path):
+    squares = []
+    for i in xrange(4):
+        for j in xrange(4):
+            sq = world.create('square')['id']
+            world.setAttr(sq, 'coordinates', (i, j))
+            squares.append(sq)
+    bots = []
+    for i in xrange(200):
+        bot = world.create('bot')['id']
+        world.setAttr(bot, 'team', 'team%d' % (i % 4,))
+        Move(bot, random.choice(squares)).execute(world)
+        bots.append(bot)
+
+    snapshotted = False
+    while world.sequence < events:
+        bot = random.choice(bots)
+        Move(bot, random.choice(squares)).execute(world)
+        world.setAttr(bot, 'hp', random.randint(1, 10))
+        if not snapshotted and world.sequence >= snapshot_at:
+            writeSnapshot(world, snapshot_path)
+            snapshotted = True
+    world.event_log.close()
+
+
+def timeRecovery(snapshot_path, log_path):
+    world = World(lambda ev: None)
+    start = time.time()
+    recover(world, snapshot_path, log_path)
+    return time.time() - start, world
+
+
+def main(events, tail):
+    random.seed(0)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        log_path = os.path.join(tmpdir, 'events.log')
+        snapshot_path = os.path.join(tmpdir, 'events.log.snapshot')
+        world = World(lambda ev: None, event_log=EventLog(log_path, 3600))
+        start = time.time()
+        play(world, events, events - tail, snapshot_path)
+        print 'played %d events in %.1fs (log %d bytes, snapshot %d bytes)' % (
+            world.sequence, time.time() - start, os.path.getsize(log_path),
+            os.path.getsize(snapshot_path))
+
+        print '%24s %12s' % ('recovery', 'time (s)')
+        elapsed, recovered = timeRecovery(snapshot_path, log_path)
+        assert recovered.objects == world.objects
+        print '%24s %12.3f' % ('snapshot + %d events' % (tail,), elapsed)
+        elapsed, recovered = timeRecovery(None, log_path)
+        assert recovered.objects == world.objects
+        print '%24s %12.3f' % ('whole log', elapsed)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    events = (args[0:1] or [1000000])[0]
+    tail = (args[1:2] or [50000])[0]
+    main(events, tail)
@@ -0,0 +1,83 @@
+"""
+Benchmark StandardRules.isAllowed.
+
+Sets up a square with two bots (one with a cannon, one with a wrench), a
+pylon and some ore, and times how many allowed actions of each type
+isAllowed can check per second (best of several repeats).
+
+Usage: python bench/rules.py [iterations]
+"""
+import sys
+import time
+
+from xatro.world import World
+from xatro.standard import StandardRules
+from xatro.engine import XatroEngine
+from xatro import action as act
+
+
+
+def setUp():
+    rules = StandardRules()
+    world = World(lambda ev: None, XatroEngine(rules))
+    square = world.create('square')['id']
+    world.setAttr(square, 'coordinates', (0, 0))
+    other_square = world.create('square')['id']
+    world.setAttr(other_square, 'coordinates', (0, 1))
+
+    shooter = world.create('bot')['id']
+    world.setAttr(shooter, 'team', 'a')
+    act.Move(shooter, square).execute(world)
+    world.setAttr(shooter, 'tool', 'cannon')
+
+    medic = world.create('bot')['id']
+    world.setAttr(medic, 'team', 'a')
+    act.Move(medic, square).execute(world)
+    world.setAttr(medic, 'tool', 'wrench')
+
+    pylon = world.create('pylon')['id']
+    act.Move(pylon, square).execute(world)
+    ore = world.create('ore')['id']
+    act.Move(ore, square).execute(world)
+
+    actions = [
+        act.Move(shooter, other_square),
+        act.Charge(shooter),
+        act.ConsumeEnergy(shooter, 1),
+        act.LookAt(shooter, medic),
+        act.ShareEnergy(shooter, medic, 1),
+        act.Shoot(shooter, medic, 1),
+        act.Repair(medic, shooter, 1),
+        act.AddLock(shooter, pylon),
+        act.BreakLock(shooter, pylon),
+        act.MakeTool(shooter, ore, 'cannon'),
+        act.OpenPortal(shooter, ore, medic),
+    ]
+    return world, rules, actions
+
+
+def timeChecks(world, rules, action, iterations, repeat=5):
+    best = None
+    for r in xrange(repeat):
+        start = time.time()
+        for i in xrange(iterations):
+            rules.isAllowed(world, action)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(iterations):
+    world, rules, actions = setUp()
+    print '%14s %14s %12s' % ('action', 'checks/s', 'us/check')
+    for action in actions:
+        rules.isAllowed(world, action)
+        elapsed = timeChecks(world, rules, action, iterations)
+        print '%14s %14d %12.2f' % (action.__class__.__name__,
+                                    iterations / elapsed,
+                                    elapsed * 1e6 / iterations)
+
+
+if __name__ == '__main__':
+    main(int((sys.argv[1:] or [50000])[0]))
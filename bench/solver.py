@@ -0,0 +1,76 @@
+"""
+Benchmark solving work.
+
+Measures how many hashes per second the stream solver (one process) and the
+process solver (one process per CPU) can try, then prints the expected
+time to solve work at a range of difficulty/scale settings for each, so that
+work requirements can be tuned from numbers.
+
+Usage: python bench/solver.py [hashes] [processes]
+"""
+import multiprocessing
+import sys
+import time
+
+from xatro.work import WorkMaker, Work, MAX_SHA, expectedHashes
+from xatro.work import searchAnswers, ProcessSolver
+
+
+# work nothing solves, so that every answer in a range is tried
+IMPOSSIBLE = Work(MAX_SHA, 'nonce')
+
+SETTINGS = [
+    # difficulty, scale
+    (1000, 10000),
+    (100, 10000),
+    (10, 10000),
+    (1, 10000),
+    (1, 100000),
+    (1, 1000000),
+    (1, 10000000),
+]
+
+
+
+def streamRate(hashes):
+    start = time.time()
+    searchAnswers(IMPOSSIBLE, 0, hashes)
+    return hashes / (time.time() - start)
+
+
+def processRate(hashes, processes):
+    solver = ProcessSolver(processes)
+    try:
+        # get every process going before timing
+        solver.search(IMPOSSIBLE, 0, processes)
+        start = time.time()
+        solver.search(IMPOSSIBLE, 0, hashes)
+        return hashes / (time.time() - start)
+    finally:
+        solver.close()
+
+
+def main(hashes, processes):
+    maker = WorkMaker()
+    rates = [
+        ('stream', streamRate(hashes)),
+        ('process x%d' % (processes,), processRate(hashes, processes)),
+    ]
+    print '%12s %14s' % ('solver', 'hashes/s')
+    for name, rate in rates:
+        print '%12s %14d' % (name, rate)
+    print
+
+    print '%10s %10s %12s' % ('difficulty', 'scale', 'hashes'),
+    print ' '.join(['%14s' % (name + ' (s)',) for name, rate in rates])
+    for difficulty, scale in SETTINGS:
+        expected = expectedHashes(maker.getWork(difficulty, scale))
+        print '%10d %10d %12.0f' % (difficulty, scale, expected),
+        print ' '.join(['%14.4f' % (expected / rate,) for name, rate in rates])
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    hashes = (args[0:1] or [1000000])[0]
+    processes = (args[1:2] or [multiprocessing.cpu_count()])[0]
+    main(hashes, processes)
@@ -0,0 +1,44 @@
+"""
+Measuring how long the reactor goes without getting a turn, for the
+benchmarks.
+"""
+import time
+
+from twisted.internet import reactor
+
+
+
+class StallMeter(object):
+    """
+    I measure the gaps between turns of the reactor.
+    """
+
+    def __init__(self):
+        self.gaps = []
+        self._last = None
+        self._call = None
+
+
+    def start(self):
+        self._last = time.time()
+        self._call = reactor.callLater(0, self._tick)
+
+
+    def stop(self):
+        if self._call.active():
+            self._call.cancel()
+
+
+    def _tick(self):
+        now = time.time()
+        self.gaps.append(now - self._last)
+        self._last = now
+        self._call = reactor.callLater(0, self._tick)
+
+
+    def report(self):
+        """
+        @return: The longest and mean gap, in milliseconds.
+        """
+        gaps = self.gaps or [0]
+        return max(gaps) * 1000, sum(gaps) / len(gaps) * 1000
@@ -0,0 +1,71 @@
+"""
+Benchmark the memory used to store world objects.
+
+Builds a state full of energy (objects with just an id and a kind) plus some
+bots with a few more attributes, once with dicts (State) and once with
+Records (CompactState).  Each layout is built in its own process so the
+resident set sizes can be compared.
+
+Usage: python bench/store.py [objects]
+"""
+import os
+import resource
+import sys
+import time
+from uuid import uuid4
+
+from xatro.state import State, CompactState
+from xatro.event import Created, AttrSet, ItemAdded
+
+
+
+def build(state_cls, count):
+    state = state_cls()
+    for i in xrange(count):
+        obj_id = str(uuid4())
+        state.eventReceived(Created(obj_id))
+        state.eventReceived(AttrSet(obj_id, 'kind', 'energy'))
+        if i % 100 == 0:
+            state.eventReceived(AttrSet(obj_id, 'kind', 'bot'))
+            state.eventReceived(AttrSet(obj_id, 'hp', 10))
+            state.eventReceived(AttrSet(obj_id, 'location', None))
+            state.eventReceived(ItemAdded(obj_id, 'energy', 'x'))
+    return state
+
+
+def measure(state_cls, count):
+    """
+    Build a state in a child process and return the growth in maxrss (KB)
+    and the time taken to build it.
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        state = build(state_cls, count)
+        elapsed = time.time() - start
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        assert len(state.state) == count
+        os.write(w, '%d %f' % (after - before, elapsed))
+        os._exit(0)
+    os.close(w)
+    result = os.read(r, 100)
+    os.waitpid(pid, 0)
+    kb, elapsed = result.split()
+    return int(kb), float(elapsed)
+
+
+def main(count):
+    print '%d objects' % (count,)
+    print '%14s %12s %14s %10s' % ('layout', 'rss (KB)', 'per object (B)',
+                                   'build (s)')
+    for state_cls in [State, CompactState]:
+        kb, elapsed = measure(state_cls, count)
+        print '%14s %12d %14.1f %10.2f' % (state_cls.__name__, kb,
+                                           kb * 1024.0 / count, elapsed)
+
+
+if __name__ == '__main__':
+    main(int((sys.argv[1:] or [200000])[0]))
@@ -0,0 +1,79 @@
+"""
+Benchmark the memory used by a long-running game.
+
+Simulates a 24-hour game on a 4x4 board.  Every simulated minute each bot
+charges, spends its energy, shoots a neighbour, gets repaired and wanders to
+an adjacent square.  Every couple of simulated hours the number of objects
+being watched and the number of live Python objects are printed; neither
+should grow with the length of the game.
+
+Usage: python bench/watchers.py [bots]
+"""
+import gc
+import random
+import resource
+import sys
+
+from xatro.world import World
+from xatro.action import Move, Charge, ConsumeEnergy, Shoot, Repair
+
+
+
+def makeBoard(world, size=4):
+    squares = {}
+    for i in xrange(size):
+        for j in xrange(size):
+            sq = world.create('square')['id']
+            world.setAttr(sq, 'coordinates', (i, j))
+            squares[(i, j)] = sq
+    return squares
+
+
+def wander(world, squares, bot, size=4):
+    x, y = world.get(world.get(bot)['location'])['coordinates']
+    dx, dy = random.choice([(0, 1), (0, -1), (1, 0), (-1, 0)])
+    x = min(max(x + dx, 0), size - 1)
+    y = min(max(y + dy, 0), size - 1)
+    Move(bot, squares[(x, y)]).execute(world)
+
+
+def simulatedMinute(world, squares, bots):
+    for bot in bots:
+        Charge(bot).execute(world)
+        ConsumeEnergy(bot, 1).execute(world)
+        target = random.choice(bots)
+        Shoot(bot, target, 1).execute(world)
+        Repair(bot, target, 1).execute(world)
+        wander(world, squares, bot)
+
+
+def report(world, minute):
+    gc.collect()
+    watched = (len(world._on_become) + len(world._on_change) +
+               len(world._on_event))
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%6d %10d %12d %14d %10d' % (minute / 60, len(world.objects),
+                                       watched, len(gc.get_objects()), maxrss)
+
+
+def main(bot_count):
+    random.seed(0)
+    world = World(lambda ev: None)
+    squares = makeBoard(world)
+    bots = []
+    for i in xrange(bot_count):
+        bot = world.create('bot')['id']
+        world.setAttr(bot, 'hp', 10)
+        Move(bot, random.choice(squares.values())).execute(world)
+        bots.append(bot)
+
+    print '%6s %10s %12s %14s %10s' % ('hour', 'objects', 'watched',
+                                       'python objs', 'maxrss')
+    for minute in xrange(24 * 60 + 1):
+        if minute % 120 == 0:
+            report(world, minute)
+        simulatedMinute(world, squares, bots)
+
+
+if __name__ == '__main__':
+    main(int((sys.argv[1:] or [16])[0]))
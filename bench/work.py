@@ -0,0 +1,98 @@
+"""
+Benchmark verifying solutions to work.
+
+Makes N pieces of work with a candidate solution each and times how many
+solutions per second are verified inline (as XatroEngine.execute does by
+default), in batches on later reactor turns, and in batches in a thread
+pool.  Also reports the longest the reactor went without getting a turn
+while the solutions were verified.
+
+First it compares checking a solution by comparing digests (what
+WorkMaker.isResult does) with parsing the hex digest into an integer and
+comparing that with the goal.
+
+Usage: python bench/work.py [solutions] [batch size]
+"""
+import sys
+import time
+from hashlib import sha1
+
+from twisted.internet import defer, reactor, task
+from twisted.python.threadpool import ThreadPool
+
+from xatro.work import WorkMaker, InlineVerifier, BatchVerifier
+
+from stall import StallMeter
+
+
+
+class IntegerWorkMaker(WorkMaker):
+    """
+    A L{WorkMaker} that compares hashes with goals as integers.
+    """
+
+    def _validAnswer(self, nonce, goal, answer):
+        return int(sha1(nonce + answer).hexdigest(), 16) > goal
+
+
+def timeChecks(check, pairs, repeat=5):
+    best = None
+    for r in xrange(repeat):
+        start = time.time()
+        for work, answer in pairs:
+            check(work, answer)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+@defer.inlineCallbacks
+def timeVerifier(verifier, pairs):
+    meter = StallMeter()
+    meter.start()
+    yield task.deferLater(reactor, 0, lambda: None)
+    start = time.time()
+    ds = [verifier.verify(work, solution) for work, solution in pairs]
+    yield defer.gatherResults(ds)
+    elapsed = time.time() - start
+    # let the meter see the turn the last verdict was delivered on
+    yield task.deferLater(reactor, 0, lambda: None)
+    meter.stop()
+    defer.returnValue((elapsed, meter.report()[0]))
+
+
+@defer.inlineCallbacks
+def main(count, batch_size):
+    maker = WorkMaker()
+    pairs = [(maker.getWork(), str(i)) for i in xrange(count)]
+
+    print '%8s %14s' % ('compare', 'checks/s')
+    for name, check in [('integer', IntegerWorkMaker().isResult),
+                        ('digest', maker.isResult)]:
+        print '%8s %14d' % (name, count / timeChecks(check, pairs))
+    print
+    pool = ThreadPool(1, 1)
+    pool.start()
+    verifiers = [
+        ('inline', InlineVerifier(maker)),
+        ('batch', BatchVerifier(maker, batch_size)),
+        ('thread', BatchVerifier(maker, batch_size, pool)),
+    ]
+    try:
+        print '%8s %14s %16s' % ('verifier', 'solutions/s', 'max stall (ms)')
+        for name, verifier in verifiers:
+            elapsed, stall = yield timeVerifier(verifier, pairs)
+            print '%8s %14d %16.1f' % (name, count / elapsed, stall)
+    finally:
+        pool.stop()
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    count = (args[0:1] or [20000])[0]
+    batch_size = (args[1:2] or [100])[0]
+    d = main(count, batch_size)
+    d.addErrback(lambda err: err.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
@@ -1,8 +1,6 @@
 from twisted.internet import defer
 from zope.interface import implements
 
-from collections import defaultdict
-
 from xatro.interface import IAction
 from xatro.event import Destroyed
 from xatro.error import NotEnoughEnergy, Invulnerable, NotAllowed
@@ -182,14 +180,16 @@ class Charge(object):
         world.setAttr(thing_id, 'created_energy',
                       thing.get('created_energy', 0) + 1)
 
-        # wait for it to be destroyed
-        d = world.onEvent(e['id'], Destroyed(e['id']))
-        d.addCallback(self._decCreatedEnergy, world, thing_id)
-
         # destroy the energy when the creator is dead
         # XXX this might be ripped out of here and put in the game engine
-        d = world.onBecome(thing_id, 'location', None)
-        d.addCallback(lambda x:world.destroy(e['id']))
+        d_creator = world.onBecome(thing_id, 'location', None)
+        d_creator.addCallback(lambda x:world.destroy(e['id']))
+        d_creator.addErrback(_ignoreCancellation)
+
+        # wait for it to be destroyed (and stop waiting for the creator)
+        d = world.onEvent(e['id'], Destroyed(e['id']))
+        d.addCallback(self._decCreatedEnergy, world, thing_id)
+        d.addCallback(lambda x:d_creator.cancel())
 
 
     def _decCreatedEnergy(self, ev, world, thing_id):
@@ -529,21 +529,27 @@ class ListSquares(object):
     def execute(self, world):
         """
         List the squares in the world.
+
+        The listing is cached (and the same list returned) until a square or
+        what is in a square changes, so don't change it.
         """
-        # XXX optimize this if it's too slow.  It's very possible that it's
-        # too slow.
+        cache = world.envelope(ListSquares)
+        revision = world.boardRevision()
+        if cache.get('revision') != revision:
+            cache['squares'] = self._listSquares(world)
+            cache['revision'] = revision
+        return cache['squares']
+
+
+    def _listSquares(self, world):
         ret = []
-        squares = (x for x in world.objects.values() if x['kind'] == 'square')
-        for square in squares:
-            contents = defaultdict(lambda: 0)
-            for thing_id in square.get('contents', []):
-                thing = world.get(thing_id)
-                contents[thing['kind']] += 1
+        for square_id in world.byKind('square'):
+            square = world.get(square_id)
             ret.append({
-                'id': square['id'],
+                'id': square_id,
                 'kind': square['kind'],
                 'coordinates': square.get('coordinates'),
-                'contents': contents,
+                'contents': world.contentsSummary(square_id),
             })
         return ret
 
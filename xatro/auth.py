@@ -4,59 +4,185 @@ try:
 except:
     import sqlite3 as sqlite
 
-from twisted.internet import defer
-from txscrypt import computeKey, checkPassword
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+from twisted.python.failure import Failure
+from txscrypt.wrapper import Wrapper, DEFAULT_SALT_LENGTH, DEFAULT_ITERATIONS
 
-from xatro.error import NotFound, BadPassword
+from xatro.error import NotFound, BadPassword, AuthBusy
 
+from hashlib import sha256
+import hmac
+import os
 
 
-class FileStoredPasswords(object):
+
+class HashingPool(object):
     """
-    I authenticate passwords from data stored in an sqlite3 file
+    I compute and check scrypt password hashes in a pool of C{size} threads,
+    with at most C{max_queued} more waiting for a thread.  Past that, I
+    refuse work with L{AuthBusy} rather than queue it.
     """
 
 
-    def __init__(self, filename):
-        self.db = sqlite.connect(filename)
-        self.db.execute('create table if not exists entity '
-                        '(name blob primary key, pw blob)')
+    def __init__(self, size=4, max_queued=100, wrapper=None, reactor=None):
+        """
+        @param wrapper: The C{txscrypt} wrapper to hash with.  By default one
+            with its own pool of C{size} threads.
+        @param reactor: The reactor for the default C{wrapper} to use, by
+            default the global one.
+        """
+        self.size = size
+        self.max_queued = max_queued
+        if wrapper is None:
+            if reactor is None:
+                from twisted.internet import reactor
+            wrapper = Wrapper(reactor, ThreadPool(size, size),
+                              DEFAULT_SALT_LENGTH, N=DEFAULT_ITERATIONS)
+        self._wrapper = wrapper
+        self.pending = 0
+
+
+    def computeKey(self, password):
+        """
+        Compute the hash of a password.
+
+        @return: A L{Deferred} which fires with the hash.
+        """
+        return self._submit(self._wrapper.computeKey, password)
+
+
+    def checkPassword(self, stored, provided):
+        """
+        Check a password against a hash from L{computeKey}.
+
+        @return: A L{Deferred} which fires with whether it matches.
+        """
+        return self._submit(self._wrapper.checkPassword, stored, provided)
+
+
+    def _submit(self, func, *args):
+        if self.pending >= self.size + self.max_queued:
+            return defer.fail(AuthBusy('Too many passwords being checked'))
+        self.pending += 1
+        d = func(*args)
+        d.addBoth(self._done)
+        return d
 
 
-    def _get(self, name):
-        c = self.db.cursor()
-        c.execute('select pw from entity where name=?', (buffer(name),))
-        row = c.fetchone()
-        if not row:
-            raise NotFound(name)
-        return str(row[0])
-    
+    def _done(self, result):
+        self.pending -= 1
+        return result
 
-    def _set(self, name, pw_hash):
-        self.db.execute('insert into entity (name, pw) values (?, ?)',
-                        (buffer(name), buffer(pw_hash)))
-        self.db.commit()
+
+
+_default_hashing = None
+
+def defaultHashingPool():
+    """
+    Get the L{HashingPool} shared by password stores that aren't given one.
+    """
+    global _default_hashing
+    if _default_hashing is None:
+        _default_hashing = HashingPool()
+    return _default_hashing
+
+
+
+class _PasswordStore(object):
+    """
+    I check passwords against hashes kept by my subclasses, which implement
+    C{_get} and C{_set}.
+
+    A correct password is remembered for C{cache_ttl} seconds, and checks of
+    the same password for the same name while one is in progress share its
+    result, so that many bots joining a team at once don't each pay for a
+    hash.  Only a keyed hash of the password is remembered.
+
+    @ivar clock: Provider of C{seconds} used to expire remembered passwords.
+    """
+
+
+    def __init__(self, hashing=None, cache_ttl=30.0, cache_size=1000,
+                 clock=None):
+        """
+        @param hashing: The L{HashingPool} to hash passwords with.  Defaults
+            to one shared by all stores.
+        @param cache_ttl: Seconds to remember a correct password for.
+        @param cache_size: Most correct passwords to remember.
+        @param clock: C{clock}, by default the reactor.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.hashing = hashing or defaultHashingPool()
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._secret = os.urandom(32)
+        # (name, keyed hash of password) -> time it expires
+        self._correct = {}
+        # (name, keyed hash of password) -> Deferreds waiting on the check
+        self._checking = {}
 
 
     def createEntity(self, name, password):
-        return computeKey(password).addCallback(self._gotHash, name)
+        return self.hashing.computeKey(password).addCallback(self._gotHash,
+                                                             name)
 
 
     def _gotHash(self, pw_hash, name):
-        self._set(name, pw_hash)
-        return name
+        d = defer.maybeDeferred(self._set, name, pw_hash)
+        return d.addCallback(lambda _: name)
 
 
     def checkPassword(self, name, password):
-        try:
-            pw_hash = self._get(name)
-        except NotFound:
-            return defer.fail(BadPassword('Bad password: %r' % (name,)))
-        d = checkPassword(pw_hash, password)
+        d = defer.maybeDeferred(self._get, name)
+        d.addCallbacks(self._gotStoredHash, self._noStoredHash,
+                       callbackArgs=(name, password), errbackArgs=(name,))
+        return d
+
+
+    def _noStoredHash(self, err, name):
+        err.trap(KeyError, NotFound)
+        raise BadPassword('Bad password: %r' % (name,))
+
+
+    def _gotStoredHash(self, pw_hash, name, password):
+        key = (name, hmac.new(self._secret, password, sha256).digest())
+        expires = self._correct.get(key)
+        if expires is not None:
+            if expires > self.clock.seconds():
+                return defer.succeed(name)
+            del self._correct[key]
+
+        d = defer.Deferred()
         d.addCallback(self._passwordMatches, name)
+        waiting = self._checking.get(key)
+        if waiting is not None:
+            waiting.append(d)
+            return d
+        self._checking[key] = [d]
+        check = self.hashing.checkPassword(pw_hash, password)
+        check.addBoth(self._checked, key)
         return d
 
 
+    def _checked(self, result, key):
+        """
+        Give the result of checking a password to everyone waiting for it,
+        and remember it if it was correct.
+        """
+        if result is True:
+            if len(self._correct) >= self.cache_size:
+                self._correct.clear()
+            self._correct[key] = self.clock.seconds() + self.cache_ttl
+        for d in self._checking.pop(key):
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
     def _passwordMatches(self, matches, name):
         if matches:
             return name
@@ -64,49 +190,213 @@ class FileStoredPasswords(object):
 
 
 
-class MemoryStoredPasswords(object):
+class EntityDatabase(object):
     """
-    I authenticate passwords from data stored in memory.
+    I keep names and password hashes in an sqlite3 file.
 
-    XXX FileStoredPasswords and I should be refactored to not have so much
-    duplicate code.
+    All my queries run in a thread of my own (which has the only connection
+    to the file), so the reactor never waits on the disk.  The file is put
+    in write-ahead-log mode, and inserts made within C{commit_delay} seconds
+    of each other are committed together.
+
+    @ivar reactor: The reactor, used to run my thread and to schedule
+        commits.
     """
+    _create = ('create table if not exists entity '
+               '(name blob primary key, pw blob)')
+    # the connection caches the prepared statement for each of these
+    _select = 'select pw from entity where name=?'
+    _insert = 'insert into entity (name, pw) values (?, ?)'
+
+
+    def __init__(self, filename, commit_delay=0.01, threadpool=None,
+                 reactor=None):
+        """
+        @param reactor: The reactor to use, by default the global one.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.filename = filename
+        self.commit_delay = commit_delay
+        self.threadpool = threadpool or ThreadPool(1, 1)
+        # only used in my thread
+        self._db = None
+        # (name, pw_hash, Deferred) waiting to be committed
+        self._inserts = []
+        self._commit_call = None
+
+
+    def _run(self, func, *args):
+        if not self.threadpool.started:
+            self.threadpool.start()
+            self.reactor.addSystemEventTrigger('before', 'shutdown',
+                                               self.close)
+        return threads.deferToThreadPool(self.reactor, self.threadpool, func,
+                                         *args)
+
+
+    def _connection(self):
+        if self._db is None:
+            db = sqlite.connect(self.filename)
+            db.execute('pragma journal_mode=wal')
+            db.execute('pragma synchronous=normal')
+            db.execute(self._create)
+            db.commit()
+            self._db = db
+        return self._db
+
+
+    def get(self, name):
+        """
+        Get the password hash for C{name}.
+
+        @return: A L{Deferred} which fires with the hash, or fails with
+            L{NotFound}.
+        """
+        return self._run(self._selectHash, name)
+
+
+    def _selectHash(self, name):
+        row = self._connection().execute(self._select,
+                                         (buffer(name),)).fetchone()
+        if not row:
+            raise NotFound(name)
+        return str(row[0])
 
 
-    def __init__(self):
-        self._data = {}
+    def insert(self, name, pw_hash):
+        """
+        Store the password hash for a new C{name}.
+
+        @return: A L{Deferred} which fires once it's committed, or fails if
+            C{name} is already taken.
+        """
+        d = defer.Deferred()
+        self._inserts.append((name, pw_hash, d))
+        if self._commit_call is None:
+            self._commit_call = self.reactor.callLater(self.commit_delay,
+                                                       self._commit)
+        return d
+
+
+    def _commit(self):
+        self._commit_call = None
+        inserts, self._inserts = self._inserts, []
+        rows = [(name, pw_hash) for name, pw_hash, d in inserts]
+        d = self._run(self._insertRows, rows)
+        d.addCallbacks(self._committed, self._commitFailed,
+                       callbackArgs=(inserts,), errbackArgs=(inserts,))
+        return d
+
+
+    def _insertRows(self, rows):
+        """
+        Insert rows in one transaction.
+
+        @return: A list of the error inserting each row (or C{None}).
+        """
+        db = self._connection()
+        errors = []
+        for name, pw_hash in rows:
+            try:
+                db.execute(self._insert, (buffer(name), buffer(pw_hash)))
+                errors.append(None)
+            except sqlite.IntegrityError as e:
+                errors.append(e)
+        db.commit()
+        return errors
+
+
+    def _committed(self, errors, inserts):
+        for (name, pw_hash, d), error in zip(inserts, errors):
+            if error is None:
+                d.callback(name)
+            else:
+                d.errback(error)
+
+
+    def _commitFailed(self, err, inserts):
+        for name, pw_hash, d in inserts:
+            d.errback(err)
+
+
+    def close(self):
+        """
+        Commit what's waiting to be committed, then close the file and stop
+        my thread.
+
+        @return: A L{Deferred} which fires when I'm closed.
+        """
+        if not self.threadpool.started:
+            return defer.succeed(None)
+        if self._commit_call is not None:
+            self._commit_call.cancel()
+            d = self._commit()
+        else:
+            d = defer.succeed(None)
+        d.addBoth(lambda _: self._run(self._closeConnection))
+        d.addBoth(lambda _: self.threadpool.stop())
+        return d
+
+
+    def _closeConnection(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+
+class FileStoredPasswords(_PasswordStore):
+    """
+    I authenticate passwords from data stored in an sqlite3 file (see
+    L{EntityDatabase}).  Password hashes are cached in memory once read.
+    """
+
+
+    def __init__(self, filename, hashing=None, cache_ttl=30.0, reactor=None):
+        """
+        @param reactor: The reactor for my L{EntityDatabase} (and the clock
+            for remembered passwords), by default the global one.
+        """
+        _PasswordStore.__init__(self, hashing, cache_ttl, clock=reactor)
+        self.db = EntityDatabase(filename, reactor=self.clock)
+        # name -> password hash
+        self._hashes = {}
 
 
     def _get(self, name):
-        return self._data[name]
-    
+        pw_hash = self._hashes.get(name)
+        if pw_hash is not None:
+            return pw_hash
+        return self.db.get(name).addCallback(self._cacheHash, name)
+
 
     def _set(self, name, pw_hash):
-        self._data[name] = pw_hash
+        d = self.db.insert(name, pw_hash)
+        return d.addCallback(lambda _: self._cacheHash(pw_hash, name))
 
 
-    def createEntity(self, name, password):
-        return computeKey(password).addCallback(self._gotHash, name)
+    def _cacheHash(self, pw_hash, name):
+        self._hashes[name] = pw_hash
+        return pw_hash
 
 
-    def _gotHash(self, pw_hash, name):
-        self._set(name, pw_hash)
-        return name
 
+class MemoryStoredPasswords(_PasswordStore):
+    """
+    I authenticate passwords from data stored in memory.
+    """
 
-    def checkPassword(self, name, password):
-        try:
-            pw_hash = self._get(name)
-        except KeyError:
-            return defer.fail(BadPassword('Bad password: %r' % (name,)))
-        d = checkPassword(pw_hash, password)
-        d.addCallback(self._passwordMatches, name)
-        return d
+
+    def __init__(self, hashing=None, cache_ttl=30.0, clock=None):
+        _PasswordStore.__init__(self, hashing, cache_ttl, clock=clock)
+        self._data = {}
 
 
-    def _passwordMatches(self, matches, name):
-        if matches:
-            return name
-        raise BadPassword('Bad password: %r' % (name,))
+    def _get(self, name):
+        return self._data[name]
 
 
+    def _set(self, name, pw_hash):
+        self._data[name] = pw_hash
@@ -1,4 +1,9 @@
-from xatro.error import NotAllowed
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from xatro.error import NotAllowed, TooManyCommands
+
+from collections import deque
 
 
 
@@ -7,16 +12,30 @@ class Avatar(object):
     I am the client-controllable interface for a game piece in the world.
 
     Write your protocols to use my public methods.
+
+    Commands are started in the order they're given to L{execute}, at most
+    C{max_in_flight} at a time, and their results are delivered in the same
+    order.  At most C{max_queued} commands wait for their turn; any more are
+    refused with L{TooManyCommands}.
     """
 
     _game_piece = None
     _world = None
 
+    max_in_flight = 1
+    max_queued = 100
+
     def __init__(self, world=None, commands=None):
         self._world = world
         self._available_commands = commands or {}
         self._pending_events = []
         self._eventReceived = self._pending_events.append
+        # (command_cls, args, kwargs, Deferred) waiting to be started
+        self._waiting = deque()
+        # [Deferred, done, result] for commands started but not delivered,
+        # in order
+        self._started = deque()
+        self._starting = False
 
 
     def setGamePiece(self, game_piece):
@@ -32,7 +51,12 @@ class Avatar(object):
     def quit(self):
         """
         Quit from the game/world/server.
+
+        Commands that haven't been started yet fail with L{NotAllowed}.
         """
+        waiting, self._waiting = self._waiting, deque()
+        for command_cls, args, kwargs, d in waiting:
+            d.errback(NotAllowed('Quit before the command was started'))
         self._world.destroy(self._game_piece)
 
 
@@ -73,6 +97,60 @@ class Avatar(object):
         """
         Execute a command with the given parameters.  The command's first
         argument will always by my game piece.
+
+        @return: A L{Deferred} which fires with the result once this and all
+            the commands given before it are done.  If too many commands are
+            already waiting, it has already failed with L{TooManyCommands}.
         """
+        if len(self._waiting) >= self.max_queued:
+            return defer.fail(TooManyCommands(
+                "Too many commands waiting (%d)" % (self.max_queued,)))
+        d = defer.Deferred()
+        self._waiting.append((command_cls, args, kwargs, d))
+        self._startWaiting()
+        return d
+
+
+    def _startWaiting(self):
+        """
+        Start as many waiting commands as are allowed in flight.  A command
+        is in flight until its result is delivered.
+
+        Commands that finish right away don't start the next ones themselves
+        (that would recurse once per command); this loop carries on instead.
+        """
+        if self._starting:
+            return
+        self._starting = True
+        try:
+            while self._waiting and len(self._started) < self.max_in_flight:
+                command_cls, args, kwargs, d = self._waiting.popleft()
+                entry = [d, False, None]
+                self._started.append(entry)
+                r = defer.maybeDeferred(self._executeNow, command_cls, args,
+                                        kwargs)
+                r.addBoth(self._commandDone, entry)
+        finally:
+            self._starting = False
+
+
+    def _executeNow(self, command_cls, args, kwargs):
         cmd = self.makeCommand(command_cls, *args, **kwargs)
-        return self._world.execute(cmd)
\ No newline at end of file
+        return self._world.execute(cmd)
+
+
+    def _commandDone(self, result, entry):
+        """
+        A command finished.  Deliver the results of it and any commands
+        after it that finished before it, then start more commands.
+        """
+        entry[1] = True
+        entry[2] = result
+        started = self._started
+        while started and started[0][1]:
+            d, done, result = started.popleft()
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+        self._startWaiting()
\ No newline at end of file
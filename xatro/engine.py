@@ -4,7 +4,7 @@ from zope.interface import implements
 
 from xatro.interface import IEngine
 from xatro.error import InvalidSolution, NotEnoughEnergy
-from xatro.work import WorkMaker
+from xatro.work import WorkMaker, InlineVerifier, ReplayCache
 from xatro.action import ConsumeEnergy
 
 
@@ -19,9 +19,21 @@ class XatroEngine(object):
     implements(IEngine)
 
 
-    def __init__(self, engine):
+    def __init__(self, engine, verifier=None, used_solutions=None):
+        """
+        @param engine: The L{IXatroEngine} I wrap.
+        @param verifier: Something with a C{verify(work, solution)} method
+            returning a L{Deferred} which fires with whether the solution is
+            good.  Defaults to an L{InlineVerifier} using my C{work_maker}.
+        @param used_solutions: A L{ReplayCache} of the C{(nonce, solution)}
+            pairs which have been used, so they aren't accepted again.
+        """
         self.engine = engine
         self.work_maker = WorkMaker()
+        self.verifier = verifier or InlineVerifier(self.work_maker)
+        if used_solutions is None:
+            used_solutions = ReplayCache()
+        self.used_solutions = used_solutions
 
 
     def execute(self, world, action):
@@ -37,10 +49,43 @@ class XatroEngine(object):
         if work:
             # do they have a solution?
             solution = world.envelope(action).get('work_solution', None)
-            if solution is None or not self.work_maker.isResult(work, solution):
-                # verify that the work is good
+            if solution is None:
                 return defer.fail(InvalidSolution(work))
-        
+            if (work.nonce, solution) in self.used_solutions:
+                # don't bother checking a solution that's been used
+                return defer.fail(InvalidSolution(work))
+            # verify that the work is good
+            d = self.verifier.verify(work, solution)
+            d.addCallback(self._verified, world, action, work, solution,
+                          not d.called)
+            return d
+
+        return self._checkEnergyAndExecute(world, action)
+
+
+    def _verified(self, valid, world, action, work, solution, deferred):
+        """
+        Called with the verdict on the C{solution} to C{work}.  A good
+        solution is used up, even if the action then isn't done.
+
+        @param deferred: C{True} if the verdict came on a later turn of the
+            reactor, in which case the world may have changed since the
+            action was allowed, so it's checked again.
+        """
+        key = (work.nonce, solution)
+        if not valid or key in self.used_solutions:
+            raise InvalidSolution(work)
+        self.used_solutions.add(key)
+        if deferred:
+            self.engine.isAllowed(world, action)
+        return self._checkEnergyAndExecute(world, action)
+
+
+    def _checkEnergyAndExecute(self, world, action):
+        """
+        Check that the subject of C{action} has enough energy, then execute
+        it.
+        """
         # check energy
         energy = self.engine.energyRequirement(world, action)
         if energy:
@@ -69,4 +114,8 @@ class XatroEngine(object):
 
 
     def worldEventReceived(self, world, event):
-        self.engine.worldEventReceived(world, event)
\ No newline at end of file
+        self.engine.worldEventReceived(world, event)
+
+
+    def worldRecovered(self, world):
+        self.engine.worldRecovered(world)
\ No newline at end of file
@@ -4,4 +4,7 @@ class NotAllowed(Exception): pass
 
 class InvalidSolution(Exception): pass
 class NotEnoughEnergy(Exception): pass
-class Invulnerable(Exception): pass
\ No newline at end of file
+class Invulnerable(Exception): pass
+class TooManyCommands(Exception): pass
+class RateLimited(Exception): pass
+class AuthBusy(Exception): pass
\ No newline at end of file
@@ -0,0 +1,216 @@
+from twisted.python import log
+
+import marshal
+import os
+import struct
+
+from xatro.event import Created, Destroyed, AttrSet, AttrDel, ItemAdded
+from xatro.event import ItemRemoved, ActionPerformed
+
+
+
+# The position of an event class in this list is how it is identified in a
+# log, so only ever add to the end.
+event_classes = [
+    Created,
+    Destroyed,
+    AttrSet,
+    AttrDel,
+    ItemAdded,
+    ItemRemoved,
+    ActionPerformed,
+]
+
+_kinds = dict((cls, i) for i, cls in enumerate(event_classes))
+
+_header = struct.Struct('<I')
+
+_plain_types = (str, unicode, int, long, float, bool, type(None))
+
+# attributes of actions which are not written to the log.
+_secret_attrs = frozenset(['password'])
+
+
+
+def _plain(value):
+    """
+    Convert a value into something C{marshal} can dump.
+
+    Objects become a tuple of their class name and a dict of their public
+    attributes.  Anything else is replaced by its C{repr}.
+    """
+    if isinstance(value, _plain_types):
+        return value
+    elif isinstance(value, (tuple, list)):
+        return type(value)(_plain(x) for x in value)
+    elif isinstance(value, dict):
+        return dict((_plain(k), _plain(v)) for k, v in value.items())
+    elif hasattr(value, '__dict__'):
+        attrs = dict((k, _plain(v)) for k, v in vars(value).items()
+                     if not k.startswith('_') and k not in _secret_attrs)
+        return (value.__class__.__name__, attrs)
+    return repr(value)
+
+
+
+def encode(sequence, event):
+    """
+    Encode an event as a log record.
+
+    @param sequence: The event's sequence number.
+
+    @return: A string.
+    """
+    kind = _kinds.get(type(event), -1)
+    if kind == -1:
+        fields = event
+    else:
+        fields = tuple(event)
+    try:
+        payload = marshal.dumps((sequence, kind, fields))
+    except ValueError:
+        payload = marshal.dumps((sequence, kind, _plain(fields)))
+    return _header.pack(len(payload)) + payload
+
+
+
+def readEvents(path, offset=0):
+    """
+    Read the events in a log.
+
+    A partly written record at the end of the log (such as one left by a
+    crash) is ignored.
+
+    @param offset: Where in the log to start reading.  It must be the start of
+        a record.
+
+    @return: An iterator of C{(sequence, event)} tuples.  Events of unknown
+        kinds, and actions, come back in their logged (plain) form.
+    """
+    for end, sequence, event in readRecords(path, offset):
+        yield sequence, event
+
+
+
+def readRecords(path, offset=0):
+    """
+    Like L{readEvents}, but also tell where each record ends.
+
+    @return: An iterator of C{(end, sequence, event)} tuples, where C{end} is
+        the offset just after the record.
+    """
+    with open(path, 'rb') as fh:
+        fh.seek(offset)
+        data = fh.read()
+    base = offset
+    offset = 0
+    end = len(data)
+    while offset + _header.size <= end:
+        length, = _header.unpack_from(data, offset)
+        start = offset + _header.size
+        if start + length > end:
+            break
+        try:
+            sequence, kind, fields = marshal.loads(data[start:start + length])
+        except (EOFError, ValueError, TypeError):
+            break
+        offset = start + length
+        if kind == -1:
+            yield base + offset, sequence, fields
+        else:
+            yield base + offset, sequence, event_classes[kind](*fields)
+
+
+
+class EventLog(object):
+    """
+    I append events to a file.
+
+    Records are buffered in memory and written out (and fsync'd) in batches,
+    either when C{buffer_size} bytes have built up or C{sync_interval} seconds
+    after the first unwritten record, whichever comes first.  Nothing more
+    than the encoding of the event happens per event.
+
+    @ivar clock: Provider of C{callLater} used to schedule syncs.
+    """
+
+
+    def __init__(self, path, sync_interval=1.0, buffer_size=65536,
+                 clock=None):
+        """
+        @param path: Path of the log file.  It is appended to if it exists.
+        @param sync_interval: Most seconds a record will stay unwritten.
+        @param buffer_size: Number of bytes to buffer before writing.
+        @param clock: C{clock}, by default the reactor.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.path = path
+        self.sync_interval = sync_interval
+        self.buffer_size = buffer_size
+        self._file = open(path, 'ab')
+        self._file.seek(0, os.SEEK_END)
+        self._buffer = []
+        self._buffered = 0
+        self._sync_call = None
+
+
+    def append(self, sequence, event):
+        """
+        Add an event to the log.
+        """
+        record = encode(sequence, event)
+        self._buffer.append(record)
+        self._buffered += len(record)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+        elif self._sync_call is None:
+            self._sync_call = self.clock.callLater(self.sync_interval,
+                                                   self.sync)
+
+
+    def flush(self):
+        """
+        Write the buffered records to the file, without syncing it.
+        """
+        if not self._buffer:
+            return
+        self._file.write(''.join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+
+
+    def sync(self):
+        """
+        Write the buffered records and make sure they are on disk.
+        """
+        if self._sync_call is not None:
+            if self._sync_call.active():
+                self._sync_call.cancel()
+            self._sync_call = None
+        self.flush()
+        self._file.flush()
+        try:
+            os.fsync(self._file.fileno())
+        except OSError:
+            log.err(None, 'Error syncing event log %r' % (self.path,))
+
+
+    def offset(self):
+        """
+        Sync the log and return its length, which is where the next record
+        will be written.
+        """
+        self.sync()
+        return self._file.tell()
+
+
+    def close(self):
+        """
+        Sync and close the log.
+        """
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
@@ -36,6 +36,13 @@ class IEngine(Interface):
         """
 
 
+    def worldRecovered(world):
+        """
+        The world's state was recovered from a snapshot and event log, without
+        telling me about the events that built it.
+        """
+
+
     def execute(world, action):
         """
         Determine if the action is okay, then do it if it is.  Return the
@@ -53,6 +60,13 @@ class IXatroEngine(Interface):
         """
 
 
+    def worldRecovered(world):
+        """
+        The world's state was recovered from a snapshot and event log, without
+        telling me about the events that built it.
+        """
+
+
     def workRequirement(world, action):
         """
         Return the work required to do an action.
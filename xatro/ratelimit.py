@@ -0,0 +1,182 @@
+from twisted.python import log
+
+from xatro import action
+from xatro.interface import IAction
+from xatro.error import RateLimited
+
+from collections import defaultdict
+from inspect import isclass
+
+
+
+class TokenBucket(object):
+    """
+    I hold up to C{burst} tokens, and gain C{rate} more each second.
+    """
+
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = now
+
+
+    def refill(self, now):
+        """
+        Add the tokens gained since I was last refilled.
+
+        @return: The number of tokens I have.
+        """
+        if now > self.stamp:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+        return self.tokens
+
+
+
+class RateLimiter(object):
+    """
+    I limit how fast bots can do actions, with a token bucket for each kind
+    of action for each bot and for each team.
+
+    Limits are C{(rate, burst)} pairs: an action may be done C{burst} times
+    in a row, and after that C{rate} times a second.
+
+    @ivar rejected: Number of actions refused since L{logRejected} was last
+        called, keyed by C{('bot', action class)} or C{('team', action
+        class)} depending on which limit they went over.
+
+    @ivar clock: Provider of C{seconds} used to refill buckets.
+    """
+
+
+    def __init__(self, bot_limits=None, team_limits=None, bot_default=None,
+                 team_default=None, clock=None):
+        """
+        @param bot_limits: Dictionary of action class to the limit each bot
+            has for it.
+        @param team_limits: Dictionary of action class to the limit each team
+            has for it (shared by the bots on the team).
+        @param bot_default: Limit for each bot for action classes not in
+            C{bot_limits}, or C{None} for no limit.
+        @param team_default: Limit for each team for action classes not in
+            C{team_limits}, or C{None} for no limit.
+        @param clock: C{clock}, by default the reactor.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.bot_limits = bot_limits or {}
+        self.team_limits = team_limits or {}
+        self.bot_default = bot_default
+        self.team_default = team_default
+        self.rejected = defaultdict(int)
+        # bot id -> action class -> bucket
+        self._bot_buckets = {}
+        # team -> action class -> bucket
+        self._team_buckets = {}
+
+
+    def check(self, world, action):
+        """
+        Use up a token for C{action} from its subject's buckets.
+
+        @raise RateLimited: If the subject, or its team, has no tokens left.
+            No tokens are used up in that case.
+        """
+        cls = action.__class__
+        subject = action.subject()
+        now = self.clock.seconds()
+
+        bot_bucket = None
+        limit = self.bot_limits.get(cls, self.bot_default)
+        if limit is not None:
+            bot_bucket = self._bucket(self._bot_buckets, subject, cls, limit,
+                                      now)
+            if bot_bucket.refill(now) < 1:
+                self.rejected[('bot', cls)] += 1
+                raise RateLimited("Too many %s actions" % (cls.__name__,))
+
+        team_bucket = None
+        limit = self.team_limits.get(cls, self.team_default)
+        if limit is not None:
+            team = world.get(subject).get('team')
+            if team is not None:
+                team_bucket = self._bucket(self._team_buckets, team, cls,
+                                           limit, now)
+                if team_bucket.refill(now) < 1:
+                    self.rejected[('team', cls)] += 1
+                    raise RateLimited("Too many %s actions by your team" % (
+                                      cls.__name__,))
+
+        if bot_bucket is not None:
+            bot_bucket.tokens -= 1
+        if team_bucket is not None:
+            team_bucket.tokens -= 1
+
+
+    def _bucket(self, buckets, key, cls, limit, now):
+        by_cls = buckets.get(key)
+        if by_cls is None:
+            by_cls = buckets[key] = {}
+        bucket = by_cls.get(cls)
+        if bucket is None:
+            rate, burst = limit
+            bucket = by_cls[cls] = TokenBucket(rate, burst, now)
+        return bucket
+
+
+    def forget(self, object_id):
+        """
+        Forget the buckets of a bot that's gone.
+        """
+        self._bot_buckets.pop(object_id, None)
+
+
+    def logRejected(self):
+        """
+        Log how many actions have been refused since I was last asked, then
+        start counting again.
+        """
+        if not self.rejected:
+            return
+        counts = sorted((scope, cls.__name__, count)
+                        for (scope, cls), count in self.rejected.items())
+        log.msg('Rate limited: %s' % (', '.join(
+                '%d %s by %s' % (count, name, scope)
+                for scope, name, count in counts),))
+        self.rejected.clear()
+
+
+
+def parseLimits(spec):
+    """
+    Parse a description of limits like C{'Look=5/10,ListSquares=1/2,*=20/40'}
+    (that is, C{name=rate/burst} separated by commas, where C{name} is the
+    name of an action class in L{xatro.action}, or C{*} for the default).
+
+    @return: A tuple of a dictionary of action class to C{(rate, burst)} and
+        the default C{(rate, burst)} (or C{None}).
+
+    @raise ValueError: If a name isn't that of an action class.
+    """
+    limits = {}
+    default = None
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, limit = part.split('=')
+        rate, burst = limit.split('/')
+        limit = (float(rate), int(burst))
+        name = name.strip()
+        if name == '*':
+            default = limit
+        else:
+            cls = getattr(action, name, None)
+            if not (isclass(cls) and IAction.implementedBy(cls)):
+                raise ValueError('Unknown action %r' % (name,))
+            limits[cls] = limit
+    return limits, default
@@ -0,0 +1,162 @@
+from twisted.internet import task
+from twisted.python import log
+
+import marshal
+import os
+
+from xatro.eventlog import readRecords
+
+
+
+def writeSnapshot(world, path):
+    """
+    Write a snapshot of a world to a file, replacing any snapshot already
+    there.
+
+    If the world has an event log, the snapshot records how far into the log
+    the world had got so that L{recover} can skip straight to the events that
+    came after it.
+
+    @param path: Path of the snapshot file.  It is replaced atomically, so a
+        crash while writing leaves the last snapshot intact.
+    """
+    snapshot = world.snapshot()
+    if world.event_log is not None:
+        snapshot['log_offset'] = world.event_log.offset()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fh:
+        marshal.dump(snapshot, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.rename(tmp_path, path)
+
+
+
+def readSnapshot(path):
+    """
+    Read a snapshot written by L{writeSnapshot}.
+
+    @return: The snapshot, or C{None} if there isn't one.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fh:
+        return marshal.load(fh)
+
+
+
+def recover(world, snapshot_path=None, log_path=None):
+    """
+    Rebuild a world's state from its last snapshot and the events logged after
+    it, and the subscriptions between its objects, then tell the world's
+    engine.
+
+    A partly written record at the end of the log (such as one left by a
+    crash) is cut off so that the log can be appended to again.
+
+    @param world: A freshly made L{World}, not yet logging events.
+    @param snapshot_path: Path of the snapshot file, if any.
+    @param log_path: Path of the event log, if any.
+
+    @return: C{True} if there was anything to recover, else C{False}.
+    """
+    recovered = False
+    offset = 0
+    snapshot = snapshot_path and readSnapshot(snapshot_path)
+    if snapshot:
+        world.restore(snapshot)
+        offset = snapshot.get('log_offset', 0)
+        recovered = True
+
+    if log_path and os.path.exists(log_path):
+        if os.path.getsize(log_path) < offset:
+            log.msg('Event log %r is shorter than the snapshot says; '
+                    'replaying it from the start' % (log_path,))
+            offset = 0
+        end = offset
+        for end, sequence, event in readRecords(log_path, offset):
+            if sequence > world.sequence:
+                world.replay(sequence, event)
+                recovered = True
+        if end < os.path.getsize(log_path):
+            log.msg('Truncating partly written event log %r at %d' % (
+                    log_path, end))
+            with open(log_path, 'r+b') as fh:
+                fh.truncate(end)
+
+    if recovered:
+        world.resubscribe()
+        if world.engine:
+            world.engine.worldRecovered(world)
+    return recovered
+
+
+
+def destroyBots(world):
+    """
+    Destroy the bots in a recovered world.
+
+    A bot is controlled by the connection that made it, and no connection
+    survives a restart, so a recovered bot could never be controlled again.
+    Left alone it would keep holding its square for its team.
+
+    Do this once the world is logging events again, so that the next recovery
+    knows the bots are gone.
+    """
+    for bot_id in list(world.byKind('bot')):
+        location = world.get(bot_id).get('location')
+        if location:
+            world.removeItem(location, 'contents', bot_id)
+        world.destroy(bot_id)
+
+
+
+class Snapshotter(object):
+    """
+    I periodically write a snapshot of a world to a file.
+
+    @ivar clock: Provider of C{callLater} used to schedule snapshots.
+    """
+
+
+    def __init__(self, world, path, interval=60.0, clock=None):
+        """
+        @param path: Path of the snapshot file.
+        @param interval: Seconds between snapshots.
+        @param clock: C{clock}, by default the reactor.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.world = world
+        self.path = path
+        self.interval = interval
+        self._loop = None
+
+
+    def start(self):
+        """
+        Start taking snapshots, the first after C{interval} seconds.
+        """
+        self._loop = task.LoopingCall(self.snapshot)
+        self._loop.clock = self.clock
+        self._loop.start(self.interval, now=False)
+
+
+    def stop(self):
+        """
+        Stop taking snapshots, after taking one last one.
+        """
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self.snapshot()
+
+
+    def snapshot(self):
+        """
+        Write a snapshot now.
+        """
+        try:
+            writeSnapshot(self.world, self.path)
+        except Exception:
+            log.err(None, 'Error writing snapshot to %r' % (self.path,))
@@ -1,22 +1,121 @@
+from inspect import getmro, isclass
+from types import MethodType
+
+
+
 class Router(object):
+    """
+    I map classes to the functions which handle instances of them.
+
+    Use me as a class attribute; decorate methods with L{handle} to register
+    them.  A class with no handler of its own is handled by the handler of
+    its nearest base class (in method resolution order).
 
+    Which function handles each class is worked out once and cached.  Each
+    instance of the class I'm an attribute of gets its own bound copy of me
+    (made on first access) which shares my mapping and my cache, so what I've
+    worked out (see L{precompute}) is never worked out again per instance.
+    """
 
-    def __init__(self, mapping=None, instance=None):
-        self._mapping = mapping or {}
+
+    def __init__(self, mapping=None, instance=None, parent=None):
         self._instance = instance
+        self._parent = parent
+        if parent is None:
+            self._mapping = mapping or {}
+            self._cache = {}
+        else:
+            self._mapping = parent._mapping
+            self._cache = parent._cache
+        self._name = None
 
 
     def __get__(self, instance, type=None):
-        return Router(self._mapping, instance)
+        if instance is None:
+            return self
+        bound = Router(instance=instance, parent=self)
+        name = self._attributeName(type or instance.__class__)
+        if name is not None:
+            try:
+                # later lookups won't come through me at all
+                instance.__dict__[name] = bound
+            except AttributeError:
+                pass
+        return bound
+
+
+    def _attributeName(self, cls):
+        if self._name is None:
+            for klass in getmro(cls):
+                for name, value in vars(klass).items():
+                    if value is self:
+                        self._name = name
+                        return name
+        return self._name
+
+
+    def lookup(self, key):
+        """
+        Get the function that handles C{key}.  If I'm bound to an instance,
+        the function is bound to it too.
+
+        @raise KeyError: If nothing handles it.
+        """
+        try:
+            func = self._cache[key]
+        except KeyError:
+            func = self._cache[key] = self._find(key)
+        if func is None:
+            raise KeyError(key)
+        if self._parent is not None:
+            return MethodType(func, self._instance)
+        return func
+
+
+    def _find(self, key):
+        """
+        Find the function that handles C{key}, or C{None}.
+        """
+        if isclass(key):
+            for klass in getmro(key):
+                if klass in self._mapping:
+                    return self._mapping[klass]
+            return None
+        return self._mapping.get(key)
 
 
     def call(self, key, *args, **kwargs):
-        func = self._mapping[key]
+        """
+        Call the function that handles C{key}.
+
+        @raise KeyError: If nothing handles it.
+        """
+        try:
+            func = self._cache[key]
+        except KeyError:
+            func = self._cache[key] = self._find(key)
+        if func is None:
+            raise KeyError(key)
         return func(self._instance, *args, **kwargs)
 
 
     def handle(self, key):
         def deco(f):
             self._mapping[key] = f
+            self._cache.clear()
             return f
-        return deco
\ No newline at end of file
+        return deco
+
+
+    def precompute(self, *keys):
+        """
+        Work out now which functions handle the registered keys and any other
+        C{keys} given (such as subclasses of registered classes), so that
+        lookups on the hot path (including the first from each instance)
+        never have to search.
+        """
+        for key in list(self._mapping) + list(keys):
+            try:
+                self.lookup(key)
+            except KeyError:
+                pass
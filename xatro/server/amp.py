@@ -4,6 +4,7 @@ from twisted.protocols import amp
 import json
 
 from xatro.transformer import DictTransformer
+from xatro.web.observatory import toJson
 from xatro.avatar import Avatar
 from xatro import action
 
@@ -24,6 +25,27 @@ class ReceiveEvent(amp.Command):
     ]
 
 
+
+class ReceiveEvents(amp.Command):
+    """
+    Several events at once.  Each is a JSON string as in L{ReceiveEvent}.
+    """
+
+    arguments = [
+        ('events', amp.ListOf(amp.String())),
+    ]
+
+
+
+class ReceiveEventsNoAnswer(ReceiveEvents):
+    """
+    L{ReceiveEvents} for clients that don't want to answer each box.
+    """
+
+    commandName = 'ReceiveEvents'
+    requiresAnswer = False
+
+
 class WorldCommand(amp.Command):
 
     arguments = [
@@ -39,12 +61,29 @@ class WorldCommand(amp.Command):
 
 
 class AvatarProtocol(amp.AMP):
-
-
-    def __init__(self, world):
+    """
+    @ivar batch_events: If C{True} then events are sent in batches with
+        L{ReceiveEvents}, one batch for all the events that happen during a
+        turn of the reactor.  Otherwise each event is sent with
+        L{ReceiveEvent}.
+    @ivar requires_answer: If C{False} then batches of events are sent
+        without asking for an answer.
+    @ivar clock: Provider of C{callLater} used to schedule batches.
+    """
+
+
+    def __init__(self, world, batch_events=False, requires_answer=True,
+                 clock=None):
         amp.AMP.__init__(self)
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
         self.world = world
         self.transformer = DictTransformer()
+        self.batch_events = batch_events
+        self.requires_answer = requires_answer
+        self._pending_events = []
+        self._flush_call = None
 
         # XXX I feel like this is what AMP was made for :(
         self.commands = {
@@ -80,29 +119,86 @@ class AvatarProtocol(amp.AMP):
         self.callRemote(Identify, id=bot)
 
 
+    def connectionLost(self, reason):
+        if self._flush_call is not None:
+            self._flush_call.cancel()
+            self._flush_call = None
+        amp.AMP.connectionLost(self, reason)
+
+
     def eventReceived(self, event):
-        self.callRemote(ReceiveEvent,
-                        ev=json.dumps(self.transformer.transform(event)))
         # XXX sending json over AMP feels wrong :(
+        ev = json.dumps(self.transformer.transform(event))
+        if not self.batch_events:
+            self.callRemote(ReceiveEvent, ev=ev)
+            return
+        self._pending_events.append(ev)
+        if self._flush_call is None:
+            self._flush_call = self.clock.callLater(0, self.flushEvents)
+
+
+    def flushEvents(self):
+        """
+        Send all the events received since the last flush, in as few boxes
+        as will fit.
+        """
+        self._flush_call = None
+        if self.requires_answer:
+            command = ReceiveEvents
+        else:
+            command = ReceiveEventsNoAnswer
+        for batch in _batches(self._pending_events, amp.MAX_VALUE_LENGTH):
+            self.callRemote(command, events=batch)
+        self._pending_events = []
 
 
     def handleWorldCommand(self, name, args, work=None):
         cls = self.commands[name]
         d = defer.maybeDeferred(self.avatar.execute, cls, *args)
-        d.addCallback(lambda r: {'data': json.dumps(r)})
+        d.addCallback(lambda r: {'data': toJson(r)})
         return d
 
 
 
+def _batches(strings, max_length):
+    """
+    Split a list of strings into lists that will each fit in an
+    L{amp.ListOf} value no longer than C{max_length}.
+    """
+    batch = []
+    length = 0
+    for s in strings:
+        # each string is prefixed with a 2-byte length
+        size = len(s) + 2
+        if batch and length + size > max_length:
+            yield batch
+            batch = []
+            length = 0
+        batch.append(s)
+        length += size
+    if batch:
+        yield batch
+
+
+
 class AvatarFactory(protocol.Factory):
     
     protocol = AvatarProtocol
 
-    def __init__(self, world):
+    def __init__(self, world, batch_events=False, requires_answer=True,
+                 clock=None):
+        """
+        @param clock: The clock for protocols to schedule batches of events
+            with, by default the reactor.
+        """
         self.world = world
+        self.batch_events = batch_events
+        self.requires_answer = requires_answer
+        self.clock = clock
 
 
     def buildProtocol(self, addr):
-        p = self.protocol(self.world)
+        p = self.protocol(self.world, self.batch_events, self.requires_answer,
+                          self.clock)
         p.factory = self
         return p
\ No newline at end of file
@@ -1,10 +1,140 @@
 from twisted.internet import protocol, defer
+from twisted.python import log
+from twisted.internet.interfaces import IPushProducer
 from twisted.protocols.basic import LineOnlyReceiver
 
+from zope.interface import implements
+
 import json
+from collections import OrderedDict
 
 from xatro.transformer import ToStringTransformer
 from xatro.avatar import Avatar
+from xatro.event import AttrSet, AttrDel
+
+
+
+class DeliveryStats(object):
+    """
+    I count how well connections are keeping up with the lines sent to them.
+
+    @ivar throttled: Number of connections currently paused.
+    @ivar pauses: Number of times any connection has been paused.
+    @ivar coalesced: Number of buffered lines replaced by newer ones.
+    @ivar disconnected: Number of connections dropped for falling too far
+        behind.
+    """
+
+    def __init__(self):
+        self.throttled = 0
+        self.pauses = 0
+        self.coalesced = 0
+        self.disconnected = 0
+        self._logged = (0, 0, 0, 0)
+
+
+    def logStats(self, name):
+        """
+        Log my counts, if they've changed since they were last logged.
+
+        @param name: What the connections I count are called in the log.
+        """
+        counts = (self.throttled, self.pauses, self.coalesced,
+                  self.disconnected)
+        if counts == self._logged:
+            return
+        self._logged = counts
+        log.msg('%s: %d throttled now, %d pauses, %d lines coalesced, '
+                '%d disconnected for falling behind' % ((name,) + counts))
+
+
+
+class LineDelivery(object):
+    """
+    I send lines for a L{LineOnlyReceiver}, and am registered as the streaming
+    producer of its transport so that I stop writing when the client isn't
+    keeping up.
+
+    While I'm paused, lines are buffered.  If C{coalesce} is on, a line sent
+    with a key replaces any buffered line with the same key, and is sent after
+    the lines buffered before it (so that it still follows them).  If more than
+    C{high_water} lines are buffered, the connection is dropped.
+    """
+
+    implements(IPushProducer)
+
+
+    def __init__(self, protocol, high_water=1000, coalesce=True, stats=None):
+        self.protocol = protocol
+        self.high_water = high_water
+        self.coalesce = coalesce
+        self.stats = stats or DeliveryStats()
+        self.paused = False
+        self.stopped = False
+        self._pending = OrderedDict()
+        self._sequence = 0
+
+
+    def sendLine(self, line, key=None):
+        """
+        Send a line now, or once the client has caught up.
+
+        @param key: Key identifying what this line is about, such that only
+            the newest line with a given key needs to be sent.
+        """
+        if self.stopped:
+            return
+        if not self.paused and not self._pending:
+            self.protocol.sendLine(line)
+            return
+
+        if key is None or not self.coalesce:
+            self._sequence += 1
+            key = self._sequence
+        elif key in self._pending:
+            self.stats.coalesced += 1
+            del self._pending[key]
+        self._pending[key] = line
+
+        if len(self._pending) > self.high_water:
+            self.stats.disconnected += 1
+            self.stopProducing()
+            self.protocol.transport.abortConnection()
+
+
+    def pauseProducing(self):
+        if not self.paused:
+            self.paused = True
+            self.stats.throttled += 1
+            self.stats.pauses += 1
+
+
+    def resumeProducing(self):
+        if self.paused:
+            self.paused = False
+            self.stats.throttled -= 1
+        while self._pending and not self.paused:
+            key, line = self._pending.popitem(last=False)
+            self.protocol.sendLine(line)
+
+
+    def stopProducing(self):
+        if self.paused:
+            self.paused = False
+            self.stats.throttled -= 1
+        self.stopped = True
+        self._pending.clear()
+
+
+
+def _coalescingKey(event):
+    """
+    Get the key identifying what an event is about, if only the newest such
+    event matters.
+    """
+    if type(event) in (AttrSet, AttrDel):
+        return (event.id, event.name)
+    return None
 
 
 
@@ -14,10 +144,17 @@ class EventFeedLineProtocol(LineOnlyReceiver):
     """
 
     delimiter = '\n'
+    high_water = 1000
+    coalesce = True
+    stats = None
+    delivery = None
 
 
     def connectionMade(self):
         self.factory.connected_protocols.append(self)
+        self.delivery = LineDelivery(self, self.high_water, self.coalesce,
+                                     self.stats)
+        self.transport.registerProducer(self.delivery, True)
 
 
     def connectionLost(self, reason):
@@ -31,7 +168,7 @@ class EventFeedLineProtocol(LineOnlyReceiver):
         """
         XXX
         """
-        self.sendLine(json.dumps(event))
+        self.delivery.sendLine(json.dumps(event), _coalescingKey(event))
 
 
 
@@ -43,8 +180,19 @@ class EventFeedLineFactory(protocol.Factory):
     protocol = EventFeedLineProtocol
 
 
-    def __init__(self):
+    def __init__(self, high_water=1000, coalesce=True):
         self.connected_protocols = []
+        self.high_water = high_water
+        self.coalesce = coalesce
+        self.stats = DeliveryStats()
+
+
+    def buildProtocol(self, addr):
+        proto = protocol.Factory.buildProtocol(self, addr)
+        proto.high_water = self.high_water
+        proto.coalesce = self.coalesce
+        proto.stats = self.stats
+        return proto
 
 
     def eventReceived(self, event):
@@ -61,6 +209,10 @@ class BotLineProtocol(LineOnlyReceiver):
 
     avatar = None
     delimiter = '\r\n'
+    high_water = 1000
+    coalesce = True
+    stats = None
+    delivery = None
 
 
     def __init__(self, avatar):
@@ -69,11 +221,15 @@ class BotLineProtocol(LineOnlyReceiver):
 
 
     def connectionMade(self):
+        self.delivery = LineDelivery(self, self.high_water, self.coalesce,
+                                     self.stats)
+        self.transport.registerProducer(self.delivery, True)
         self.avatar.setEventReceiver(self.eventReceived)
 
 
     def eventReceived(self, event):
-        self.sendLine(self.event_transformer.transform(event))
+        self.delivery.sendLine(self.event_transformer.transform(event),
+                               _coalescingKey(event))
 
 
     def connectionLost(self, reason):
@@ -101,11 +257,11 @@ class BotLineProtocol(LineOnlyReceiver):
 
     def _handleCommandResult(self, result):
         if result:
-            self.sendLine(self.event_transformer.transform(result))
+            self.delivery.sendLine(self.event_transformer.transform(result))
 
 
     def _handleCommandFailure(self, err):
-        self.sendLine(str(err.value))
+        self.delivery.sendLine(str(err.value))
 
 
 
@@ -117,9 +273,18 @@ class BotFactory(protocol.Factory):
     protocol = BotLineProtocol
 
 
-    def __init__(self, world, commands=None):
+    def __init__(self, world, commands=None, high_water=1000, coalesce=True):
+        """
+        @param high_water: Most lines to buffer for a client that isn't
+            keeping up before disconnecting it.
+        @param coalesce: If C{True} then while a client isn't keeping up, only
+            the newest value of each attribute is sent to it.
+        """
         self.world = world
         self.commands = commands
+        self.high_water = high_water
+        self.coalesce = coalesce
+        self.stats = DeliveryStats()
 
 
     def buildProtocol(self, addr):
@@ -130,6 +295,9 @@ class BotFactory(protocol.Factory):
 
         proto = self.protocol(avatar)
         proto.factory = self
+        proto.high_water = self.high_water
+        proto.coalesce = self.coalesce
+        proto.stats = self.stats
         return proto
 
 
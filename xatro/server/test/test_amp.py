@@ -1,5 +1,9 @@
 from twisted.trial.unittest import TestCase
-from twisted.internet import defer
+from twisted.internet import defer, task
+from twisted.internet.error import ConnectionDone
+from twisted.protocols import amp
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
 
 from mock import create_autospec, MagicMock
 
@@ -10,7 +14,8 @@ from xatro.event import AttrSet
 from xatro.world import World
 from xatro.avatar import Avatar
 from xatro.server.amp import AvatarProtocol, AvatarFactory, Identify
-from xatro.server.amp import ReceiveEvent
+from xatro.server.amp import ReceiveEvent, ReceiveEvents
+from xatro.server.amp import ReceiveEventsNoAnswer
 
 
 
@@ -34,6 +39,21 @@ class AvatarFactoryTest(TestCase):
         self.assertEqual(p.factory, f)
         self.assertEqual(p.world, 'world')
         self.assertTrue(isinstance(p, AvatarProtocol))
+        self.assertEqual(p.batch_events, False)
+        self.assertEqual(p.requires_answer, True)
+
+
+    def test_buildProtocol_batching(self):
+        """
+        Should pass on event batching options to the protocol.
+        """
+        clock = task.Clock()
+        f = AvatarFactory('world', batch_events=True, requires_answer=False,
+                          clock=clock)
+        p = f.buildProtocol(None)
+        self.assertEqual(p.batch_events, True)
+        self.assertEqual(p.requires_answer, False)
+        self.assertIdentical(p.clock, clock)
 
 
 
@@ -86,4 +106,74 @@ class AvatarProtocolTest(TestCase):
         self.assertEqual(r, {'data': json.dumps({"hey":"ho"})})
 
 
+    def batchingProtocol(self, **kwargs):
+        world = World(MagicMock())
+        p = AvatarProtocol(world, batch_events=True, clock=task.Clock(),
+                           **kwargs)
+        p.callRemote = create_autospec(p.callRemote)
+        p.makeConnection(StringTransport())
+        p.callRemote.reset_mock()
+        return p
+
+
+    def test_eventReceived_batched(self):
+        """
+        When batching, all the events received during a turn of the reactor
+        are sent in one ReceiveEvents box.
+        """
+        p = self.batchingProtocol()
+        ev1 = AttrSet('id', 'name', 'val')
+        ev2 = AttrSet('id', 'name', 'val2')
+        p.eventReceived(ev1)
+        p.eventReceived(ev2)
+        self.assertEqual(p.callRemote.call_count, 0)
+
+        p.clock.advance(0)
+        transformer = DictTransformer()
+        p.callRemote.assert_called_once_with(ReceiveEvents, events=[
+            json.dumps(transformer.transform(ev1)),
+            json.dumps(transformer.transform(ev2)),
+        ])
+
+        # nothing more until there are more events
+        p.callRemote.reset_mock()
+        p.clock.advance(1)
+        self.assertEqual(p.callRemote.call_count, 0)
+
+
+    def test_eventReceived_batchedNoAnswer(self):
+        """
+        Batches can be sent without requiring an answer.
+        """
+        p = self.batchingProtocol(requires_answer=False)
+        p.eventReceived(AttrSet('id', 'name', 'val'))
+        p.clock.advance(0)
+        self.assertEqual(p.callRemote.call_args[0][0], ReceiveEventsNoAnswer)
+        self.assertEqual(ReceiveEventsNoAnswer.commandName,
+                         ReceiveEvents.commandName)
+        self.assertEqual(ReceiveEventsNoAnswer.requiresAnswer, False)
+
 
+    def test_eventReceived_batchSize(self):
+        """
+        Batches too big for one AMP value are split into several boxes.
+        """
+        p = self.batchingProtocol()
+        for i in xrange(4):
+            p.eventReceived(AttrSet('id', 'name', 'x' * 20000))
+        p.clock.advance(0)
+        self.assertEqual(p.callRemote.call_count, 2)
+        for call in p.callRemote.call_args_list:
+            events = call[1]['events']
+            encoded = amp.ListOf(amp.String()).toString(events)
+            self.assertTrue(len(encoded) <= amp.MAX_VALUE_LENGTH)
+
+
+    def test_connectionLost_batched(self):
+        """
+        Pending events aren't sent after the connection is lost.
+        """
+        p = self.batchingProtocol()
+        p.eventReceived(AttrSet('id', 'name', 'val'))
+        p.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(p.clock.getDelayedCalls(), [])
@@ -1,16 +1,18 @@
 from twisted.trial.unittest import TestCase
 from twisted.test.proto_helpers import StringTransport
 from twisted.internet import defer
+from twisted.python import log
 
 from mock import MagicMock, create_autospec
 import json
 
 from xatro.server.lineproto import EventFeedLineFactory, EventFeedLineProtocol
 from xatro.server.lineproto import BotFactory, BotLineProtocol
+from xatro.server.lineproto import LineDelivery, DeliveryStats
 
 from xatro.world import World
 from xatro.avatar import Avatar
-from xatro.event import AttrSet
+from xatro.event import AttrSet, AttrDel
 from xatro.action import Move
 from xatro.transformer import ToStringTransformer
 
@@ -81,6 +83,205 @@ class EventFeedLineProtocolTest(TestCase):
         self.assertEqual(t.value(), json.dumps(['hey', 'ho']) + '\n')
 
 
+    def test_producer(self):
+        """
+        The protocol should register a streaming L{LineDelivery} as the
+        producer of its transport, configured by its factory.
+        """
+        f = EventFeedLineFactory(high_water=5, coalesce=False)
+        p = f.buildProtocol(None)
+        t = StringTransport()
+        p.makeConnection(t)
+
+        self.assertTrue(isinstance(t.producer, LineDelivery))
+        self.assertTrue(t.streaming)
+        self.assertEqual(t.producer.high_water, 5)
+        self.assertEqual(t.producer.coalesce, False)
+        self.assertIdentical(t.producer.stats, f.stats)
+
+
+
+
+class LineDeliveryTest(TestCase):
+
+
+    def deliver(self, **kwargs):
+        proto = EventFeedLineProtocol()
+        proto.transport = StringTransport()
+        return proto, LineDelivery(proto, **kwargs)
+
+
+    def test_unpaused(self):
+        """
+        Lines are sent immediately when not paused.
+        """
+        proto, d = self.deliver()
+        d.sendLine('foo')
+        self.assertEqual(proto.transport.value(), 'foo\n')
+
+
+    def test_paused(self):
+        """
+        Lines sent while paused are buffered until resumed, and are then sent
+        in order.
+        """
+        stats = DeliveryStats()
+        proto, d = self.deliver(stats=stats)
+        d.pauseProducing()
+        self.assertEqual(stats.throttled, 1)
+        self.assertEqual(stats.pauses, 1)
+
+        d.sendLine('foo')
+        d.sendLine('bar')
+        self.assertEqual(proto.transport.value(), '')
+
+        d.resumeProducing()
+        self.assertEqual(proto.transport.value(), 'foo\nbar\n')
+        self.assertEqual(stats.throttled, 0)
+        self.assertEqual(stats.pauses, 1)
+
+
+    def test_pauseTwice(self):
+        """
+        Pausing an already paused connection doesn't count it twice.
+        """
+        stats = DeliveryStats()
+        proto, d = self.deliver(stats=stats)
+        d.pauseProducing()
+        d.pauseProducing()
+        self.assertEqual(stats.throttled, 1)
+        d.resumeProducing()
+        d.resumeProducing()
+        self.assertEqual(stats.throttled, 0)
+
+
+    def test_pausedDuringResume(self):
+        """
+        If the transport pauses again while the buffer is being flushed, the
+        rest of the buffer waits for the next resume.
+        """
+        proto, d = self.deliver()
+        written = []
+        def sendLine(line):
+            written.append(line)
+            d.pauseProducing()
+        proto.sendLine = sendLine
+
+        d.pauseProducing()
+        d.sendLine('foo')
+        d.sendLine('bar')
+        d.resumeProducing()
+        self.assertEqual(written, ['foo'])
+        d.resumeProducing()
+        self.assertEqual(written, ['foo', 'bar'])
+
+
+    def test_orderKeptAfterResume(self):
+        """
+        Lines aren't sent ahead of ones still buffered.
+        """
+        proto, d = self.deliver()
+        sent = []
+        proto.sendLine = sent.append
+        d._pending['x'] = 'old'
+        d.sendLine('new')
+        self.assertEqual(sent, [])
+        d.resumeProducing()
+        self.assertEqual(sent, ['old', 'new'])
+
+
+    def test_coalesce(self):
+        """
+        While paused, a line with the same key as a buffered line replaces
+        it, and is sent after the lines buffered in between.
+        """
+        stats = DeliveryStats()
+        proto, d = self.deliver(stats=stats)
+        d.pauseProducing()
+        d.sendLine('hp 10', ('a', 'hp'))
+        d.sendLine('other')
+        d.sendLine('hp 9', ('a', 'hp'))
+        d.sendLine('hp 1', ('b', 'hp'))
+        d.resumeProducing()
+        self.assertEqual(proto.transport.value(), 'other\nhp 9\nhp 1\n')
+        self.assertEqual(stats.coalesced, 1)
+
+
+    def test_noCoalesce(self):
+        """
+        If coalescing is off, keyed lines are all sent.
+        """
+        proto, d = self.deliver(coalesce=False)
+        d.pauseProducing()
+        d.sendLine('hp 10', ('a', 'hp'))
+        d.sendLine('hp 9', ('a', 'hp'))
+        d.resumeProducing()
+        self.assertEqual(proto.transport.value(), 'hp 10\nhp 9\n')
+
+
+    def test_highWater(self):
+        """
+        If more than C{high_water} lines are buffered, the connection is
+        aborted and nothing more is sent.
+        """
+        stats = DeliveryStats()
+        proto, d = self.deliver(high_water=2, stats=stats)
+        proto.transport.abortConnection = MagicMock()
+        d.pauseProducing()
+        d.sendLine('a')
+        d.sendLine('b')
+        self.assertEqual(proto.transport.abortConnection.call_count, 0)
+        d.sendLine('c')
+        proto.transport.abortConnection.assert_called_once_with()
+        self.assertEqual(stats.disconnected, 1)
+        self.assertEqual(stats.throttled, 0)
+
+        d.resumeProducing()
+        d.sendLine('d')
+        self.assertEqual(proto.transport.value(), '')
+
+
+    def test_stopProducing(self):
+        """
+        Once stopped, buffered lines are discarded and nothing more is sent.
+        """
+        stats = DeliveryStats()
+        proto, d = self.deliver(stats=stats)
+        d.pauseProducing()
+        d.sendLine('a')
+        d.stopProducing()
+        self.assertEqual(stats.throttled, 0)
+        d.sendLine('b')
+        self.assertEqual(proto.transport.value(), '')
+
+
+
+
+class DeliveryStatsTest(TestCase):
+
+
+    def test_logStats(self):
+        """
+        The counts are logged when they've changed since they were last
+        logged.
+        """
+        messages = []
+        log.addObserver(messages.append)
+        self.addCleanup(log.removeObserver, messages.append)
+
+        stats = DeliveryStats()
+        stats.logStats('Bots')
+        self.assertEqual(messages, [])
+
+        stats.throttled = 1
+        stats.pauses = 2
+        stats.coalesced = 3
+        stats.logStats('Bots')
+        stats.logStats('Bots')
+        self.assertEqual([m['message'] for m in messages],
+                         [('Bots: 1 throttled now, 2 pauses, 3 lines '
+                           'coalesced, 0 disconnected for falling behind',)])
+
 
 
 class BotFactoryTest(TestCase):
@@ -96,6 +297,9 @@ class BotFactoryTest(TestCase):
         """
         f = BotFactory('world')
         self.assertEqual(f.world, 'world')
+        self.assertEqual(f.high_water, 1000)
+        self.assertEqual(f.coalesce, True)
+        self.assertTrue(isinstance(f.stats, DeliveryStats))
 
 
     def test_buildProtocol(self):
@@ -117,6 +321,8 @@ class BotFactoryTest(TestCase):
         self.assertEqual(proto.avatar.availableCommands(), {'foo': 'bar'})
         obj = world.get(proto.avatar._game_piece)
         self.assertEqual(obj['kind'], 'bot', "Should make a bot in the world")
+        self.assertIdentical(proto.stats, f.stats, "Should share the "
+                             "factory's delivery stats")
 
         self.assertTrue(isinstance(proto.event_transformer,
                         ToStringTransformer))
@@ -157,6 +363,70 @@ class BotLineProtocolTest(TestCase):
         self.assertEqual(proto.transport.value(), 'transformed\r\n')
 
 
+    def test_eventReceivedCoalesced(self):
+        """
+        While the client is behind, only the newest value of each attribute
+        is sent to it.
+        """
+        avatar = Avatar()
+        proto = BotLineProtocol(avatar)
+        proto.event_transformer = MagicMock()
+        proto.event_transformer.transform = lambda ev: '%s %s' % (ev.name,
+                                                                   ev.value)
+        t = StringTransport()
+        proto.makeConnection(t)
+
+        t.producer.pauseProducing()
+        proto.eventReceived(AttrSet('bot', 'hp', 10))
+        proto.eventReceived(AttrSet('bot', 'energy', 1))
+        proto.eventReceived(AttrSet('bot', 'hp', 9))
+        self.assertEqual(t.value(), '')
+
+        t.producer.resumeProducing()
+        self.assertEqual(t.value(), 'energy 1\r\nhp 9\r\n')
+
+
+    def test_eventReceivedSetDelSet(self):
+        """
+        While the client is behind, an attribute that is set, deleted and set
+        again ends up set.
+        """
+        avatar = Avatar()
+        proto = BotLineProtocol(avatar)
+        t = StringTransport()
+        proto.makeConnection(t)
+
+        t.producer.pauseProducing()
+        proto.eventReceived(AttrSet('bot', 'tool', 'cannon'))
+        proto.eventReceived(AttrDel('bot', 'tool'))
+        proto.eventReceived(AttrSet('bot', 'tool', 'wrench'))
+        t.producer.resumeProducing()
+        self.assertEqual(t.value(), proto.event_transformer.transform(
+            AttrSet('bot', 'tool', 'wrench')) + '\r\n')
+
+
+    def test_eventReceivedSetDel(self):
+        """
+        While the client is behind, an attribute that is set and then deleted
+        ends up deleted.
+        """
+        avatar = Avatar()
+        proto = BotLineProtocol(avatar)
+        t = StringTransport()
+        proto.makeConnection(t)
+
+        t.producer.pauseProducing()
+        proto.eventReceived(AttrSet('bot', 'tool', 'cannon'))
+        proto.eventReceived(AttrSet('bot', 'hp', 10))
+        proto.eventReceived(AttrDel('bot', 'tool'))
+        t.producer.resumeProducing()
+        transform = proto.event_transformer.transform
+        self.assertEqual(t.value(), ''.join([
+            transform(AttrSet('bot', 'hp', 10)) + '\r\n',
+            transform(AttrDel('bot', 'tool')) + '\r\n',
+        ]))
+
+
     def test_connectionLost(self):
         """
         When the connection is lost, the avatar should quit.
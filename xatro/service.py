@@ -1,5 +1,5 @@
 from twisted.application import service, internet
-from twisted.internet import endpoints
+from twisted.internet import endpoints, task
 from twisted.python import usage
 from twisted.python.filepath import FilePath
 
@@ -7,11 +7,18 @@ from twisted.web.server import Site
 
 from xatro.world import World
 from xatro import action
-from xatro.auth import FileStoredPasswords
+from xatro.auth import FileStoredPasswords, HashingPool
 from xatro.server.lineproto import BotFactory
 from xatro.server import amp
 from xatro.engine import XatroEngine
+from xatro.work import BatchVerifier
 from xatro.web.observatory import GameObserver
+from xatro.trace import EventTracer, parseLevel, parseSample
+from xatro.eventlog import EventLog
+from xatro.recovery import recover, destroyBots, Snapshotter
+from xatro.ratelimit import RateLimiter, parseLimits
+
+import signal
 
 
 class Options(usage.Options):
@@ -19,6 +26,18 @@ class Options(usage.Options):
     
     """
     
+    optFlags = [
+        ('compact-state', None,
+         "Store world objects compactly (uses less memory)"),
+        ('amp-batch-events', None,
+         "Send events to AMP clients in batches (ReceiveEvents)"),
+        ('amp-no-answer', None,
+         "Don't ask AMP clients to answer batches of events"),
+        ('web-share-state', None,
+         "Have the web observer read the world's state instead of keeping "
+         "its own copy"),
+    ]
+
     optParameters = [
         ("line-proto-endpoint", "l", "tcp:7601",
          "string endpoint description to listen for line receiving protocol"),
@@ -33,6 +52,60 @@ class Options(usage.Options):
 
         ('password-file', 'p', '.xatro.passwords',
          "File to store team passwords in"),
+        ('auth-threads', None, 4,
+         "Threads to hash team passwords in", int),
+        ('auth-queue', None, 100,
+         "Most team passwords waiting to be hashed before more are refused",
+         int),
+        ('auth-cache-ttl', None, 30.0,
+         "Seconds to remember that a team password was correct", float),
+
+        ('line-high-water', None, 1000,
+         "Most lines to buffer for a slow line-protocol client before "
+         "disconnecting it", int),
+
+        ('web-snapshot-every', None, 100,
+         "Rebuild the state snapshot sent to new web observers at most once "
+         "per this many events", int),
+        ('web-event-log', None, 1000,
+         "Number of recent events to keep for web observers that reconnect",
+         int),
+
+        ('event-log', None, None,
+         "File to append every world event to"),
+        ('event-log-sync', None, 1.0,
+         "Most seconds an event stays unwritten to the event log", float),
+        ('snapshot', None, None,
+         "File to keep a snapshot of the world in (default: the event log's "
+         "path plus .snapshot).  On startup the world is recovered from it "
+         "and the event log"),
+        ('snapshot-every', None, 60.0,
+         "Seconds between snapshots of the world", float),
+
+        ('trace-level', None, 'off',
+         "Which world events to log: off, actions or events", parseLevel),
+        ('trace-sample', None, 1,
+         "Only log 1 out of every N traced events", parseSample),
+        ('trace-keep', None, 0,
+         "Remember the last N events and log them on SIGUSR1", int),
+
+        ('work-verify', None, 'inline',
+         "How to verify solutions to work: inline, batch (in batches on "
+         "later reactor turns) or thread (in batches in a thread pool)"),
+        ('work-verify-batch', None, 100,
+         "Most work solutions to verify in one batch", int),
+
+        ('bot-rate-limit', None, None,
+         "Limits on how fast each bot can do actions, as "
+         "Action=rate/burst,... (e.g. Look=5/10,*=20/40 where * is for all "
+         "other actions)", parseLimits),
+        ('team-rate-limit', None, None,
+         "Limits on how fast each team can do actions, like "
+         "--bot-rate-limit", parseLimits),
+
+        ('stats-every', None, 60.0,
+         "Seconds between logging how many actions were rate limited and "
+         "how many line-protocol clients are falling behind", float),
     ]
 
 
@@ -72,25 +145,82 @@ def makeService(options):
     rules.isAllowed.return_value = None
 
     engine = XatroEngine(rules)
+    if options['work-verify'] in ('batch', 'thread'):
+        threadpool = None
+        if options['work-verify'] == 'thread':
+            threadpool = reactor.getThreadPool()
+        engine.verifier = BatchVerifier(engine.work_maker,
+                                        options['work-verify-batch'],
+                                        threadpool)
     
     # web
-    web_app = GameObserver(FilePath(options['web-static-path']))
+    web_app = GameObserver(FilePath(options['web-static-path']),
+                           options['web-snapshot-every'],
+                           options['web-event-log'])
     site = Site(web_app.app.resource())
     endpoint = endpoints.serverFromString(reactor, options['web-endpoint'])
     web_service = internet.StreamServerEndpointService(endpoint, site)
     web_service.setName('Web Observer Service')
 
     # passwords
-    auth = FileStoredPasswords(options['password-file'])
+    hashing = HashingPool(options['auth-threads'], options['auth-queue'])
+    auth = FileStoredPasswords(options['password-file'], hashing,
+                               options['auth-cache-ttl'])
+
+    # event tracing
+    tracer = EventTracer(options['trace-level'], options['trace-sample'],
+                         options['trace-keep'])
+    if options['trace-keep']:
+        signal.signal(signal.SIGUSR1,
+                      lambda *args: reactor.callFromThread(tracer.dump))
+
+    # rate limits
+    rate_limiter = None
+    if options['bot-rate-limit'] or options['team-rate-limit']:
+        bot_limits, bot_default = options['bot-rate-limit'] or ({}, None)
+        team_limits, team_default = options['team-rate-limit'] or ({}, None)
+        rate_limiter = RateLimiter(bot_limits, team_limits, bot_default,
+                                   team_default)
+        task.LoopingCall(rate_limiter.logRejected).start(
+            options['stats-every'], now=False)
 
     # world
-    world = World(web_app.eventReceived, engine, auth)
+    world = World(web_app.eventReceived, engine, auth, tracer,
+                  compact=options['compact-state'],
+                  rate_limiter=rate_limiter)
+    web_app.numberBy(world)
+
+    # recovery and event log
+    recovered = False
+    if options['event-log']:
+        snapshot_path = (options['snapshot'] or
+                         options['event-log'] + '.snapshot')
+        recovered = recover(world, snapshot_path, options['event-log'])
+        event_log = EventLog(options['event-log'], options['event-log-sync'])
+        world.event_log = event_log
+        snapshotter = Snapshotter(world, snapshot_path,
+                                  options['snapshot-every'])
+        snapshotter.start()
+        def shutdown():
+            snapshotter.stop()
+            event_log.close()
+        reactor.addSystemEventTrigger('before', 'shutdown', shutdown)
+
+    if options['web-share-state'] or recovered:
+        # the web observer didn't see the events that built a recovered world
+        web_app.shareState(world.objects)
+
+    if recovered:
+        # nobody is left to control the bots
+        destroyBots(world)
 
     # make the board
-    makeBoard(world, options)
+    if not recovered:
+        makeBoard(world, options)
 
     # AMP
-    f = amp.AvatarFactory(world)
+    f = amp.AvatarFactory(world, options['amp-batch-events'],
+                          not options['amp-no-answer'], reactor)
     endpoint = endpoints.serverFromString(reactor, options['amp-proto-endpoint'])
     amp_service = internet.StreamServerEndpointService(endpoint, f)
     amp_service.setName('AMP Bot Service')
@@ -111,7 +241,9 @@ def makeService(options):
         'squares': action.ListSquares,
         'createteam': action.CreateTeam,
         'jointeam': action.JoinTeam,
-    })
+    }, high_water=options['line-high-water'])
+    task.LoopingCall(f.stats.logStats, 'Line-protocol clients').start(
+        options['stats-every'], now=False)
     endpoint = endpoints.serverFromString(reactor, options['line-proto-endpoint'])
     line_service = internet.StreamServerEndpointService(endpoint, f)
     line_service.setName('Line-protocol Bot Service')
@@ -7,81 +7,119 @@ from xatro.router import Router
 from xatro import action as act
 from xatro.event import ActionPerformed, Destroyed, AttrSet
 
+from twisted.python import log
+
 from collections import defaultdict
 from functools import wraps
+import traceback
 
 
 
-def requireSameSquare(*attrs):
+def _compileRule(body, requirements):
+    """
+    Make a single function which checks all the C{requirements} of a rule
+    (in order) and then calls the rule's C{body}.
+
+    Each requirement is a function taking the world, the action and a dict of
+    the objects fetched so far (by id), which raises L{NotAllowed} if the
+    action doesn't meet it.  Requirements add what they fetch to the dict, so
+    that each object is only gotten from the world once.
+    """
+    requirements = tuple(requirements)
+    @wraps(body)
+    def rule(instance, world, action, fetched=None):
+        if fetched is None:
+            fetched = {}
+        for check in requirements:
+            check(world, action, fetched)
+        return body(instance, world, action)
+    rule.body = body
+    rule.requirements = requirements
+    return rule
+
+
+def _requirement(check):
+    """
+    Make a decorator which adds a requirement to a rule.
+
+    Requirements are checked in the order the decorators are listed.  However
+    many are stacked, the result is one function (see L{_compileRule}).
+    """
     def deco(func):
-        @wraps(func)
-        def wrapper(instance, world, action):
-            locations = set()
-            for attr in attrs:
-                obj = world.get(getattr(action, attr))
-                locations.add(obj.get('location', None))
-            if len(locations) != 1:
-                raise NotAllowed("Must be in the same place")
-            return func(instance, world, action)
-        return wrapper
+        body = getattr(func, 'body', func)
+        requirements = getattr(func, 'requirements', ())
+        return _compileRule(body, (check,) + requirements)
     return deco
 
 
-def requireSquare(func):
-    @wraps(func)
-    def wrapper(instance, world, action):
-        obj = world.get(action.subject())
-        if obj.get('location') is None:
-            raise NotAllowed("You must be on the board")
-        return func(instance, world, action)
-    return wrapper
+def requireSameSquare(*attrs):
+    def check(world, action, fetched):
+        locations = set()
+        for attr in attrs:
+            object_id = getattr(action, attr)
+            obj = fetched.get(object_id)
+            if obj is None:
+                obj = fetched[object_id] = world.get(object_id)
+            locations.add(obj.get('location', None))
+        if len(locations) != 1:
+            raise NotAllowed("Must be in the same place")
+    return _requirement(check)
+
+
+def _checkSquare(world, action, fetched):
+    object_id = action.subject()
+    obj = fetched.get(object_id)
+    if obj is None:
+        obj = fetched[object_id] = world.get(object_id)
+    if obj.get('location') is None:
+        raise NotAllowed("You must be on the board")
+
+requireSquare = _requirement(_checkSquare)
 
 
-def requireOnDeck(func):
-    @wraps(func)
-    def wrapper(instance, world, action):
-        obj = world.get(action.subject())
-        if obj.get('location') is not None:
-            raise NotAllowed("You can only do this on deck")
-        return func(instance, world, action)
-    return wrapper
+def _checkOnDeck(world, action, fetched):
+    object_id = action.subject()
+    obj = fetched.get(object_id)
+    if obj is None:
+        obj = fetched[object_id] = world.get(object_id)
+    if obj.get('location') is not None:
+        raise NotAllowed("You can only do this on deck")
+
+requireOnDeck = _requirement(_checkOnDeck)
 
 
 def requireTool(tool):
-    def deco(func):
-        @wraps(func)
-        def wrapper(instance, world, action):
-            obj = world.get(action.subject())
-            if obj.get('tool') != tool:
-                raise NotAllowed("You must have a %s equipped" % (tool,))
-            return func(instance, world, action)
-        return wrapper
-    return deco
+    def check(world, action, fetched):
+        object_id = action.subject()
+        obj = fetched.get(object_id)
+        if obj is None:
+            obj = fetched[object_id] = world.get(object_id)
+        if obj.get('tool') != tool:
+            raise NotAllowed("You must have a %s equipped" % (tool,))
+    return _requirement(check)
 
 
 def requireVulnerable(target_attr):
-    def deco(func):
-        @wraps(func)
-        def wrapper(instance, world, action):
-            obj = world.get(getattr(action, target_attr))
-            if not obj.get('hp'):
-                raise NotAllowed("The target isn't a vulnerable thing")
-            return func(instance, world, action)
-        return wrapper
-    return deco
+    def check(world, action, fetched):
+        object_id = getattr(action, target_attr)
+        obj = fetched.get(object_id)
+        if obj is None:
+            obj = fetched[object_id] = world.get(object_id)
+        if not obj.get('hp'):
+            raise NotAllowed("The target isn't a vulnerable thing")
+    return _requirement(check)
 
 
 def requireKind(attr_name, required_kind):
-    def deco(func):
-        @wraps(func)
-        def wrapper(instance, world, action):
-            obj = world.get(getattr(action, attr_name))
-            if obj.get('kind') != required_kind:
-                raise NotAllowed("You can't do that with a %s" % (
-                                 obj.get('kind'),))
-            return func(instance, world, action)
-        return wrapper
-    return deco    
+    def check(world, action, fetched):
+        object_id = getattr(action, attr_name)
+        obj = fetched.get(object_id)
+        if obj is None:
+            obj = fetched[object_id] = world.get(object_id)
+        if obj.get('kind') != required_kind:
+            raise NotAllowed("You can't do that with a %s" % (
+                             obj.get('kind'),))
+    return _requirement(check)
 
 
 
@@ -123,10 +161,20 @@ class StandardRules(object):
     isAllowedRouter = Router()
 
 
-    def __init__(self):
+    def __init__(self, work_scheduler=None):
+        """
+        @param work_scheduler: An L{xatro.work.AdaptiveWorkScheduler} which
+            decides the work bots must do for each action, or C{None} if no
+            work is required.
+        """
+        self.work_scheduler = work_scheduler
         self.bot_teams = {}
         self.bots_per_team_on_squares = defaultdict(lambda: set())
-        self._pylons = {}
+        self.pylon_teams = {}
+        self.pylons_per_team = {}
+        self._win_condition_subscribers = []
+        # action class -> rule (see _ruleFor)
+        self._rules = {}
 
 
     def worldEventReceived(self, world, event):
@@ -136,8 +184,95 @@ class StandardRules(object):
             pass
 
 
+    def worldRecovered(self, world):
+        """
+        Rebuild what I know about the game from the state of the world.
+        """
+        self.bot_teams = {}
+        self.bots_per_team_on_squares = defaultdict(lambda: set())
+        for bot_id in world.byKind('bot'):
+            bot = world.get(bot_id)
+            if 'team' in bot:
+                self.bot_teams[bot_id] = bot['team']
+            if bot.get('location') is not None:
+                self.bots_per_team_on_squares[bot.get('team')].add(bot_id)
+        self.pylon_teams = {}
+        self.pylons_per_team = {}
+        self.winner = None
+        for pylon_id in world.byKind('pylon'):
+            self._setPylonTeam(pylon_id, world.get(pylon_id).get('team'))
+        for team in self.pylons_per_team.keys():
+            self._checkForWinner(team)
+        self._winConditionChanged()
+
+
+    def subscribeToWinCondition(self, callback):
+        """
+        Call C{callback} whenever a pylon changes hands (or is added or
+        removed), with a dict of team to the number of pylons it owns (C{None}
+        for unowned pylons) and the winner (or C{None}).
+        """
+        self._win_condition_subscribers.append(callback)
+
+
+    def unsubscribeFromWinCondition(self, callback):
+        """
+        Stop calling a function given to L{subscribeToWinCondition}.
+        """
+        self._win_condition_subscribers.remove(callback)
+
+
+    def _setPylonTeam(self, pylon_id, team):
+        """
+        Record who owns a pylon.
+
+        @return: C{True} if that changed anything, else C{False}.
+        """
+        if pylon_id in self.pylon_teams:
+            old_team = self.pylon_teams[pylon_id]
+            if old_team == team:
+                return False
+            self._countPylon(old_team, -1)
+        self.pylon_teams[pylon_id] = team
+        self._countPylon(team, 1)
+        return True
+
+
+    def _removePylon(self, pylon_id):
+        self._countPylon(self.pylon_teams.pop(pylon_id), -1)
+
+
+    def _checkForWinner(self, team):
+        """
+        Declare C{team} the winner if it owns all the pylons.
+        """
+        if (team is not None and
+                self.pylons_per_team.get(team) == len(self.pylon_teams)):
+            # we have a winner
+            self.winner = team
+
+
+    def _countPylon(self, team, change):
+        count = self.pylons_per_team.get(team, 0) + change
+        if count:
+            self.pylons_per_team[team] = count
+        else:
+            del self.pylons_per_team[team]
+
+
+    def _winConditionChanged(self):
+        for callback in list(self._win_condition_subscribers):
+            try:
+                callback(dict(self.pylons_per_team), self.winner)
+            except:
+                log.msg('Error in win condition subscriber %r' % (callback,))
+                log.msg(traceback.format_exc())
+
+
     @ev_router.handle(ActionPerformed)
     def _whenActionPerformed(self, world, event):
+        if self.work_scheduler is not None:
+            self.work_scheduler.actionDone(event.action.subject())
         try:
             return self.act_router.call(event.action.__class__, world,
                                         event.action)
@@ -168,26 +303,27 @@ class StandardRules(object):
                 # ore just became lifesource
                 world.setAttr(event.id, 'hp', self.lifesource_starting_hp)
         elif obj['kind'] == 'pylon':
-            if event.name == 'kind':
-                # pylon created
-                self._pylons[obj['id']] = None
-            elif event.name == 'team':
-                # pylon was captured
-                self._pylons[obj['id']] = event.value
-
-            teams = set(self._pylons.values())
-            if len(teams) == 1 and teams != set([None]):
-                # we have a winner
-                self.winner = list(teams)[0]
+            if event.name in ('team', 'kind'):
+                team = obj.get('team')
+                if self._setPylonTeam(event.id, team):
+                    self._checkForWinner(team)
+                    self._winConditionChanged()
 
 
 
     @ev_router.handle(Destroyed)
     def _whenDestroyed(self, world, event):
+        if self.work_scheduler is not None:
+            self.work_scheduler.forget(event.id)
         if event.id in self.bot_teams:
             # indicate that this bot is no longer on the board
             team = self.bot_teams.pop(event.id)
             self.bots_per_team_on_squares[team].remove(event.id)
+        elif event.id in self.pylon_teams:
+            self._removePylon(event.id)
+            if len(self.pylons_per_team) == 1:
+                self._checkForWinner(self.pylons_per_team.keys()[0])
+            self._winConditionChanged()
 
 
     @act_router.handle(act.BreakLock)
@@ -203,17 +339,47 @@ class StandardRules(object):
     def isAllowed(self, world, action):
         if self.winner:
             raise NotAllowed("Game over.  Team %s won" % (self.winner,))
-        obj = world.get(action.subject())
+        subject_id = action.subject()
+        obj = world.get(subject_id)
         kind = obj.get('kind', None)
         if kind != 'bot':
             raise NotAllowed("Only bots can do that")
 
         try:
-            return self.isAllowedRouter.call(action.__class__, world, action)
+            rule = self._rules[action.__class__]
+        except KeyError:
+            rule = self._ruleFor(action.__class__)
+        if rule is None:
+            return
+        try:
+            return rule(world, action, {subject_id: obj})
         except KeyError:
             pass
 
 
+    def _ruleFor(self, action_class):
+        """
+        Get (and remember) the function which checks whether an action of the
+        given class is allowed.  It takes the world, the action and a dict of
+        the objects already fetched (see L{_compileRule}).
+
+        @return: The function, or C{None} if there are no rules for such
+            actions.
+        """
+        try:
+            handler = self.isAllowedRouter.lookup(action_class)
+        except KeyError:
+            rule = None
+        else:
+            if getattr(handler, 'requirements', None) is not None:
+                # already compiled by its requirement decorators
+                rule = handler
+            else:
+                rule = lambda world, action, fetched: handler(world, action)
+        self._rules[action_class] = rule
+        return rule
+
+
     @isAllowedRouter.handle(act.LookAt)
     @requireSquare
     @requireSameSquare('thing', 'target')
@@ -341,6 +507,12 @@ class StandardRules(object):
 
     def workRequirement(self, world, action):
         """
+        Get the L{Work} the subject of an action must do first, if any.
         """
-        # XXX nothing requires work right now
-        pass
+        if self.work_scheduler is None:
+            return None
+        return self.work_scheduler.workFor(action.subject())
+
+StandardRules.ev_router.precompute()
+StandardRules.act_router.precompute()
+StandardRules.isAllowedRouter.precompute()
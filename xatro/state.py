@@ -1,5 +1,3 @@
-from twisted.python import log
-
 from xatro.event import Created, Destroyed, AttrSet, ItemAdded, ItemRemoved
 from xatro.event import AttrDel
 from xatro.router import Router
@@ -11,17 +9,137 @@ class State(object):
     I hold the state of a world as built up by events.
 
     @ivar state: Dictionary of all the objects in the world.
+    @ivar tracer: An optional L{EventTracer} told about every event.
+    @ivar kinds: Dictionary of C{kind} to the set of ids of the objects of
+        that kind.
+    @ivar summaries: Dictionary of object id to a dictionary of C{kind} to
+        the number of things of that kind in the object's C{contents}.
+    @ivar board_revision: A number which changes whenever a square or a
+        square's summary changes.
     """
 
     router = Router()
 
 
-    def __init__(self):
+    def __init__(self, tracer=None):
         self.state = {}
+        self.tracer = tracer
+        self.kinds = {}
+        self.summaries = {}
+        self.board_revision = 0
+        self._containers = {}
+
+
+    def makeObject(self, id):
+        """
+        Make the thing that will hold the attributes of a new object.
+        """
+        return {'id': id}
+
+
+    def byKind(self, kind):
+        """
+        Return a set of the ids of all the objects of the given kind.
+        """
+        return set(self.kinds.get(kind, ()))
+
+
+    def _index(self, id, kind):
+        self.kinds.setdefault(kind, set()).add(id)
+
+
+    def _unindex(self, id, kind):
+        ids = self.kinds.get(kind)
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del self.kinds[kind]
+
+
+    def summary(self, id):
+        """
+        Return a dictionary of C{kind} to the number of things of that kind in
+        the C{contents} of the given object.
+        """
+        return dict(self.summaries.get(id, ()))
+
+
+    def _count(self, container, kind, change):
+        counts = self.summaries.setdefault(container, {})
+        counts[kind] = counts.get(kind, 0) + change
+        if not counts[kind]:
+            del counts[kind]
+        self.board_revision += 1
+
+
+    def _contained(self, id, container):
+        self._uncontained(id)
+        kind = self.state[id].get('kind') if id in self.state else None
+        self._containers[id] = (container, kind)
+        self._count(container, kind, 1)
+
+
+    def _uncontained(self, id):
+        """
+        Stop counting C{id} in the summary of its container.
+
+        @return: The id of the container, or C{None} if it wasn't in one.
+        """
+        if id not in self._containers:
+            return None
+        container, kind = self._containers.pop(id)
+        self._count(container, kind, -1)
+        return container
+
+
+    def _squareChanged(self, id):
+        if id in self.kinds.get('square', ()):
+            self.board_revision += 1
+
+
+    def snapshot(self):
+        """
+        Get everything needed to L{restore} me later.
+
+        The result shares structure with me, so it should be serialized
+        before any more events are received.
+
+        @return: A C{dict} of plain (C{marshal}-able) data.
+        """
+        return {
+            'objects': self._plainObjects(),
+            'kinds': self.kinds,
+            'summaries': self.summaries,
+            'containers': self._containers,
+            'board_revision': self.board_revision,
+        }
+
+
+    def _plainObjects(self):
+        return self.state
+
+
+    def restore(self, snapshot):
+        """
+        Replace everything I hold with what is in a L{snapshot}.
+
+        C{state} is updated in place so that references to it stay valid.
+        """
+        self.state.clear()
+        for id, attrs in snapshot['objects'].iteritems():
+            obj = self.makeObject(id)
+            for name, value in attrs.iteritems():
+                obj[name] = value
+            self.state[id] = obj
+        self.kinds = snapshot['kinds']
+        self.summaries = snapshot['summaries']
+        self._containers = snapshot['containers']
+        self.board_revision = snapshot['board_revision']
 
 
     def eventReceived(self, event):
-        log.msg(event)
+        if self.tracer:
+            self.tracer.eventReceived(event)
         try:
             return self.router.call(event.__class__, event)
         except KeyError:
@@ -30,24 +148,43 @@ class State(object):
 
     @router.handle(Created)
     def handle_Created(self, event):
-        self.state[event.id] = {
-            'id': event.id,
-        }
+        self.state[event.id] = self.makeObject(event.id)
 
 
     @router.handle(Destroyed)
     def handle_Destroyed(self, event):
-        self.state.pop(event.id)
+        self._squareChanged(event.id)
+        obj = self.state.pop(event.id)
+        self._unindex(event.id, obj.get('kind'))
+        self.summaries.pop(event.id, None)
+        self._uncontained(event.id)
 
 
     @router.handle(AttrSet)
     def handle_AttrSet(self, (id, name, value)):
-        self.state[id][name] = value
+        obj = self.state[id]
+        container = None
+        if name == 'kind':
+            self._unindex(id, obj.get('kind'))
+            self._index(id, value)
+            container = self._uncontained(id)
+        obj[name] = value
+        if container is not None:
+            self._contained(id, container)
+        self._squareChanged(id)
 
 
     @router.handle(AttrDel)
     def handle_AttrDel(self, (id, name)):
-        del self.state[id][name]
+        obj = self.state[id]
+        container = None
+        self._squareChanged(id)
+        if name == 'kind':
+            self._unindex(id, obj.get('kind'))
+            container = self._uncontained(id)
+        del obj[name]
+        if container is not None:
+            self._contained(id, container)
 
     @router.handle(ItemAdded)
     def handle_ItemAdded(self, (id, name, value)):
@@ -55,8 +192,144 @@ class State(object):
         if name not in obj:
             obj[name] = []
         obj[name].append(value)
+        if name == 'contents':
+            self._contained(value, id)
 
 
     @router.handle(ItemRemoved)
     def handle_ItemRemoved(self, (id, name, value)):
-        self.state[id][name].remove(value)
\ No newline at end of file
+        self.state[id][name].remove(value)
+        if name == 'contents' and self._containers.get(value, (None,))[0] == id:
+            self._uncontained(value)
+
+State.router.precompute()
+
+
+
+class Record(object):
+    """
+    I hold the attributes of a single world object and behave like the
+    C{dict} that L{State} would use, but take much less memory.
+
+    Common attributes are stored in slots (an unset slot is a missing key);
+    anything else goes in a C{dict} that is only made when needed.  String
+    C{kind}s are interned so that all objects of a kind share one string.
+    """
+
+    __slots__ = ('id', 'kind', 'location', 'hp', 'locks', 'team', 'tool',
+                 'contents', 'energy', 'created_energy', 'coordinates',
+                 'portal_user', '_extra')
+
+    _order = __slots__[:-1]
+    _slotted = frozenset(_order)
+
+    __hash__ = None
+
+
+    def __init__(self, id):
+        self.id = id
+
+
+    def __getitem__(self, name):
+        try:
+            if name in self._slotted:
+                return getattr(self, name)
+            return self._extra[name]
+        except (AttributeError, KeyError):
+            raise KeyError(name)
+
+
+    def __setitem__(self, name, value):
+        if name in self._slotted:
+            if name == 'kind' and type(value) is str:
+                value = intern(value)
+            setattr(self, name, value)
+        else:
+            try:
+                self._extra[name] = value
+            except AttributeError:
+                self._extra = {name: value}
+
+
+    def __delitem__(self, name):
+        try:
+            if name in self._slotted:
+                delattr(self, name)
+            else:
+                del self._extra[name]
+        except (AttributeError, KeyError):
+            raise KeyError(name)
+
+
+    def __contains__(self, name):
+        try:
+            self[name]
+            return True
+        except KeyError:
+            return False
+
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+    def keys(self):
+        keys = [x for x in self._order if hasattr(self, x)]
+        keys.extend(getattr(self, '_extra', ()))
+        return keys
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def __len__(self):
+        return len(self.keys())
+
+
+    def values(self):
+        return [self[x] for x in self.keys()]
+
+
+    def items(self):
+        return [(x, self[x]) for x in self.keys()]
+
+
+    def toDict(self):
+        """
+        Return a C{dict} with the same contents as me.
+        """
+        return dict(self.items())
+
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.toDict()
+        return self.toDict() == other
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    def __repr__(self):
+        return repr(self.toDict())
+
+
+
+class CompactState(State):
+    """
+    I am a L{State} which holds each object in a L{Record} instead of a
+    C{dict}.  Use me for worlds with very many objects.
+    """
+
+
+    def makeObject(self, id):
+        return Record(id)
+
+
+    def _plainObjects(self):
+        return dict((id, obj.toDict()) for id, obj in self.state.iteritems())
@@ -276,6 +276,21 @@ class ChargeTest(TestCase):
 
 
 
+    def test_energyDestroyed_stopWatchingCreator(self):
+        """
+        Once the energy is destroyed, nothing is left waiting on the death of
+        its creator.
+        """
+        world = World(MagicMock())
+        thing = world.create('thing')
+
+        Charge(thing['id']).execute(world)
+        world.destroy(thing['energy'][0])
+
+        self.assertEqual(len(world._on_become), 0)
+
+
+
 class ShareEnergyTest(TestCase):
 
 
@@ -869,6 +884,36 @@ class ListSquaresTest(TestCase):
 
 
 
+    def test_execute_cached(self):
+        """
+        The same listing is returned until something about the squares
+        changes.
+        """
+        world = World(MagicMock())
+        s1 = world.create('square')['id']
+        thing = world.create('thing')['id']
+
+        output = ListSquares(thing).execute(world)
+        self.assertIdentical(ListSquares(thing).execute(world), output)
+
+        world.setAttr(thing, 'hp', 10)
+        self.assertIdentical(ListSquares(thing).execute(world), output)
+
+        Move(thing, s1).execute(world)
+        output2 = ListSquares(thing).execute(world)
+        self.assertEqual(output2, [{
+            'id': s1,
+            'kind': 'square',
+            'coordinates': None,
+            'contents': {'thing': 1},
+        }])
+
+        world.setAttr(thing, 'kind', 'other')
+        self.assertEqual(ListSquares(thing).execute(world)[0]['contents'],
+                         {'other': 1})
+
+
+
 class AddLockTest(TestCase):
 
 
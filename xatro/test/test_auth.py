@@ -1,9 +1,13 @@
 from twisted.trial.unittest import TestCase
-from twisted.internet import defer
+from twisted.internet import defer, task
 
+from mock import MagicMock
 
-from xatro.error import BadPassword
+from xatro.error import BadPassword, AuthBusy, NotFound
 from xatro.auth import FileStoredPasswords, MemoryStoredPasswords
+from xatro.auth import HashingPool, EntityDatabase
+
+import sqlite3
 
 
 class FileStoredPasswordsTest(TestCase):
@@ -68,6 +72,131 @@ class FileStoredPasswordsTest(TestCase):
 
 
 
+    @defer.inlineCallbacks
+    def test_hashesCached(self):
+        """
+        Password hashes are only read from the file once.
+        """
+        auth = FileStoredPasswords(self.mktemp())
+        self.addCleanup(auth.db.close)
+        yield auth.createEntity('foo', 'password')
+        auth2 = FileStoredPasswords(auth.db.filename)
+        self.addCleanup(auth2.db.close)
+        get = auth2.db.get
+        calls = []
+        def countingGet(name):
+            calls.append(name)
+            return get(name)
+        auth2.db.get = countingGet
+
+        yield auth2.checkPassword('foo', 'password')
+        yield self.assertFailure(auth2.checkPassword('foo', 'wrong'),
+                                 BadPassword)
+        self.assertEqual(calls, ['foo'])
+        # the creator never needs to read it
+        yield auth.checkPassword('foo', 'password')
+
+
+
+class EntityDatabaseTest(TestCase):
+
+
+    def database(self):
+        db = EntityDatabase(self.mktemp())
+        self.addCleanup(db.close)
+        return db
+
+
+    @defer.inlineCallbacks
+    def test_get(self):
+        """
+        Inserted hashes can be gotten once committed.  Unknown names fail
+        with NotFound.
+        """
+        db = self.database()
+        yield self.assertFailure(db.get('foo'), NotFound)
+        name = yield db.insert('foo', 'hash')
+        self.assertEqual(name, 'foo')
+        pw_hash = yield db.get('foo')
+        self.assertEqual(pw_hash, 'hash')
+
+
+    @defer.inlineCallbacks
+    def test_reactor(self):
+        """
+        The reactor given is the one used to run queries and schedule
+        commits.
+        """
+        from twisted.internet import reactor
+        fake = MagicMock(wraps=reactor)
+        db = EntityDatabase(self.mktemp(), reactor=fake)
+        self.addCleanup(db.close)
+        yield db.insert('foo', 'hash')
+        fake.addSystemEventTrigger.assert_called_once_with('before',
+                                                           'shutdown',
+                                                           db.close)
+        self.assertEqual(fake.callLater.call_count, 1)
+        self.assertTrue(fake.callFromThread.called)
+
+
+    @defer.inlineCallbacks
+    def test_batch(self):
+        """
+        Inserts made together are committed in one transaction, and a name
+        that's taken only fails its own insert.
+        """
+        db = self.database()
+        yield db.insert('taken', 'hash')
+        batches = []
+        insertRows = db._insertRows
+        def recordingInsertRows(rows):
+            batches.append(rows)
+            return insertRows(rows)
+        db._insertRows = recordingInsertRows
+
+        ds = [db.insert('a', 'hash a'), db.insert('taken', 'x'),
+              db.insert('b', 'hash b')]
+        yield self.assertFailure(ds[1], sqlite3.IntegrityError)
+        yield ds[0]
+        yield ds[2]
+        self.assertEqual(batches, [[('a', 'hash a'), ('taken', 'x'),
+                                    ('b', 'hash b')]])
+        pw_hash = yield db.get('b')
+        self.assertEqual(pw_hash, 'hash b')
+
+
+    @defer.inlineCallbacks
+    def test_wal(self):
+        """
+        The file is in write-ahead-log mode.
+        """
+        db = self.database()
+        yield db.insert('foo', 'hash')
+        mode = yield db._run(lambda: db._connection().execute(
+                             'pragma journal_mode').fetchone()[0])
+        self.assertEqual(mode, 'wal')
+
+
+    @defer.inlineCallbacks
+    def test_close(self):
+        """
+        Closing commits waiting inserts.
+        """
+        db = EntityDatabase(self.mktemp())
+        yield db.get('nothing').addErrback(lambda err: None)
+        d = db.insert('foo', 'hash')
+        yield db.close()
+        name = yield d
+        self.assertEqual(name, 'foo')
+        self.assertFalse(db.threadpool.started)
+
+        db2 = EntityDatabase(db.filename)
+        self.addCleanup(db2.close)
+        pw_hash = yield db2.get('foo')
+        self.assertEqual(pw_hash, 'hash')
+
+
+
 class MemoryStoredPasswordsTest(TestCase):
 
 
@@ -113,4 +242,136 @@ class MemoryStoredPasswordsTest(TestCase):
 
 
 
+class FakeWrapper(object):
+    """
+    A stand-in for a C{txscrypt} wrapper whose results are fired by hand.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+
+    def computeKey(self, password):
+        d = defer.Deferred()
+        self.calls.append(('computeKey', password, d))
+        return d
+
+
+    def checkPassword(self, stored, provided):
+        d = defer.Deferred()
+        self.calls.append(('checkPassword', (stored, provided), d))
+        return d
+
+
+
+class HashingPoolTest(TestCase):
+
+
+    def test_passThrough(self):
+        """
+        Hashing is done by the wrapper.
+        """
+        wrapper = FakeWrapper()
+        pool = HashingPool(1, 1, wrapper)
+        d1 = pool.computeKey('password')
+        d2 = pool.checkPassword('hash', 'password')
+        self.assertEqual([c[:2] for c in wrapper.calls],
+                         [('computeKey', 'password'),
+                          ('checkPassword', ('hash', 'password'))])
+        wrapper.calls[0][2].callback('hash')
+        wrapper.calls[1][2].callback(True)
+        self.assertEqual(self.successResultOf(d1), 'hash')
+        self.assertEqual(self.successResultOf(d2), True)
+
+
+    def test_full(self):
+        """
+        Once C{size} hashes are running and C{max_queued} are waiting, more
+        are refused until some finish.
+        """
+        wrapper = FakeWrapper()
+        pool = HashingPool(2, 1, wrapper)
+        ds = [pool.checkPassword('hash', str(i)) for i in xrange(3)]
+        self.failureResultOf(pool.checkPassword('hash', 'x'), AuthBusy)
+        self.failureResultOf(pool.computeKey('x'), AuthBusy)
+        self.assertEqual(len(wrapper.calls), 3)
+
+        wrapper.calls[0][2].errback(ValueError('bad hash'))
+        self.failureResultOf(ds[0], ValueError)
+        pool.checkPassword('hash', 'x')
+        self.assertEqual(len(wrapper.calls), 4)
+        self.assertEqual(pool.pending, 3)
+
+
+
+class PasswordCacheTest(TestCase):
 
+
+    def store(self, **kwargs):
+        self.wrapper = FakeWrapper()
+        auth = MemoryStoredPasswords(HashingPool(1, 10, self.wrapper),
+                                     clock=task.Clock(), **kwargs)
+        auth._set('team', 'hash')
+        return auth
+
+
+    def test_cached(self):
+        """
+        A correct password isn't hashed again for C{cache_ttl} seconds.
+        """
+        auth = self.store(cache_ttl=10)
+        d = auth.checkPassword('team', 'password')
+        self.wrapper.calls[0][2].callback(True)
+        self.assertEqual(self.successResultOf(d), 'team')
+
+        auth.clock.advance(9)
+        d = auth.checkPassword('team', 'password')
+        self.assertEqual(self.successResultOf(d), 'team')
+        self.assertEqual(len(self.wrapper.calls), 1)
+
+        auth.clock.advance(1)
+        d = auth.checkPassword('team', 'password')
+        self.assertNoResult(d)
+        self.assertEqual(len(self.wrapper.calls), 2)
+
+
+    def test_wrongNotCached(self):
+        """
+        Wrong passwords are checked every time, and don't get in the way of
+        the right one.
+        """
+        auth = self.store()
+        d = auth.checkPassword('team', 'wrong')
+        self.wrapper.calls[0][2].callback(False)
+        self.failureResultOf(d, BadPassword)
+
+        auth.checkPassword('team', 'wrong')
+        self.assertEqual(len(self.wrapper.calls), 2)
+        self.assertEqual(auth._correct, {})
+        self.assertNotIn('wrong', repr(auth._checking))
+
+
+    def test_coalesce(self):
+        """
+        Checks of a password that's already being checked share the result.
+        """
+        auth = self.store()
+        ds = [auth.checkPassword('team', 'password') for i in xrange(5)]
+        other = auth.checkPassword('team', 'other')
+        self.assertEqual(len(self.wrapper.calls), 2)
+
+        self.wrapper.calls[0][2].callback(True)
+        self.assertEqual([self.successResultOf(d) for d in ds], ['team'] * 5)
+        self.assertNoResult(other)
+
+
+    def test_coalesceFailure(self):
+        """
+        If the shared check fails, everyone waiting on it fails.
+        """
+        auth = self.store()
+        ds = [auth.checkPassword('team', 'password') for i in xrange(2)]
+        self.wrapper.calls[0][2].errback(ValueError('bad hash'))
+        for d in ds:
+            self.failureResultOf(d, ValueError)
+        self.assertEqual(auth._checking, {})
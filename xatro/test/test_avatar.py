@@ -1,8 +1,9 @@
 from twisted.trial.unittest import TestCase
+from twisted.internet import defer
 
 from mock import MagicMock
 
-from xatro.error import NotAllowed
+from xatro.error import NotAllowed, TooManyCommands
 from xatro.world import World
 from xatro.avatar import Avatar
 
@@ -126,7 +127,130 @@ class AvatarTest(TestCase):
 
         a.makeCommand.assert_called_once_with(command, 'foo', 'bar')
         world.execute.assert_called_once_with('made command')
-        self.assertEqual(r, 'foo', "Should return result of execution")
+        self.assertEqual(self.successResultOf(r), 'foo',
+                         "Should return result of execution")
+
+
+    def test_execute_inOrder(self):
+        """
+        A command isn't started until the one before it is done.
+        """
+        world = MagicMock()
+        results = [defer.Deferred(), defer.Deferred()]
+        world.execute.side_effect = results
+
+        a = Avatar(world)
+        a.makeCommand = lambda cls, *args: (cls,) + args
+        d1 = a.execute('join', 'team')
+        d2 = a.execute('move', 'square')
+        world.execute.assert_called_once_with(('join', 'team'))
+
+        results[0].callback('joined')
+        self.assertEqual(self.successResultOf(d1), 'joined')
+        world.execute.assert_called_with(('move', 'square'))
+        self.assertNoResult(d2)
+
+        results[1].callback('moved')
+        self.assertEqual(self.successResultOf(d2), 'moved')
+
+
+    def test_execute_failure(self):
+        """
+        A failed command fails its Deferred and lets the next one start.
+        """
+        world = MagicMock()
+        results = [defer.Deferred(), defer.Deferred()]
+        world.execute.side_effect = results
+
+        a = Avatar(world)
+        a.makeCommand = lambda cls, *args: (cls,) + args
+        d1 = a.execute('join', 'team')
+        d2 = a.execute('move', 'square')
+        results[0].errback(NotAllowed('no'))
+        self.failureResultOf(d1, NotAllowed)
+        results[1].callback('moved')
+        self.assertEqual(self.successResultOf(d2), 'moved')
+
+        # and so does failing to make the command
+        a.makeCommand = MagicMock(side_effect=TypeError('bad args'))
+        self.failureResultOf(a.execute('move'), TypeError)
+
+
+    def test_execute_inFlight(self):
+        """
+        Up to C{max_in_flight} commands run at once, but their results are
+        delivered in the order the commands were given.
+        """
+        world = MagicMock()
+        results = [defer.Deferred() for i in xrange(3)]
+        world.execute.side_effect = results
+
+        a = Avatar(world)
+        a.max_in_flight = 2
+        a.makeCommand = lambda cls, *args: (cls,) + args
+        ds = [a.execute(str(i)) for i in xrange(3)]
+        self.assertEqual(world.execute.call_count, 2)
+
+        results[1].callback('second')
+        self.assertNoResult(ds[0])
+        self.assertNoResult(ds[1])
+        # the second is still in flight until the first is delivered
+        self.assertEqual(world.execute.call_count, 2)
+
+        results[0].callback('first')
+        self.assertEqual(self.successResultOf(ds[0]), 'first')
+        self.assertEqual(self.successResultOf(ds[1]), 'second')
+        self.assertEqual(world.execute.call_count, 3)
+        results[2].callback('third')
+        self.assertEqual(self.successResultOf(ds[2]), 'third')
+
+
+    def test_execute_tooMany(self):
+        """
+        Commands given while C{max_queued} are waiting fail right away.
+        """
+        world = MagicMock()
+        results = [defer.Deferred() for i in xrange(3)]
+        world.execute.side_effect = results
+
+        a = Avatar(world)
+        a.max_queued = 2
+        a.makeCommand = lambda cls, *args: (cls,) + args
+        running = a.execute('0')
+        waiting = [a.execute('1'), a.execute('2')]
+        self.failureResultOf(a.execute('3'), TooManyCommands)
+        self.assertEqual(world.execute.call_count, 1)
+
+        results[0].callback('done')
+        self.successResultOf(running)
+        self.assertEqual(world.execute.call_count, 2)
+        self.assertNoResult(waiting[0])
+        self.assertNoResult(a.execute('3'))
+
+
+    def test_execute_manySynchronous(self):
+        """
+        Hundreds of commands which finish right away can wait behind one that
+        doesn't, and all run in order once it's done.
+        """
+        world = MagicMock()
+        pending = defer.Deferred()
+        ran = []
+        def execute(cmd):
+            if cmd[1] == 0:
+                return pending
+            ran.append(cmd[1])
+            return cmd[1]
+        world.execute.side_effect = execute
+
+        a = Avatar(world)
+        a.max_queued = 1000
+        a.makeCommand = lambda cls, *args: (cls,) + args
+        ds = [a.execute('cmd', i) for i in xrange(801)]
+        pending.callback(0)
+
+        self.assertEqual(ran, range(1, 801))
+        self.assertEqual([self.successResultOf(d) for d in ds], range(801))
 
 
     def test_quit(self):
@@ -142,4 +266,30 @@ class AvatarTest(TestCase):
         world.destroy.assert_called_once_with('foo')
 
 
+    def test_quit_waiting(self):
+        """
+        Commands waiting to be started when an avatar quits fail, and aren't
+        started later.
+        """
+        world = MagicMock()
+        running = defer.Deferred()
+        world.execute.return_value = running
+
+        a = Avatar(world)
+        a.setGamePiece('foo')
+        a.makeCommand = lambda cls, *args: (cls,) + args
+        first = a.execute('0')
+        waiting = [a.execute('1'), a.execute('2')]
+        a.quit()
+
+        for d in waiting:
+            exc = self.failureResultOf(d, NotAllowed).value
+            self.assertEqual(str(exc), 'Quit before the command was started')
+        self.assertNoResult(first)
+
+        running.callback('done')
+        self.assertEqual(self.successResultOf(first), 'done')
+        self.assertEqual(world.execute.call_count, 1)
+
+
 
@@ -29,6 +29,16 @@ class XatroEngineTest(TestCase):
         self.assertEqual(e.engine, wrapped)
 
 
+    def test_worldRecovered(self):
+        """
+        The wrapped engine is told when the world is recovered.
+        """
+        wrapped = MagicMock()
+        e = XatroEngine(wrapped)
+        e.worldRecovered('world')
+        wrapped.worldRecovered.assert_called_once_with('world')
+
+
     def friendlyEngine(self):
         """
         Return a XatroEngine whose internal engine will let any action happen.
@@ -123,6 +133,119 @@ class XatroEngineTest(TestCase):
         action.execute.assert_called_once_with(world)
 
 
+    def test_execute_verifier(self):
+        """
+        Solutions are verified by the engine's verifier, and if the verdict
+        comes later, the action is checked again before it's executed.
+        """
+        e = self.friendlyEngine()
+        e.engine.workRequirement.return_value = Work(0, 'bar')
+        verdict = defer.Deferred()
+        e.verifier = MagicMock()
+        e.verifier.verify.return_value = verdict
+
+        world = World(MagicMock())
+        action = MagicMock()
+        action.execute.return_value = 'foo'
+        world.envelope(action)['work_solution'] = 'solution'
+
+        d = e.execute(world, action)
+        e.verifier.verify.assert_called_once_with(Work(0, 'bar'), 'solution')
+        self.assertNoResult(d)
+        self.assertEqual(action.execute.call_count, 0)
+
+        verdict.callback(True)
+        self.assertEqual(self.successResultOf(d), 'foo')
+        self.assertEqual(e.engine.isAllowed.call_count, 2)
+        action.execute.assert_called_once_with(world)
+
+
+    def test_execute_verifier_invalid(self):
+        """
+        If the verifier rejects the solution, the action isn't done.
+        """
+        e = self.friendlyEngine()
+        e.engine.workRequirement.return_value = Work(0, 'bar')
+        verdict = defer.Deferred()
+        e.verifier = MagicMock()
+        e.verifier.verify.return_value = verdict
+
+        world = World(MagicMock())
+        action = MagicMock()
+        world.envelope(action)['work_solution'] = 'solution'
+
+        d = e.execute(world, action)
+        verdict.callback(False)
+        self.failureResultOf(d, InvalidSolution)
+        self.assertEqual(action.execute.call_count, 0)
+
+
+    def test_execute_verifier_noLongerAllowed(self):
+        """
+        If the action stopped being allowed while the solution was being
+        verified, it isn't done.
+        """
+        e = self.friendlyEngine()
+        e.engine.workRequirement.return_value = Work(0, 'bar')
+        verdict = defer.Deferred()
+        e.verifier = MagicMock()
+        e.verifier.verify.return_value = verdict
+
+        world = World(MagicMock())
+        action = MagicMock()
+        world.envelope(action)['work_solution'] = 'solution'
+
+        d = e.execute(world, action)
+        e.engine.isAllowed.side_effect = NotAllowed()
+        verdict.callback(True)
+        self.failureResultOf(d, NotAllowed)
+        self.assertEqual(action.execute.call_count, 0)
+
+
+    def test_execute_workRequired_replay(self):
+        """
+        A solution can't be used twice.
+        """
+        e = self.friendlyEngine()
+        e.engine.workRequirement.return_value = Work(0, 'bar')
+
+        world = World(MagicMock())
+        action = MagicMock()
+        world.envelope(action)['work_solution'] = 'anything will work'
+        self.successResultOf(e.execute(world, action))
+
+        action2 = MagicMock()
+        world.envelope(action2)['work_solution'] = 'anything will work'
+        self.failureResultOf(e.execute(world, action2), InvalidSolution)
+        self.assertEqual(action2.execute.call_count, 0)
+
+
+    def test_execute_verifier_replay(self):
+        """
+        If the same solution is being verified for two actions at once, only
+        the first gets to use it.
+        """
+        e = self.friendlyEngine()
+        e.engine.workRequirement.return_value = Work(0, 'bar')
+        verdicts = [defer.Deferred(), defer.Deferred()]
+        e.verifier = MagicMock()
+        e.verifier.verify.side_effect = verdicts
+
+        world = World(MagicMock())
+        action1 = MagicMock()
+        action2 = MagicMock()
+        world.envelope(action1)['work_solution'] = 'solution'
+        world.envelope(action2)['work_solution'] = 'solution'
+
+        d1 = e.execute(world, action1)
+        d2 = e.execute(world, action2)
+        verdicts[0].callback(True)
+        verdicts[1].callback(True)
+        self.successResultOf(d1)
+        self.failureResultOf(d2, InvalidSolution)
+        self.assertEqual(action2.execute.call_count, 0)
+
+
     def test_execute_notAllowed(self):
         """
         If an action is not allowed, don't do it.
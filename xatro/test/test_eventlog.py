@@ -0,0 +1,150 @@
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+
+from xatro.eventlog import EventLog, encode, readEvents, readRecords
+from xatro.event import Created, AttrSet, ItemAdded, ActionPerformed
+from xatro.action import Move, CreateTeam
+
+
+
+class EventLogTest(TestCase):
+
+
+    def log(self, **kwargs):
+        log = EventLog(self.mktemp(), clock=task.Clock(), **kwargs)
+        self.addCleanup(log.close)
+        return log
+
+
+    def test_roundTrip(self):
+        """
+        Events appended to the log can be read back with their sequence
+        numbers.
+        """
+        log = self.log()
+        log.append(1, Created('foo'))
+        log.append(2, AttrSet('foo', 'coordinates', (1, 2)))
+        log.append(3, ItemAdded('foo', 'contents', u'bar'))
+        log.append(4, 'something else')
+        log.close()
+
+        self.assertEqual(list(readEvents(log.path)), [
+            (1, Created('foo')),
+            (2, AttrSet('foo', 'coordinates', (1, 2))),
+            (3, ItemAdded('foo', 'contents', u'bar')),
+            (4, 'something else'),
+        ])
+
+
+    def test_actions(self):
+        """
+        Actions are logged as their class name and public attributes, but
+        without passwords.
+        """
+        log = self.log()
+        log.append(1, ActionPerformed(Move('foo', 'bar')))
+        log.append(2, ActionPerformed(CreateTeam('foo', 'team', 'secret')))
+        log.close()
+
+        events = list(readEvents(log.path))
+        self.assertEqual(events[0], (1, ActionPerformed(
+            ('Move', {'thing': 'foo', 'dst': 'bar'}))))
+        self.assertEqual(events[1], (2, ActionPerformed(
+            ('CreateTeam', {'creator': 'foo', 'team_name': 'team'}))))
+
+
+    def test_buffered(self):
+        """
+        Nothing is written until the sync interval passes.
+        """
+        log = self.log(sync_interval=2)
+        log.append(1, Created('foo'))
+        log.append(2, Created('bar'))
+        self.assertEqual(list(readEvents(log.path)), [])
+
+        log.clock.advance(2)
+        self.assertEqual(list(readEvents(log.path)), [
+            (1, Created('foo')),
+            (2, Created('bar')),
+        ])
+        self.assertEqual(log.clock.getDelayedCalls(), [])
+
+
+    def test_bufferFull(self):
+        """
+        Records are written once C{buffer_size} bytes are buffered.
+        """
+        log = self.log(buffer_size=len(encode(1, Created('foo'))) * 2)
+        log.append(1, Created('foo'))
+        log._file.flush()
+        self.assertEqual(list(readEvents(log.path)), [])
+
+        log.append(2, Created('bar'))
+        log._file.flush()
+        self.assertEqual(len(list(readEvents(log.path))), 2)
+
+
+    def test_append(self):
+        """
+        An existing log is appended to.
+        """
+        log = self.log()
+        log.append(1, Created('foo'))
+        log.close()
+
+        log2 = EventLog(log.path)
+        log2.append(2, Created('bar'))
+        log2.close()
+
+        self.assertEqual([x[0] for x in readEvents(log.path)], [1, 2])
+
+
+    def test_truncated(self):
+        """
+        A partly written record at the end of the log is ignored.
+        """
+        log = self.log()
+        log.append(1, Created('foo'))
+        log.close()
+        with open(log.path, 'ab') as fh:
+            fh.write(encode(2, Created('bar'))[:-3])
+
+        self.assertEqual(list(readEvents(log.path)), [(1, Created('foo'))])
+
+
+    def test_offset(self):
+        """
+        The offset of a log is where the next record will go, and reading can
+        start from there.
+        """
+        log = self.log()
+        log.append(1, Created('foo'))
+        offset = log.offset()
+        self.assertEqual(offset, len(encode(1, Created('foo'))))
+        log.append(2, Created('bar'))
+        log.close()
+
+        self.assertEqual(list(readEvents(log.path, offset)),
+                         [(2, Created('bar'))])
+
+        log2 = EventLog(log.path)
+        self.addCleanup(log2.close)
+        self.assertEqual(log2.offset(), offset * 2)
+
+
+    def test_readRecords(self):
+        """
+        Records are read along with the offset just after each.
+        """
+        log = self.log()
+        log.append(1, Created('foo'))
+        log.append(2, Created('bar'))
+        log.close()
+        size = len(encode(1, Created('foo')))
+        self.assertEqual(list(readRecords(log.path)), [
+            (size, 1, Created('foo')),
+            (size * 2, 2, Created('bar')),
+        ])
+        self.assertEqual(list(readRecords(log.path, size)), [
+            (size * 2, 2, Created('bar')),
+        ])
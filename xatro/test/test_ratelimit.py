@@ -0,0 +1,207 @@
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+from twisted.python import log
+
+from mock import MagicMock
+
+from xatro.world import World
+from xatro.error import RateLimited
+from xatro.ratelimit import TokenBucket, RateLimiter, parseLimits
+from xatro.action import Look, ListSquares
+
+
+
+class TokenBucketTest(TestCase):
+
+
+    def test_refill(self):
+        """
+        A bucket starts full and gains C{rate} tokens a second, up to
+        C{burst}.
+        """
+        bucket = TokenBucket(2, 5, 0)
+        self.assertEqual(bucket.refill(0), 5)
+        bucket.tokens = 0
+        self.assertEqual(bucket.refill(1), 2)
+        self.assertEqual(bucket.refill(1.5), 3)
+        self.assertEqual(bucket.refill(100), 5)
+        self.assertEqual(bucket.refill(99), 5)
+
+
+
+class RateLimiterTest(TestCase):
+
+
+    def limiter(self, *args, **kwargs):
+        return RateLimiter(clock=task.Clock(), *args, **kwargs)
+
+
+    def test_noLimits(self):
+        """
+        With no limits, everything is allowed.
+        """
+        world = World(MagicMock())
+        limiter = self.limiter()
+        for i in xrange(100):
+            limiter.check(world, Look('bot'))
+        self.assertEqual(dict(limiter.rejected), {})
+
+
+    def test_bot(self):
+        """
+        Each bot may do an action C{burst} times, then C{rate} times a second.
+        """
+        world = World(MagicMock())
+        limiter = self.limiter({Look: (1, 2)})
+        limiter.check(world, Look('bot'))
+        limiter.check(world, Look('bot'))
+        self.assertRaises(RateLimited, limiter.check, world, Look('bot'))
+        limiter.check(world, Look('other'))
+
+        limiter.clock.advance(1)
+        limiter.check(world, Look('bot'))
+        self.assertRaises(RateLimited, limiter.check, world, Look('bot'))
+        self.assertEqual(dict(limiter.rejected), {('bot', Look): 2})
+
+        # other actions aren't limited
+        limiter.check(world, ListSquares('bot'))
+
+
+    def test_botDefault(self):
+        """
+        The default limit applies separately to each action class that
+        doesn't have its own.
+        """
+        world = World(MagicMock())
+        limiter = self.limiter({Look: (1, 3)}, bot_default=(1, 1))
+        limiter.check(world, ListSquares('bot'))
+        self.assertRaises(RateLimited, limiter.check, world,
+                          ListSquares('bot'))
+        for i in xrange(3):
+            limiter.check(world, Look('bot'))
+        self.assertEqual(dict(limiter.rejected), {('bot', ListSquares): 1})
+
+
+    def test_team(self):
+        """
+        The bots on a team share the team's buckets.  Bots without a team
+        only have their own.
+        """
+        world = World(MagicMock())
+        bots = []
+        for i in xrange(3):
+            bot = world.create('bot')['id']
+            world.setAttr(bot, 'team', 'a')
+            bots.append(bot)
+        loner = world.create('bot')['id']
+        limiter = self.limiter(team_limits={Look: (1, 2)})
+
+        limiter.check(world, Look(bots[0]))
+        limiter.check(world, Look(bots[1]))
+        self.assertRaises(RateLimited, limiter.check, world, Look(bots[2]))
+        for i in xrange(3):
+            limiter.check(world, Look(loner))
+        self.assertEqual(dict(limiter.rejected), {('team', Look): 1})
+
+
+    def test_teamRejectKeepsBotToken(self):
+        """
+        If the team is over its limit, the bot's own token isn't used up.
+        """
+        world = World(MagicMock())
+        bot = world.create('bot')['id']
+        world.setAttr(bot, 'team', 'a')
+        limiter = self.limiter({Look: (1, 1)}, {Look: (1, 1)})
+        limiter._team_buckets['a'] = {Look: TokenBucket(1, 1, 0)}
+        limiter._team_buckets['a'][Look].tokens = 0
+
+        self.assertRaises(RateLimited, limiter.check, world, Look(bot))
+        self.assertEqual(limiter._bot_buckets[bot][Look].tokens, 1)
+
+
+    def test_logRejected(self):
+        """
+        How many actions were refused is logged, and counting starts again.
+        """
+        messages = []
+        log.addObserver(messages.append)
+        self.addCleanup(log.removeObserver, messages.append)
+
+        world = World(MagicMock())
+        limiter = self.limiter({Look: (1, 1)})
+        limiter.logRejected()
+        self.assertEqual(messages, [])
+
+        limiter.check(world, Look('bot'))
+        for i in xrange(2):
+            self.assertRaises(RateLimited, limiter.check, world, Look('bot'))
+        limiter.logRejected()
+        self.assertEqual([m['message'] for m in messages],
+                         [('Rate limited: 2 Look by bot',)])
+        self.assertEqual(dict(limiter.rejected), {})
+
+
+    def test_forget(self):
+        """
+        A forgotten bot starts with full buckets.
+        """
+        world = World(MagicMock())
+        limiter = self.limiter({Look: (1, 1)})
+        limiter.check(world, Look('bot'))
+        limiter.forget('bot')
+        limiter.check(world, Look('bot'))
+        limiter.forget('nobody')
+
+
+    def test_world(self):
+        """
+        Actions over the limit are refused by the world without reaching the
+        engine, and destroyed objects are forgotten.
+        """
+        engine = MagicMock()
+        engine.execute.return_value = 'done'
+        limiter = self.limiter({Look: (1, 1)})
+        world = World(MagicMock(), engine, rate_limiter=limiter)
+        bot = world.create('bot')['id']
+
+        self.assertEqual(self.successResultOf(world.execute(Look(bot))),
+                         'done')
+        self.failureResultOf(world.execute(Look(bot)), RateLimited)
+        self.assertEqual(engine.execute.call_count, 1)
+
+        world.destroy(bot)
+        self.assertEqual(limiter._bot_buckets, {})
+
+
+    def test_worldUnknownSubject(self):
+        """
+        If checking an action fails for some other reason (such as its
+        subject not existing) the world still returns a failed Deferred.
+        """
+        engine = MagicMock()
+        limiter = self.limiter(team_limits={Look: (1, 1)})
+        world = World(MagicMock(), engine, rate_limiter=limiter)
+
+        self.failureResultOf(world.execute(Look('gone')), KeyError)
+        self.assertEqual(engine.execute.call_count, 0)
+
+
+
+class ParseLimitsTest(TestCase):
+
+
+    def test_parse(self):
+        self.assertEqual(parseLimits('Look=5/10, ListSquares=0.5/2,*=20/40'),
+                         ({Look: (5.0, 10), ListSquares: (0.5, 2)},
+                          (20.0, 40)))
+        self.assertEqual(parseLimits('Look=1/1'), ({Look: (1.0, 1)}, None))
+        self.assertEqual(parseLimits(''), ({}, None))
+
+
+    def test_unknownAction(self):
+        """
+        Names which aren't those of action classes are refused.
+        """
+        self.assertRaises(ValueError, parseLimits, 'Lok=5/10')
+        self.assertRaises(ValueError, parseLimits, 'defer=5/10')
+        self.assertRaises(ValueError, parseLimits, 'IAction=5/10')
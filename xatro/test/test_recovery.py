@@ -0,0 +1,239 @@
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+
+from mock import MagicMock
+
+import os
+
+from xatro.recovery import writeSnapshot, readSnapshot, recover, Snapshotter
+from xatro.recovery import destroyBots
+from xatro.eventlog import EventLog, encode, readEvents
+from xatro.world import World
+from xatro.event import Created
+from xatro.action import Move
+
+
+
+class RecoveryTest(TestCase):
+
+
+    def setUp(self):
+        self.log_path = self.mktemp()
+        self.snapshot_path = self.mktemp()
+
+
+    def loggingWorld(self, engine=None):
+        event_log = EventLog(self.log_path, clock=task.Clock())
+        self.addCleanup(event_log.close)
+        return World(MagicMock(), engine, event_log=event_log)
+
+
+    def assertSameWorld(self, a, b):
+        self.assertEqual(a.objects, b.objects)
+        self.assertEqual(a.sequence, b.sequence)
+        self.assertEqual(a.boardRevision(), b.boardRevision())
+
+
+    def test_nothing(self):
+        """
+        There's nothing to recover if there's no snapshot or log.
+        """
+        engine = MagicMock()
+        world = World(MagicMock(), engine)
+        self.assertEqual(recover(world, self.snapshot_path, self.log_path),
+                         False)
+        self.assertEqual(recover(world), False)
+        self.assertEqual(world.objects, {})
+        self.assertEqual(engine.worldRecovered.call_count, 0)
+
+
+    def test_readSnapshot(self):
+        """
+        A snapshot can be read back after it's written.
+        """
+        self.assertEqual(readSnapshot(self.snapshot_path), None)
+        world = World(MagicMock())
+        world.create('foo')
+        writeSnapshot(world, self.snapshot_path)
+        self.assertEqual(readSnapshot(self.snapshot_path), world.snapshot())
+        self.assertFalse(os.path.exists(self.snapshot_path + '.tmp'))
+
+
+    def test_logOnly(self):
+        """
+        A world can be recovered from just its log.
+        """
+        world = self.loggingWorld()
+        thing = world.create('thing')['id']
+        world.setAttr(thing, 'hp', 2)
+        world.event_log.close()
+
+        engine = MagicMock()
+        world2 = World(MagicMock(), engine)
+        self.assertEqual(recover(world2, self.snapshot_path, self.log_path),
+                         True)
+        self.assertSameWorld(world2, world)
+        engine.worldRecovered.assert_called_once_with(world2)
+
+
+    def test_snapshotAndTail(self):
+        """
+        A world is recovered from its last snapshot plus the events logged
+        after it, which are read starting where the snapshot left off.
+        """
+        world = self.loggingWorld()
+        thing = world.create('thing')['id']
+        writeSnapshot(world, self.snapshot_path)
+        snapshot = readSnapshot(self.snapshot_path)
+        self.assertEqual(snapshot['log_offset'],
+                         os.path.getsize(self.log_path))
+
+        world.setAttr(thing, 'hp', 2)
+        world.create('other')
+        world.event_log.close()
+
+        # mangle the start of the log to show that it isn't read
+        with open(self.log_path, 'r+b') as fh:
+            fh.write('\xff' * 4)
+
+        world2 = World(MagicMock())
+        recover(world2, self.snapshot_path, self.log_path)
+        self.assertSameWorld(world2, world)
+
+
+    def test_eventsAlreadyInSnapshot(self):
+        """
+        Events in the log which are already part of the snapshot are not
+        replayed again.
+        """
+        world = self.loggingWorld()
+        world.create('thing')
+        writeSnapshot(world, self.snapshot_path)
+        world.create('other')
+        world.event_log.close()
+
+        snapshot = readSnapshot(self.snapshot_path)
+        del snapshot['log_offset']
+        world2 = World(MagicMock())
+        world2.restore(snapshot)
+        world2.replay = MagicMock(wraps=world2.replay)
+        recover(world2, None, self.log_path)
+
+        self.assertEqual(world2.replay.call_count, 2)
+        self.assertSameWorld(world2, world)
+
+
+    def test_subscriptions(self):
+        """
+        Objects in a recovered world are subscribed to each other as they
+        were before, so squares pass on what happens in them and recovered
+        bots can be moved.
+        """
+        world = self.loggingWorld()
+        square = world.create('square')['id']
+        other = world.create('square')['id']
+        bot = world.create('bot')['id']
+        Move(bot, square).execute(world)
+        writeSnapshot(world, self.snapshot_path)
+        bot2 = world.create('bot')['id']
+        Move(bot2, square).execute(world)
+        world.event_log.close()
+
+        world2 = World(MagicMock())
+        recover(world2, self.snapshot_path, self.log_path)
+        received = []
+        world2.receiveFor(bot, received.append)
+        world2.emit('hello', square)
+        self.assertEqual(received, ['hello'])
+
+        # what one occupant does is seen by the others
+        received2 = []
+        world2.receiveFor(bot2, received2.append)
+        world2.emit('wave', bot)
+        self.assertEqual(received2, ['wave'])
+
+        Move(bot, other).execute(world2)
+        self.assertEqual(world2.get(bot)['location'], other)
+        self.assertEqual(world2.get(square)['contents'], [bot2])
+        self.assertEqual(world2.get(other)['contents'], [bot])
+        del received[:]
+        world2.emit('hello', square)
+        self.assertEqual(received, [])
+        world2.emit('hello', other)
+        self.assertEqual(received, ['hello'])
+
+
+    def test_destroyBots(self):
+        """
+        Recovered bots can be destroyed, leaving the rest of the world.
+        """
+        world = self.loggingWorld()
+        square = world.create('square')['id']
+        bot = world.create('bot')['id']
+        Move(bot, square).execute(world)
+        world.event_log.close()
+
+        world2 = World(MagicMock())
+        recover(world2, None, self.log_path)
+        destroyBots(world2)
+        self.assertEqual(world2.byKind('bot'), set())
+        self.assertEqual(world2.get(square)['contents'], [])
+        self.assertEqual(len(world2._subscribers[square]), 1)
+
+
+    def test_truncatedLog(self):
+        """
+        A partly written record at the end of the log is cut off, so that
+        events appended afterwards can be read.
+        """
+        world = self.loggingWorld()
+        world.create('thing')
+        world.event_log.close()
+        size = os.path.getsize(self.log_path)
+        with open(self.log_path, 'ab') as fh:
+            fh.write(encode(99, Created('torn'))[:-2])
+
+        world2 = World(MagicMock())
+        recover(world2, self.snapshot_path, self.log_path)
+        self.assertEqual(os.path.getsize(self.log_path), size)
+
+        event_log = EventLog(self.log_path)
+        event_log.append(world2.sequence + 1, Created('next'))
+        event_log.close()
+        self.assertEqual(list(readEvents(self.log_path))[-1],
+                         (world2.sequence + 1, Created('next')))
+
+
+
+class SnapshotterTest(TestCase):
+
+
+    def test_periodic(self):
+        """
+        Snapshots are taken every C{interval} seconds, and once more when
+        stopped.
+        """
+        path = self.mktemp()
+        world = World(MagicMock())
+        s = Snapshotter(world, path, 10, task.Clock())
+        s.start()
+        self.assertEqual(readSnapshot(path), None)
+
+        world.create('foo')
+        s.clock.advance(10)
+        self.assertEqual(readSnapshot(path)['sequence'], 2)
+
+        world.create('bar')
+        s.stop()
+        self.assertEqual(readSnapshot(path)['sequence'], 4)
+        self.assertEqual(s.clock.getDelayedCalls(), [])
+
+
+    def test_error(self):
+        """
+        Errors writing a snapshot are logged.
+        """
+        world = World(MagicMock())
+        s = Snapshotter(world, os.path.join(self.mktemp(), 'missing', 'dir'))
+        s.snapshot()
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
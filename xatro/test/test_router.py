@@ -0,0 +1,147 @@
+from twisted.trial.unittest import TestCase
+
+from xatro.router import Router
+
+
+
+class Base(object):
+    pass
+
+
+class Sub(Base):
+    pass
+
+
+class Other(object):
+    pass
+
+
+
+class Handler(object):
+
+    router = Router()
+
+
+    def __init__(self):
+        self.called = []
+
+
+    def handle(self, thing):
+        return self.router.call(thing.__class__, thing)
+
+
+    @router.handle(Base)
+    def base(self, thing):
+        self.called.append(('base', thing))
+        return 'base'
+
+
+    @router.handle('key')
+    def key(self, arg):
+        raise KeyError('from inside')
+
+
+
+class RouterTest(TestCase):
+
+
+    def test_call(self):
+        """
+        Calling dispatches to the handler for the class, bound to the
+        instance the router was gotten from.
+        """
+        h = Handler()
+        thing = Base()
+        self.assertEqual(h.handle(thing), 'base')
+        self.assertEqual(h.called, [('base', thing)])
+
+
+    def test_subclass(self):
+        """
+        A class with no handler of its own is handled by the handler of its
+        nearest base class.
+        """
+        h = Handler()
+        thing = Sub()
+        self.assertEqual(h.handle(thing), 'base')
+        self.assertEqual(h.called, [('base', thing)])
+
+
+    def test_notHandled(self):
+        """
+        KeyError is raised for things with no handler, every time.
+        """
+        h = Handler()
+        self.assertRaises(KeyError, h.handle, Other())
+        self.assertRaises(KeyError, h.handle, Other())
+        self.assertRaises(KeyError, h.router.lookup, Other)
+
+
+    def test_handlerKeyError(self):
+        """
+        A KeyError raised by a handler comes out of call.
+        """
+        h = Handler()
+        exc = self.assertRaises(KeyError, h.router.call, 'key', 'arg')
+        self.assertEqual(exc.args, ('from inside',))
+
+
+    def test_boundOnce(self):
+        """
+        Each instance gets a single bound router, and instances don't share
+        them.
+        """
+        h1 = Handler()
+        h2 = Handler()
+        self.assertIdentical(h1.router, h1.router)
+        self.assertNotIdentical(h1.router, h2.router)
+        self.assertIdentical(Handler.router, Handler.router)
+        self.assertIdentical(h1.router._parent, Handler.router)
+
+
+    def test_lookup(self):
+        """
+        Looking up a handler on the class gets the function; on an instance
+        it gets a bound method.
+        """
+        self.assertEqual(Handler.router.lookup(Sub), Handler.__dict__['base'])
+        h = Handler()
+        h.router.lookup(Sub)('thing')
+        self.assertEqual(h.called, [('base', 'thing')])
+
+
+    def test_handleAfterLookup(self):
+        """
+        Registering a handler forgets cached lookups.
+        """
+        router = Router()
+        router.handle(Base)(lambda self, x: 'base')
+        self.assertEqual(router.lookup(Sub)(None, 1), 'base')
+        router.handle(Sub)(lambda self, x: 'sub')
+        self.assertEqual(router.lookup(Sub)(None, 1), 'sub')
+
+
+    def test_precompute(self):
+        """
+        Precomputing fills in the cache for registered keys and the extra
+        keys given.
+        """
+        router = Router()
+        router.handle(Base)(lambda self, x: 'base')
+        router.precompute(Sub, Other)
+        self.assertEqual(set(router._cache), set([Base, Sub, Other]))
+        self.assertEqual(router._cache[Other], None)
+
+
+    def test_sharedCache(self):
+        """
+        The routers bound to instances share what the class's router has
+        worked out, so they don't work it out again.
+        """
+        Handler.router.precompute(Sub)
+        h = Handler()
+        h.router._find = None
+        thing = Sub()
+        self.assertEqual(h.handle(thing), 'base')
+        self.assertEqual(h.called, [('base', thing)])
+        self.assertIdentical(h.router._cache, Handler.router._cache)
@@ -12,6 +12,7 @@ from xatro.error import NotAllowed
 from xatro.engine import XatroEngine
 from xatro.interface import IXatroEngine
 from xatro.standard import StandardRules
+from xatro.router import Router
 
 
 
@@ -130,6 +131,39 @@ class StandardRulesTest(TestCase):
                              "%r energy" % (hp, energy, actual))
 
 
+    def test_workRequirement_default(self):
+        """
+        Without a work scheduler, no work is required.
+        """
+        world = World(MagicMock())
+        rules = StandardRules()
+        self.assertEqual(rules.workRequirement(world, action.Look('foo')),
+                         None)
+
+
+    def test_workRequirement_scheduled(self):
+        """
+        With a work scheduler, the subject of an action must do the work it
+        hands out, and doing an action (or being destroyed) is reported back
+        to it.
+        """
+        scheduler = MagicMock()
+        scheduler.workFor.return_value = 'work'
+        rules = StandardRules(scheduler)
+        world = World(MagicMock(), XatroEngine(rules))
+
+        self.assertEqual(rules.workRequirement(world, action.Look('foo')),
+                         'work')
+        scheduler.workFor.assert_called_once_with('foo')
+
+        bot = world.create('bot')['id']
+        world.emit(ActionPerformed(action.Look(bot)), bot)
+        scheduler.actionDone.assert_called_once_with(bot)
+
+        world.destroy(bot)
+        scheduler.forget.assert_called_once_with(bot)
+
+
     def test_failIfNotOnBoard(self):
         """
         The following actions require a bot to be on the board.
@@ -760,6 +794,136 @@ class StandardRulesTest(TestCase):
         self.assertEqual(rules.winner, 'foo')
 
 
+    def test_pylonCounts(self):
+        """
+        The rules keep count of how many pylons each team owns.
+        """
+        world, rules = self.worldAndRules()
+        p1 = world.create('pylon')['id']
+        p2 = world.create('pylon')['id']
+        self.assertEqual(rules.pylons_per_team, {None: 2})
+
+        world.setAttr(p1, 'team', 'foo')
+        self.assertEqual(rules.pylons_per_team, {None: 1, 'foo': 1})
+
+        world.setAttr(p1, 'team', 'bar')
+        world.setAttr(p2, 'team', 'foo')
+        self.assertEqual(rules.pylons_per_team, {'bar': 1, 'foo': 1})
+        self.assertEqual(rules.pylon_teams, {p1: 'bar', p2: 'foo'})
+
+
+    def test_winConditionSubscribers(self):
+        """
+        Subscribers are told when a pylon changes hands, but not about other
+        changes to pylons.
+        """
+        world, rules = self.worldAndRules()
+        called = []
+        rules.subscribeToWinCondition(lambda *args: called.append(args))
+        p1 = world.create('pylon')['id']
+        p2 = world.create('pylon')['id']
+        self.assertEqual(called, [({None: 1}, None), ({None: 2}, None)])
+
+        del called[:]
+        world.setAttr(p1, 'locks', 2)
+        world.setAttr(p1, 'team', None)
+        self.assertEqual(called, [])
+
+        world.setAttr(p1, 'team', 'foo')
+        world.setAttr(p2, 'team', 'foo')
+        self.assertEqual(called, [
+            ({None: 1, 'foo': 1}, None),
+            ({'foo': 2}, 'foo'),
+        ])
+
+
+    def test_unsubscribeFromWinCondition(self):
+        """
+        Subscribers can stop being told about the win condition, and ones that
+        fail don't stop others from being told.
+        """
+        world, rules = self.worldAndRules()
+        called = []
+        def fail(pylons, winner):
+            raise Exception('oops')
+        def succeed(pylons, winner):
+            called.append(pylons)
+        rules.subscribeToWinCondition(fail)
+        rules.subscribeToWinCondition(succeed)
+        world.create('pylon')
+        self.assertEqual(called, [{None: 1}])
+
+        rules.unsubscribeFromWinCondition(succeed)
+        world.create('pylon')
+        self.assertEqual(called, [{None: 1}])
+        self.assertRaises(ValueError, rules.unsubscribeFromWinCondition,
+                          succeed)
+
+
+    def test_pylonDestroyed(self):
+        """
+        Destroying the last pylon a team didn't own wins it the game.
+        """
+        world, rules = self.worldAndRules()
+        called = []
+        p1 = world.create('pylon')['id']
+        p2 = world.create('pylon')['id']
+        world.setAttr(p1, 'team', 'foo')
+        rules.subscribeToWinCondition(lambda *args: called.append(args))
+
+        world.destroy(p2)
+        self.assertEqual(rules.pylons_per_team, {'foo': 1})
+        self.assertEqual(rules.winner, 'foo')
+        self.assertEqual(called, [({'foo': 1}, 'foo')])
+
+
+    def test_worldRecoveredNoWinner(self):
+        """
+        A recovered world where one team owns only some of the pylons has no
+        winner.
+        """
+        world, rules = self.worldAndRules()
+        for team in ['foo', 'foo', None]:
+            pylon = world.create('pylon')['id']
+            world.setAttr(pylon, 'team', team)
+
+        rules2 = StandardRules()
+        world2 = World(MagicMock(), XatroEngine(rules2))
+        world2.restore(world.snapshot())
+        rules2.worldRecovered(world2)
+        self.assertEqual(rules2.pylons_per_team, {'foo': 2, None: 1})
+        self.assertEqual(rules2.winner, None)
+
+
+    def test_worldRecovered(self):
+        """
+        When a world is recovered, the rules rebuild what they know about
+        teams and the winner from it.
+        """
+        world, rules = self.worldAndRules()
+        square = world.create('square')['id']
+        landed = world.create('bot')['id']
+        world.setAttr(landed, 'team', 'foo')
+        world.setAttr(landed, 'location', square)
+        on_deck = world.create('bot')['id']
+        world.setAttr(on_deck, 'team', 'bar')
+        world.create('bot')
+        pylon = world.create('pylon')['id']
+        world.setAttr(pylon, 'team', 'foo')
+
+        rules2 = StandardRules()
+        world2 = World(MagicMock(), XatroEngine(rules2))
+        world2.restore(world.snapshot())
+        rules2.worldRecovered(world2)
+
+        self.assertEqual(rules2.bot_teams, rules.bot_teams)
+        self.assertEqual(rules2.bot_teams, {landed: 'foo', on_deck: 'bar'})
+        self.assertEqual(dict(rules2.bots_per_team_on_squares),
+                         {'foo': set([landed])})
+        self.assertEqual(rules2.winner, 'foo')
+        self.assertEqual(rules2.pylons_per_team, rules.pylons_per_team)
+
+
     @defer.inlineCallbacks
     def test_afterWinNothingIsAllowed(self):
         """
@@ -781,3 +945,98 @@ class StandardRulesTest(TestCase):
 
 
 
+
+
+
+class RequirementsTest(TestCase):
+
+
+    def shootingWorld(self):
+        world = World(MagicMock())
+        square = world.create('square')['id']
+        bot = world.create('bot')['id']
+        action.Move(bot, square).execute(world)
+        target = world.create('bot')['id']
+        action.Move(target, square).execute(world)
+        world.setAttr(target, 'hp', 10)
+        return world, square, bot, target
+
+
+    def test_singleFunction(self):
+        """
+        However many requirements a rule has, it is a single function which
+        checks them in the order they are listed.
+        """
+        rule = StandardRules.isAllowedRouter.lookup(action.Shoot)
+        self.assertEqual(rule.body.__name__, 'isAllowed_Shoot')
+        self.assertEqual(len(rule.requirements), 4)
+        self.assertEqual(rule.requirements[0].__name__, '_checkSquare')
+
+
+    def test_subclassRouter(self):
+        """
+        A subclass with its own router has its own rules checked, and
+        instances don't share the rules they have looked up.
+        """
+        class Lenient(StandardRules):
+            isAllowedRouter = Router()
+
+            @isAllowedRouter.handle(action.Shoot)
+            def isAllowed_Shoot(self, world, action):
+                pass
+
+        world, square, bot, target = self.shootingWorld()
+        shoot = action.Shoot(bot, target, 1)
+        Lenient().isAllowed(world, shoot)
+        self.assertRaises(NotAllowed, StandardRules().isAllowed, world, shoot)
+        Lenient().isAllowed(world, shoot)
+
+
+    def test_messages(self):
+        """
+        The first requirement that isn't met says why.
+        """
+        world, square, bot, target = self.shootingWorld()
+        rules = StandardRules()
+        shoot = action.Shoot(bot, target, 1)
+
+        world.setAttr(bot, 'tool', 'wrench')
+        world.setAttr(target, 'hp', 0)
+        exc = self.assertRaises(NotAllowed, rules.isAllowed, world, shoot)
+        self.assertEqual(str(exc), 'You must have a cannon equipped')
+
+        world.setAttr(bot, 'tool', 'cannon')
+        exc = self.assertRaises(NotAllowed, rules.isAllowed, world, shoot)
+        self.assertEqual(str(exc), "The target isn't a vulnerable thing")
+
+        action.Move(bot, None).execute(world)
+        exc = self.assertRaises(NotAllowed, rules.isAllowed, world, shoot)
+        self.assertEqual(str(exc), 'You must be on the board')
+
+
+    def test_fetchOnce(self):
+        """
+        Each object an action refers to is only gotten from the world once
+        while checking whether it's allowed.
+        """
+        world, square, bot, target = self.shootingWorld()
+        world.setAttr(bot, 'tool', 'cannon')
+        rules = StandardRules()
+        world.get = MagicMock(wraps=world.get)
+
+        rules.isAllowed(world, action.Shoot(bot, target, 1))
+
+        fetched = [c[0][0] for c in world.get.call_args_list]
+        self.assertEqual(sorted(fetched), sorted([bot, target]))
+
+
+    def test_missingObject(self):
+        """
+        As before rules were compiled, a missing object that a requirement
+        refers to doesn't stop an action from being allowed (it will fail
+        when it's done instead).
+        """
+        world, square, bot, target = self.shootingWorld()
+        world.setAttr(bot, 'tool', 'cannon')
+        rules = StandardRules()
+        rules.isAllowed(world, action.Shoot(bot, 'nothing', 1))
@@ -1,7 +1,10 @@
 from twisted.trial.unittest import TestCase
 
+from mock import MagicMock
 
-from xatro.state import State
+import marshal
+
+from xatro.state import State, CompactState, Record
 from xatro.event import Created, Destroyed, AttrSet, ItemAdded, ItemRemoved
 from xatro.event import AttrDel
 
@@ -83,4 +86,255 @@ class StateTest(TestCase):
         state = State()
         state.eventReceived('foo')
         class Foo(object): pass
-        state.eventReceived(Foo())
\ No newline at end of file
+        state.eventReceived(Foo())
+
+
+    def test_byKind(self):
+        """
+        Objects are indexed by kind.
+        """
+        state = State()
+        state.eventReceived(Created('foo'))
+        state.eventReceived(Created('bar'))
+        state.eventReceived(Created('baz'))
+        state.eventReceived(AttrSet('foo', 'kind', 'square'))
+        state.eventReceived(AttrSet('bar', 'kind', 'square'))
+        state.eventReceived(AttrSet('baz', 'kind', 'ore'))
+        self.assertEqual(state.byKind('square'), set(['foo', 'bar']))
+        self.assertEqual(state.byKind('ore'), set(['baz']))
+        self.assertEqual(state.byKind('nothing'), set())
+
+        # change kind
+        state.eventReceived(AttrSet('baz', 'kind', 'lifesource'))
+        self.assertEqual(state.byKind('ore'), set())
+        self.assertEqual(state.byKind('lifesource'), set(['baz']))
+
+        # destroy
+        state.eventReceived(Destroyed('foo'))
+        self.assertEqual(state.byKind('square'), set(['bar']))
+
+        # delete kind
+        state.eventReceived(AttrDel('bar', 'kind'))
+        self.assertEqual(state.byKind('square'), set())
+        self.assertEqual(state.kinds, {'lifesource': set(['baz'])})
+
+
+    def test_byKind_copy(self):
+        """
+        Changing the set returned by byKind doesn't change the index.
+        """
+        state = State()
+        state.eventReceived(Created('foo'))
+        state.eventReceived(AttrSet('foo', 'kind', 'square'))
+        state.byKind('square').clear()
+        self.assertEqual(state.byKind('square'), set(['foo']))
+
+
+    def test_summary(self):
+        """
+        The kinds of things in the contents of an object are counted.
+        """
+        state = State()
+        for id, kind in [('sq', 'square'), ('b1', 'bot'), ('b2', 'bot'),
+                         ('o', 'ore')]:
+            state.eventReceived(Created(id))
+            state.eventReceived(AttrSet(id, 'kind', kind))
+
+        state.eventReceived(ItemAdded('sq', 'contents', 'b1'))
+        state.eventReceived(ItemAdded('sq', 'contents', 'b2'))
+        state.eventReceived(ItemAdded('sq', 'contents', 'o'))
+        self.assertEqual(state.summary('sq'), {'bot': 2, 'ore': 1})
+
+        state.eventReceived(ItemRemoved('sq', 'contents', 'b1'))
+        self.assertEqual(state.summary('sq'), {'bot': 1, 'ore': 1})
+
+        # change of kind
+        state.eventReceived(AttrSet('o', 'kind', 'lifesource'))
+        self.assertEqual(state.summary('sq'), {'bot': 1, 'lifesource': 1})
+
+        # destruction
+        state.eventReceived(Destroyed('b2'))
+        self.assertEqual(state.summary('sq'), {'lifesource': 1})
+        state.eventReceived(ItemRemoved('sq', 'contents', 'b2'))
+        self.assertEqual(state.summary('sq'), {'lifesource': 1})
+
+        self.assertEqual(state.summary('nothing'), {})
+
+
+    def test_board_revision(self):
+        """
+        The board revision changes when squares or their summaries change, but
+        not when other things change.
+        """
+        state = State()
+        state.eventReceived(Created('sq'))
+        state.eventReceived(AttrSet('sq', 'kind', 'square'))
+        state.eventReceived(Created('bot'))
+        state.eventReceived(AttrSet('bot', 'kind', 'bot'))
+
+        rev = state.board_revision
+        state.eventReceived(AttrSet('bot', 'hp', 10))
+        self.assertEqual(state.board_revision, rev)
+
+        state.eventReceived(AttrSet('sq', 'coordinates', (0, 0)))
+        self.assertNotEqual(state.board_revision, rev)
+
+        rev = state.board_revision
+        state.eventReceived(ItemAdded('sq', 'contents', 'bot'))
+        self.assertNotEqual(state.board_revision, rev)
+
+
+    def test_tracer(self):
+        """
+        Every event is given to the tracer, if there is one.
+        """
+        tracer = MagicMock()
+        state = State(tracer)
+        state.eventReceived(Created('foo'))
+        tracer.eventReceived.assert_called_once_with(Created('foo'))
+
+
+
+class StateSnapshotTest(TestCase):
+
+
+    def populate(self, state):
+        for event in [
+            Created('square'),
+            AttrSet('square', 'kind', 'square'),
+            Created('bot'),
+            AttrSet('bot', 'kind', 'bot'),
+            AttrSet('bot', 'coordinates', (1, 2)),
+            ItemAdded('square', 'contents', 'bot'),
+            AttrSet('bot', 'location', 'square'),
+        ]:
+            state.eventReceived(event)
+
+
+    def assertSameState(self, a, b):
+        self.assertEqual(a.state, b.state)
+        self.assertEqual(a.kinds, b.kinds)
+        self.assertEqual(a.summaries, b.summaries)
+        self.assertEqual(a.board_revision, b.board_revision)
+
+
+    def test_restore(self):
+        """
+        A state restored from a marshalled snapshot of another is the same as
+        it, and keeps working the same way.
+        """
+        state = State()
+        self.populate(state)
+        restored = State()
+        objects = restored.state
+        restored.restore(marshal.loads(marshal.dumps(state.snapshot())))
+
+        self.assertIdentical(restored.state, objects, "Should update the "
+                             "same dict")
+        self.assertSameState(restored, state)
+
+        for s in [state, restored]:
+            s.eventReceived(ItemRemoved('square', 'contents', 'bot'))
+            s.eventReceived(Destroyed('bot'))
+        self.assertSameState(restored, state)
+
+
+    def test_restoreCompact(self):
+        """
+        Compact states can be snapshotted and restored too.
+        """
+        state = CompactState()
+        self.populate(state)
+        restored = CompactState()
+        restored.restore(marshal.loads(marshal.dumps(state.snapshot())))
+
+        self.assertTrue(isinstance(restored.state['bot'], Record))
+        self.assertSameState(restored, state)
+
+
+
+class CompactStateTest(TestCase):
+
+
+    def test_Created(self):
+        """
+        Objects are held in Records.
+        """
+        state = CompactState()
+        state.eventReceived(Created('foo'))
+        self.assertTrue(isinstance(state.state['foo'], Record))
+        self.assertEqual(state.state['foo'], {'id': 'foo'})
+
+
+    def test_events(self):
+        """
+        Records are changed by events just like dicts are.
+        """
+        state = CompactState()
+        state.eventReceived(Created('foo'))
+        state.eventReceived(AttrSet('foo', 'hp', 4))
+        state.eventReceived(AttrSet('foo', 'odd', 'thing'))
+        state.eventReceived(ItemAdded('foo', 'contents', 'bar'))
+        state.eventReceived(ItemAdded('foo', 'contents', 'baz'))
+        state.eventReceived(ItemRemoved('foo', 'contents', 'bar'))
+        state.eventReceived(AttrDel('foo', 'hp'))
+        self.assertEqual(state.state['foo'], {
+            'id': 'foo',
+            'odd': 'thing',
+            'contents': ['baz'],
+        })
+
+
+
+class RecordTest(TestCase):
+
+
+    def test_mapping(self):
+        """
+        A Record can be used like a dict.
+        """
+        r = Record('foo')
+        r['kind'] = 'bot'
+        r['location'] = None
+        r['something'] = 'else'
+
+        self.assertEqual(r['kind'], 'bot')
+        self.assertEqual(r.get('location', 'default'), None)
+        self.assertEqual(r.get('hp', 'default'), 'default')
+        self.assertIn('location', r)
+        self.assertIn('something', r)
+        self.assertNotIn('hp', r)
+        self.assertRaises(KeyError, lambda: r['hp'])
+        self.assertEqual(sorted(r.keys()),
+                         ['id', 'kind', 'location', 'something'])
+        self.assertEqual(len(r), 4)
+        self.assertEqual(r.toDict(), {
+            'id': 'foo',
+            'kind': 'bot',
+            'location': None,
+            'something': 'else',
+        })
+
+        del r['location']
+        del r['something']
+        self.assertEqual(r, {'id': 'foo', 'kind': 'bot'})
+        self.assertRaises(KeyError, r.__delitem__, 'location')
+        self.assertRaises(KeyError, r.__delitem__, 'something')
+
+
+    def test_internKind(self):
+        """
+        Kinds are interned.
+        """
+        r1 = Record('1')
+        r1['kind'] = ''.join(['en', 'ergy'])
+        r2 = Record('2')
+        r2['kind'] = ''.join(['ener', 'gy'])
+        self.assertIdentical(r1['kind'], r2['kind'])
+
+
+    def test_slots(self):
+        """
+        Records don't have a __dict__.
+        """
+        self.assertFalse(hasattr(Record('foo'), '__dict__'))
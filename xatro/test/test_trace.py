@@ -0,0 +1,109 @@
+from twisted.trial.unittest import TestCase
+from twisted.python import log
+
+from xatro.trace import EventTracer, parseLevel, parseSample
+from xatro.event import ActionPerformed, Created
+
+
+
+class EventTracerTest(TestCase):
+
+
+    def logged(self):
+        """
+        Capture the messages logged during a test.
+        """
+        messages = []
+        def observer(event):
+            messages.append(event['message'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+        return messages
+
+
+    def test_default(self):
+        """
+        By default, nothing is logged or remembered.
+        """
+        messages = self.logged()
+        tracer = EventTracer()
+        tracer.eventReceived(Created('foo'))
+        self.assertEqual(messages, [])
+        self.assertEqual(list(tracer.recent), [])
+
+
+    def test_events(self):
+        """
+        At the EVENTS level every event is logged.
+        """
+        messages = self.logged()
+        tracer = EventTracer(EventTracer.EVENTS)
+        tracer.eventReceived(Created('foo'))
+        tracer.eventReceived(ActionPerformed('bar'))
+        self.assertEqual(messages, [(Created('foo'),),
+                                    (ActionPerformed('bar'),)])
+
+
+    def test_actions(self):
+        """
+        At the ACTIONS level only ActionPerformed events are logged.
+        """
+        messages = self.logged()
+        tracer = EventTracer(EventTracer.ACTIONS)
+        tracer.eventReceived(Created('foo'))
+        tracer.eventReceived(ActionPerformed('bar'))
+        self.assertEqual(messages, [(ActionPerformed('bar'),)])
+
+
+    def test_levelName(self):
+        """
+        Levels can be given by name.
+        """
+        self.assertEqual(EventTracer('events').level, EventTracer.EVENTS)
+        self.assertEqual(EventTracer('actions').level, EventTracer.ACTIONS)
+        self.assertEqual(EventTracer('off').level, EventTracer.OFF)
+
+
+    def test_unknownLevelName(self):
+        """
+        A level name that isn't known is refused rather than taken as a
+        level.
+        """
+        self.assertRaises(ValueError, EventTracer, 'action')
+        self.assertRaises(ValueError, parseLevel, 'action')
+        self.assertEqual(parseLevel('actions'), EventTracer.ACTIONS)
+
+
+    def test_badSample(self):
+        """
+        The sample rate must be at least 1.
+        """
+        self.assertRaises(ValueError, EventTracer, sample=0)
+        self.assertRaises(ValueError, parseSample, '0')
+        self.assertRaises(ValueError, parseSample, 'x')
+        self.assertEqual(parseSample('3'), 3)
+
+
+    def test_sample(self):
+        """
+        Only 1 out of every C{sample} events is logged.
+        """
+        messages = self.logged()
+        tracer = EventTracer(EventTracer.EVENTS, sample=3)
+        for i in xrange(7):
+            tracer.eventReceived(Created(i))
+        self.assertEqual(messages, [(Created(2),), (Created(5),)])
+
+
+    def test_dump(self):
+        """
+        The last C{keep} events are remembered even when they aren't logged,
+        and can be dumped to the log.
+        """
+        tracer = EventTracer(keep=2)
+        for i in xrange(3):
+            tracer.eventReceived(Created(i))
+
+        messages = self.logged()
+        self.assertEqual(tracer.dump(), [Created(1), Created(2)])
+        self.assertEqual(messages[1:], [(Created(1),), (Created(2),)])
@@ -1,8 +1,13 @@
 from twisted.trial.unittest import TestCase
+from twisted.internet import task
+from twisted.python.threadpool import ThreadPool
 from itertools import product
 from hashlib import sha1
 
-from xatro.work import WorkMaker
+from xatro.work import WorkMaker, Work, InlineVerifier, BatchVerifier
+from xatro.work import AdaptiveWorkScheduler, ReplayCache
+from xatro.work import digestThreshold, expectedHashes, searchAnswers
+from xatro.work import StreamSolver, ProcessSolver
 
 
 POOL = map(chr, xrange(0, 255))
@@ -112,3 +117,420 @@ class WorkMakerTest(TestCase):
         self.assertEqual(maker.isResult(work, None), False)
 
 
+
+    def test_isResult_matchesIntegerCompare(self):
+        """
+        Comparing digests gives the same answers as comparing the hashes as
+        numbers, including right at the goal.
+        """
+        maker = WorkMaker()
+        for i in xrange(200):
+            answer = str(i)
+            result = int(sha1('nonce' + answer).hexdigest(), 16)
+            for goal in [result - 1, result, result + 1, 0, MAX_SHA / 2,
+                         maker.makeGoal(), maker.makeGoal(1, 3)]:
+                self.assertEqual(maker.isResult(Work(goal, 'nonce'), answer),
+                                 validAnswer('nonce', goal, answer),
+                                 "goal %r, answer %r" % (goal, answer))
+
+
+    def test_isResult_goalOutOfRange(self):
+        """
+        Every hash beats a negative goal and none beat the biggest hash.
+        """
+        maker = WorkMaker()
+        self.assertEqual(maker.isResult(Work(-1, 'nonce'), 'a'), True)
+        self.assertEqual(maker.isResult(Work(MAX_SHA, 'nonce'), 'a'), False)
+        self.assertEqual(maker.isResult(Work(MAX_SHA * 2, 'nonce'), 'a'),
+                         False)
+
+
+    def test_thresholdsBounded(self):
+        """
+        Only so many goals' thresholds are remembered.
+        """
+        maker = WorkMaker()
+        maker.max_thresholds = 10
+        for goal in xrange(25):
+            maker.isResult(Work(goal, 'nonce'), 'a')
+        self.assertTrue(len(maker._thresholds) <= 10)
+
+
+
+class ReplayCacheTest(TestCase):
+
+
+    def cache(self, **kwargs):
+        cache = ReplayCache(clock=task.Clock(), **kwargs)
+        return cache
+
+
+    def test_add(self):
+        """
+        Solutions that have been added are in the cache.
+        """
+        cache = self.cache()
+        self.assertFalse(('nonce', 'answer') in cache)
+        cache.add(('nonce', 'answer'))
+        self.assertTrue(('nonce', 'answer') in cache)
+        self.assertFalse(('nonce', 'other') in cache)
+
+
+    def test_ttl(self):
+        """
+        Solutions are forgotten after C{ttl} seconds.
+        """
+        cache = self.cache(ttl=10)
+        cache.add(('nonce', 'a'))
+        cache.clock.advance(5)
+        cache.add(('nonce', 'b'))
+        cache.clock.advance(5)
+        self.assertFalse(('nonce', 'a') in cache)
+        self.assertTrue(('nonce', 'b') in cache)
+
+        cache.add(('nonce', 'c'))
+        self.assertEqual(len(cache), 2)
+
+
+    def test_size(self):
+        """
+        Only the most recent C{size} solutions are remembered.
+        """
+        cache = self.cache(size=3)
+        for answer in 'abcde':
+            cache.add(('nonce', answer))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual([('nonce', x) in cache for x in 'abcde'],
+                         [False, False, True, True, True])
+
+
+    def test_addAgain(self):
+        """
+        Adding a solution again after it expired remembers it anew.
+        """
+        cache = self.cache(ttl=10)
+        cache.add(('nonce', 'a'))
+        cache.clock.advance(10)
+        cache.add(('nonce', 'a'))
+        self.assertTrue(('nonce', 'a') in cache)
+        cache.clock.advance(9)
+        self.assertTrue(('nonce', 'a') in cache)
+        self.assertEqual(len(cache), 1)
+
+
+
+class AdaptiveWorkSchedulerTest(TestCase):
+
+
+    def scheduler(self, **kwargs):
+        scheduler = AdaptiveWorkScheduler(WorkMaker(10, 10000),
+                                          clock=task.Clock(), **kwargs)
+        return scheduler
+
+
+    def test_workFor(self):
+        """
+        A bot keeps getting the same work until it does an action, and starts
+        at the easiest scale.
+        """
+        scheduler = self.scheduler()
+        work = scheduler.workFor('bot')
+        self.assertEqual(scheduler.workFor('bot'), work)
+        self.assertEqual(work.goal, scheduler.work_maker.makeGoal(10, 10000))
+        self.assertNotEqual(scheduler.workFor('other').nonce, work.nonce)
+
+        scheduler.actionDone('bot')
+        self.assertNotEqual(scheduler.workFor('bot').nonce, work.nonce)
+
+
+    def test_actionDone_noWork(self):
+        """
+        Actions by bots that weren't given work don't count.
+        """
+        scheduler = self.scheduler()
+        scheduler.actionDone('bot')
+        self.assertEqual(scheduler.rate('bot'), 0)
+
+        scheduler.workFor('bot')
+        scheduler.actionDone('bot')
+        scheduler.actionDone('bot')
+        self.assertEqual(scheduler.rate('bot'), 1.0 / scheduler.window)
+
+
+    def test_fastBot(self):
+        """
+        Bots that act faster than the target rate are given harder work, up
+        to the maximum scale.
+        """
+        scheduler = self.scheduler(target_rate=1.0, max_scale=100000)
+        for i in xrange(50):
+            scheduler.workFor('bot')
+            scheduler.actionDone('bot')
+            scheduler.clock.advance(0.01)
+        scheduler.workFor('bot')
+        self.assertEqual(scheduler.scale('bot'), 100000)
+
+
+    def test_idleBot(self):
+        """
+        Bots that have been idle are given easier work, down to the minimum
+        scale, by at most C{step} at a time.
+        """
+        scheduler = self.scheduler(target_rate=1.0, step=2.0)
+        for i in xrange(50):
+            scheduler.workFor('bot')
+            scheduler.actionDone('bot')
+            scheduler.clock.advance(0.01)
+        scheduler.workFor('bot')
+        scale = scheduler.scale('bot')
+        self.assertTrue(scale > 10000)
+
+        scheduler.clock.advance(100)
+        scheduler.actionDone('bot')
+        scheduler.workFor('bot')
+        self.assertEqual(scheduler.scale('bot'), scale / 2)
+
+        for i in xrange(20):
+            scheduler.clock.advance(100)
+            scheduler.actionDone('bot')
+            scheduler.workFor('bot')
+        self.assertEqual(scheduler.scale('bot'), 10000)
+
+
+    def test_forget(self):
+        """
+        Forgotten bots start over.
+        """
+        scheduler = self.scheduler()
+        work = scheduler.workFor('bot')
+        scheduler.actionDone('bot')
+        scheduler.forget('bot')
+        self.assertEqual(scheduler.rate('bot'), 0)
+        self.assertEqual(scheduler.scale('bot'), 10000)
+        self.assertNotEqual(scheduler.workFor('bot').nonce, work.nonce)
+        scheduler.forget('nobody')
+
+
+    def test_simulatedLoad(self):
+        """
+        Bots that can hash at very different speeds all settle at about the
+        target action rate, so the server checks about the same number of
+        solutions from each however hard they try.
+        """
+        target = 2.0
+        scheduler = self.scheduler(target_rate=target, window=5.0,
+                                   max_scale=10 ** 9)
+        # hashes per second each bot can do
+        speeds = {'slow': 5000, 'medium': 50000, 'fast': 500000}
+        next_action = dict.fromkeys(speeds, 0.0)
+        actions = dict.fromkeys(speeds, 0)
+        clock = scheduler.clock
+
+        def run(seconds):
+            end = clock.seconds() + seconds
+            while True:
+                bot = min(next_action, key=next_action.get)
+                if next_action[bot] > end:
+                    break
+                clock.advance(next_action[bot] - clock.seconds())
+                scheduler.actionDone(bot)
+                actions[bot] += 1
+                # the expected number of hashes to solve the new work
+                work = scheduler.workFor(bot)
+                p = float(scheduler.work_maker.MAX_SHA - work.goal)
+                hashes = scheduler.work_maker.MAX_SHA / p
+                next_action[bot] = clock.seconds() + hashes / speeds[bot]
+            clock.advance(end - clock.seconds())
+
+        # settle down
+        run(120)
+        for bot in speeds:
+            actions[bot] = 0
+        run(100)
+
+        for bot in speeds:
+            rate = actions[bot] / 100.0
+            self.assertTrue(abs(rate - target) < target * 0.1,
+                            "%s bot acted %r times a second, not about %r" % (
+                            bot, rate, target))
+        self.assertTrue(scheduler.scale('slow') < scheduler.scale('medium') <
+                        scheduler.scale('fast'))
+
+
+
+class InlineVerifierTest(TestCase):
+
+
+    def test_verify(self):
+        """
+        Solutions are checked right away with the work maker.
+        """
+        maker = WorkMaker()
+        verifier = InlineVerifier(maker)
+        work = maker.getWork(1, 1000000)
+        self.assertEqual(self.successResultOf(verifier.verify(work, 'hey')),
+                         False)
+        self.assertEqual(self.successResultOf(
+                         verifier.verify(Work(0, 'bar'), 'hey')), True)
+
+
+
+class BatchVerifierTest(TestCase):
+
+
+    def test_verify(self):
+        """
+        Solutions are checked together on a later turn of the reactor.
+        """
+        maker = WorkMaker()
+        verifier = BatchVerifier(maker, clock=task.Clock())
+
+        bad = verifier.verify(maker.getWork(1, 1000000), 'hey')
+        good = verifier.verify(Work(0, 'bar'), 'hey')
+        self.assertNoResult(bad)
+        self.assertNoResult(good)
+
+        verifier.clock.advance(0)
+        self.assertEqual(self.successResultOf(bad), False)
+        self.assertEqual(self.successResultOf(good), True)
+
+
+    def test_batchSize(self):
+        """
+        At most batch_size solutions are checked on each turn of the reactor.
+        """
+        verifier = BatchVerifier(WorkMaker(), batch_size=2, clock=task.Clock())
+        batches = []
+        check = verifier._checkBatch
+        def _checkBatch(pairs):
+            batches.append(len(pairs))
+            return check(pairs)
+        verifier._checkBatch = _checkBatch
+
+        ds = [verifier.verify(Work(0, 'bar'), str(i)) for i in xrange(5)]
+        verifier.clock.advance(0)
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual([self.successResultOf(d) for d in ds], [True] * 5)
+        self.assertEqual(verifier.clock.getDelayedCalls(), [])
+
+
+    def test_error(self):
+        """
+        If checking a batch fails, every solution in it fails.
+        """
+        maker = WorkMaker()
+        maker.isResult = lambda work, result: 1 / 0
+        verifier = BatchVerifier(maker, clock=task.Clock())
+
+        d1 = verifier.verify(Work(0, 'bar'), 'a')
+        d2 = verifier.verify(Work(0, 'bar'), 'b')
+        verifier.clock.advance(0)
+        self.failureResultOf(d1, ZeroDivisionError)
+        self.failureResultOf(d2, ZeroDivisionError)
+
+
+    def test_threadpool(self):
+        """
+        If given a thread pool, batches are checked in it.
+        """
+        pool = ThreadPool(1, 1)
+        pool.start()
+        self.addCleanup(pool.stop)
+
+        maker = WorkMaker()
+        verifier = BatchVerifier(maker, threadpool=pool)
+        work = maker.getWork()
+        d1 = verifier.verify(work, findResult(work.nonce, work.goal))
+        d2 = verifier.verify(maker.getWork(1, 1000000), 'hey')
+        d = d1.addCallback(lambda r: self.assertEqual(r, True))
+        d.addCallback(lambda _: d2)
+        return d.addCallback(self.assertEqual, False)
+
+
+
+class SolverTest(TestCase):
+
+
+    def test_digestThreshold(self):
+        """
+        The threshold is the goal as a 20-byte big-endian string.
+        """
+        self.assertEqual(digestThreshold(0), '\x00' * 20)
+        self.assertEqual(digestThreshold(0x1ff), '\x00' * 18 + '\x01\xff')
+        self.assertEqual(digestThreshold(MAX_SHA), '\xff' * 20)
+        self.assertEqual(digestThreshold(-1), '')
+
+
+    def test_expectedHashes(self):
+        """
+        The expected number of hashes is the inverse of the chance that a
+        hash beats the goal.
+        """
+        maker = WorkMaker()
+        self.assertAlmostEqual(expectedHashes(maker.getWork(10, 10000)),
+                               1000, 3)
+        self.assertAlmostEqual(expectedHashes(maker.getWork(1, 2)), 2, 3)
+        self.assertEqual(expectedHashes(Work(-1, 'nonce')), 1)
+
+
+    def test_searchAnswers(self):
+        """
+        The answer found solves the work, and is the first one that does.
+        """
+        maker = WorkMaker()
+        work = maker.getWork(1, 100)
+        answer = searchAnswers(work)
+        self.assertTrue(maker.isResult(work, answer))
+        for i in xrange(int(answer, 16)):
+            self.assertFalse(maker.isResult(work, '%x' % (i,)))
+
+
+    def test_searchAnswers_range(self):
+        """
+        Only answers in the range given are tried.
+        """
+        maker = WorkMaker()
+        work = maker.getWork(1, 100)
+        first = int(searchAnswers(work), 16)
+        self.assertEqual(searchAnswers(work, 0, first), None)
+        self.assertEqual(searchAnswers(work, first, first + 1),
+                         '%x' % (first,))
+        answer = searchAnswers(work, first + 1, step=3)
+        self.assertEqual((int(answer, 16) - first - 1) % 3, 0)
+        self.assertTrue(maker.isResult(work, answer))
+
+
+    def test_StreamSolver(self):
+        maker = WorkMaker()
+        solver = StreamSolver()
+        work = maker.getWork()
+        self.assertTrue(maker.isResult(work, solver.solve(work)))
+        solver.close()
+
+
+    def test_ProcessSolver(self):
+        """
+        Answers are searched for in several processes.
+        """
+        maker = WorkMaker()
+        solver = ProcessSolver(2, chunk_size=100)
+        self.addCleanup(solver.close)
+        for i in xrange(3):
+            work = maker.getWork()
+            self.assertTrue(maker.isResult(work, solver.solve(work)))
+
+
+    def test_ProcessSolver_search(self):
+        """
+        A range of answers is split between the processes, and the first
+        answer in it is found.
+        """
+        maker = WorkMaker()
+        solver = ProcessSolver(3)
+        self.addCleanup(solver.close)
+        work = maker.getWork(1, 100)
+        first = int(searchAnswers(work), 16)
+        self.assertEqual(solver.search(work, 0, first), None)
+        self.assertEqual(solver.search(work, 0, first + 1), '%x' % (first,))
+        self.assertEqual(solver.search(work, first, first + 1),
+                         '%x' % (first,))
@@ -1,11 +1,13 @@
 from twisted.trial.unittest import TestCase
 from twisted.internet import defer
 
-from mock import MagicMock
+from mock import MagicMock, call
 
-from xatro.world import World
+from xatro.world import World, _CallMemory, _Callbacks
+from xatro.state import Record
 from xatro.event import Created, Destroyed, AttrSet, ItemAdded, ItemRemoved
 from xatro.event import ActionPerformed, AttrDel
+from xatro.action import Move
 
 
 
@@ -31,6 +33,117 @@ class WorldTest(TestCase):
         self.assertEqual(world.auth, 'auth')
 
 
+    def test_tracer(self):
+        """
+        A world can have an event tracer, which is told about every event.
+        """
+        tracer = MagicMock()
+        world = World(MagicMock(), tracer=tracer)
+        self.assertEqual(world.tracer, tracer)
+
+        world.emit('foo', 'object_id')
+        tracer.eventReceived.assert_called_once_with('foo')
+
+
+    def test_sequence(self):
+        """
+        Events are numbered in the order they are processed, and the number
+        of the event being processed is available while it is.
+        """
+        world = World(MagicMock())
+        self.assertEqual(world.sequence, 0)
+        seen = []
+        def receiver(event):
+            seen.append((world.sequence, event))
+            if event == 'first':
+                world.emit('third', 'bar')
+        world.subscribeTo('foo', receiver)
+        world.subscribeTo('bar', receiver)
+
+        world.emit('first', 'foo')
+        world.emit('second', 'foo')
+
+        self.assertEqual(seen, [(1, 'first'), (2, 'third'), (3, 'second')])
+        self.assertEqual(world.sequence, 3)
+
+
+    def test_eventLog(self):
+        """
+        Every event is appended to the world's event log with its sequence
+        number.
+        """
+        event_log = MagicMock()
+        world = World(MagicMock(), event_log=event_log)
+        self.assertEqual(world.event_log, event_log)
+
+        world.emit('foo', 'object_id')
+        world.emit('bar', 'object_id')
+        self.assertEqual(event_log.append.call_args_list, [
+            call(1, 'foo'),
+            call(2, 'bar'),
+        ])
+
+
+    def test_eventLogPassedAlong(self):
+        """
+        An event passed along from one object to another is only numbered and
+        logged once.
+        """
+        event_log = MagicMock()
+        world = World(MagicMock(), event_log=event_log)
+        world.subscribeTo('thing', world.emitterFor('container'))
+
+        world.emit('foo', 'thing')
+        self.assertEqual(event_log.append.call_args_list, [call(1, 'foo')])
+        self.assertEqual(world.sequence, 1)
+
+
+    def test_snapshot(self):
+        """
+        A world can be restored from a snapshot of another, including its
+        sequence number, without anyone being told.
+        """
+        world = World(MagicMock())
+        thing = world.create('thing')['id']
+        world.setAttr(thing, 'hp', 3)
+
+        receiver = MagicMock()
+        engine = MagicMock()
+        world2 = World(receiver, engine)
+        objects = world2.objects
+        world2.restore(world.snapshot())
+
+        self.assertEqual(world2.objects, world.objects)
+        self.assertIdentical(world2.objects, objects)
+        self.assertEqual(world2.byKind('thing'), set([thing]))
+        self.assertEqual(world2.sequence, world.sequence)
+        self.assertEqual(receiver.call_count, 0)
+        self.assertEqual(engine.worldEventReceived.call_count, 0)
+
+
+    def test_replay(self):
+        """
+        Replaying an event updates the world's state and sequence number
+        without emitting it.
+        """
+        receiver = MagicMock()
+        world = World(receiver)
+        world.replay(7, Created('foo'))
+        self.assertEqual(world.get('foo'), {'id': 'foo'})
+        self.assertEqual(world.sequence, 7)
+        self.assertEqual(receiver.call_count, 0)
+
+
+    def test_compact(self):
+        """
+        A world can store its objects compactly.
+        """
+        world = World(MagicMock(), compact=True)
+        obj = world.create('foo')
+        self.assertTrue(isinstance(obj, Record))
+        self.assertEqual(world.get(obj['id'])['kind'], 'foo')
+
+
     def test_emit_toEngine(self):
         """
         All emissions are sent to the engine.
@@ -128,6 +241,17 @@ class WorldTest(TestCase):
         self.assertEqual(obj, obj2)
 
 
+    def test_byKind(self):
+        """
+        You can get the ids of all the objects of a kind.
+        """
+        world = World(MagicMock())
+        s1 = world.create('square')['id']
+        s2 = world.create('square')['id']
+        world.create('bot')
+        self.assertEqual(world.byKind('square'), set([s1, s2]))
+
+
     def test_setAttr(self):
         """
         You can set the value of an attribute.
@@ -281,6 +405,55 @@ class WorldTest(TestCase):
         self.assertFailure(d, defer.CancelledError)
 
 
+    def test_setAttr_noWatchers(self):
+        """
+        Setting attributes that nothing is waiting on doesn't keep anything
+        around.
+        """
+        world = World(MagicMock())
+        obj = world.create('foo')['id']
+        for i in xrange(10):
+            world.setAttr(obj, 'hp', i)
+        self.assertEqual(len(world._on_become), 0)
+        self.assertEqual(len(world._on_change), 0)
+
+
+    def test_watchers_cleanup(self):
+        """
+        Nothing is kept for watchers after they fire or are cancelled.
+        """
+        world = World(MagicMock())
+        obj = world.create('foo')['id']
+        world.onBecome(obj, 'hey', 3)
+        world.onNextChange(obj, 'hey')
+        d = world.onEvent(obj, 'event')
+        d.addErrback(lambda err: None)
+
+        world.setAttr(obj, 'hey', 3)
+        d.cancel()
+        self.assertEqual(len(world._on_become), 0)
+        self.assertEqual(len(world._on_change), 0)
+        self.assertEqual(len(world._on_event), 0)
+
+
+    def test_watchers_destroy(self):
+        """
+        Watchers waiting on an object are dropped when the object is destroyed,
+        after those waiting for its destruction have fired.
+        """
+        world = World(MagicMock())
+        obj = world.create('foo')['id']
+        world.onBecome(obj, 'hey', 3)
+        world.onNextChange(obj, 'hey')
+        d = world.onEvent(obj, Destroyed(obj))
+
+        world.destroy(obj)
+        self.assertEqual(self.successResultOf(d), Destroyed(obj))
+        self.assertEqual(len(world._on_become), 0)
+        self.assertEqual(len(world._on_change), 0)
+        self.assertEqual(len(world._on_event), 0)
+
+
     def test_onEvent(self):
         """
         You can be notified when a certain event happens.
@@ -364,6 +537,33 @@ class WorldTest(TestCase):
         self.assertEqual(world.emitterFor('foo'), world.emitterFor('foo'))
 
 
+    def test_emitterFor_destroyed(self):
+        """
+        Emitters and receivers for an object are forgotten when the object is
+        destroyed.
+        """
+        world = World(MagicMock())
+        obj = world.create('foo')['id']
+        base = world.cachedClosureCount()
+
+        emitter = world.emitterFor(obj)
+        world.receiverFor(obj)
+        self.assertEqual(world.cachedClosureCount(), base + 1)
+
+        world.destroy(obj)
+        self.assertEqual(world.cachedClosureCount(), base - 1)
+        self.assertNotEqual(world.emitterFor(obj), emitter)
+
+
+    def test_emitterFor_perWorld(self):
+        """
+        Each world makes its own emitters.
+        """
+        world1 = World(MagicMock())
+        world2 = World(MagicMock())
+        self.assertNotEqual(world1.emitterFor('foo'), world2.emitterFor('foo'))
+
+
     def test_subscribeTo(self):
         """
         You can subscribe to the events that are emitted by a particular object.
@@ -387,6 +587,61 @@ class WorldTest(TestCase):
         ev.assert_called_once_with('event')
 
 
+    def test_subscribeTo_twice(self):
+        """
+        A function subscribed twice is called once per event and must be
+        unsubscribed twice.
+        """
+        world = World(MagicMock())
+        obj = world.create('foo')['id']
+        called = []
+        world.subscribeTo(obj, called.append)
+        world.subscribeTo(obj, called.append)
+
+        world.emit('event', obj)
+        self.assertEqual(called, ['event'])
+
+        world.unsubscribeFrom(obj, called.append)
+        world.emit('event2', obj)
+        self.assertEqual(called, ['event', 'event2'])
+
+        world.unsubscribeFrom(obj, called.append)
+        world.emit('event3', obj)
+        self.assertEqual(called, ['event', 'event2'])
+
+
+    def test_unsubscribeFrom_notSubscribed(self):
+        """
+        Unsubscribing something that isn't subscribed is an error.
+        """
+        world = World(MagicMock())
+        self.assertRaises(ValueError, world.unsubscribeFrom, 'foo', 'func')
+
+
+    def test_subscribeTo_receivers(self):
+        """
+        When the receivers of several objects are subscribed to an object, each
+        object receives that object's emissions.
+        """
+        world = World(MagicMock())
+        square = world.create('square')['id']
+        bots = [world.create('bot')['id'] for i in xrange(3)]
+        received = {}
+        for bot in bots:
+            received[bot] = []
+            world.receiveFor(bot, received[bot].append)
+            world.subscribeTo(square, world.receiverFor(bot))
+
+        world.emit('hello', square)
+        for bot in bots:
+            self.assertEqual(received[bot], ['hello'])
+
+        world.unsubscribeFrom(square, world.receiverFor(bots[0]))
+        world.emit('goodbye', square)
+        self.assertEqual(received[bots[0]], ['hello'])
+        self.assertEqual(received[bots[1]], ['hello', 'goodbye'])
+
+
     def test_receiveFor(self):
         """
         You can subscribe to the events that are received by a particular
@@ -409,6 +664,29 @@ class WorldTest(TestCase):
         self.assertEqual(called, [], "Should not receive")
 
 
+    def test_receiveFor_twice(self):
+        """
+        A function receiving for an object twice is called once per event and
+        must stop receiving twice.
+        """
+        world = World(MagicMock())
+        obj = world.create('foo')['id']
+        called = []
+        world.receiveFor(obj, called.append)
+        world.receiveFor(obj, called.append)
+
+        world.eventReceived('event', obj)
+        self.assertEqual(called, ['event'])
+
+        world.stopReceivingFor(obj, called.append)
+        world.eventReceived('event2', obj)
+        self.assertEqual(called, ['event', 'event2'])
+
+        world.stopReceivingFor(obj, called.append)
+        world.eventReceived('event3', obj)
+        self.assertEqual(called, ['event', 'event2'])
+
+
     def test_receiverFor(self):
         """
         You can get a function that will call eventReceived for a given object.
@@ -493,6 +771,43 @@ class WorldTest(TestCase):
         self.assertEqual(emitted, [])
 
 
+    def test_destroy_unsubscribeReceiver(self):
+        """
+        When an object is destroyed, its receiver is no longer subscribed to
+        the objects it was receiving emissions from, even if it didn't move
+        away from them first.
+        """
+        world = World(MagicMock())
+        square = world.create('square')['id']
+        Move(world.create('bot')['id'], square).execute(world)
+        base = world.cachedClosureCount()
+
+        for i in xrange(1000):
+            bot = world.create('bot')['id']
+            Move(bot, square).execute(world)
+            world.destroy(bot)
+
+        self.assertEqual(len(world._subscribers[square]), 2)
+        self.assertEqual(world.cachedClosureCount(), base)
+        self.assertEqual(len(world._subscriptions), 2)
+
+
+    def test_destroy_unsubscribeFromOthers(self):
+        """
+        When an object that other objects were receiving emissions from is
+        destroyed, they forget they were subscribed to it.
+        """
+        world = World(MagicMock())
+        square = world.create('square')['id']
+        bot = world.create('bot')['id']
+        Move(bot, square).execute(world)
+        world.destroy(square)
+
+        self.assertEqual(world._subscriptions[bot], set([bot]))
+        self.assertNotIn(square, world._subscriptions)
+        self.assertEqual(len(world._subscribers[bot]), 1)
+
+
     def test_envelope(self):
         """
         You can read/write on the envelope of objects.
@@ -610,3 +925,86 @@ class WorldTest(TestCase):
 
 
 
+
+
+
+class CallMemoryTest(TestCase):
+
+
+    def test_add(self):
+        """
+        Adding a key returns True the first time and False after that.
+        """
+        memory = _CallMemory()
+        self.assertEqual(memory.add(('func', ('event',), ())), True)
+        self.assertEqual(memory.add(('func', ('event',), ())), False)
+        self.assertEqual(memory.add(('func', ('other',), ())), True)
+
+
+    def test_add_unhashable(self):
+        """
+        Keys that can't be hashed are remembered too.
+        """
+        memory = _CallMemory()
+        called = []
+        self.assertEqual(memory.add((called.append, ('event',), ())), True)
+        self.assertEqual(memory.add((called.append, ('event',), ())), False)
+
+
+
+class CallbacksTest(TestCase):
+
+
+    def test_order(self):
+        """
+        Callbacks are listed in the order they were first added.
+        """
+        callbacks = _Callbacks()
+        callbacks.add('a')
+        callbacks.add('b', 'b_id')
+        callbacks.add('a')
+        self.assertEqual(callbacks.entries(), [('a', None), ('b', 'b_id')])
+        self.assertEqual(len(callbacks), 2)
+
+
+    def test_remove(self):
+        """
+        A callback is gone once it has been removed as many times as it was
+        added.
+        """
+        callbacks = _Callbacks()
+        callbacks.add('a')
+        callbacks.add('a')
+        callbacks.remove('a')
+        self.assertEqual(callbacks.entries(), [('a', None)])
+        callbacks.remove('a')
+        self.assertEqual(callbacks.entries(), [])
+        self.assertRaises(ValueError, callbacks.remove, 'a')
+
+
+    def test_discard(self):
+        """
+        Discarding a callback removes it however many times it was added.
+        """
+        callbacks = _Callbacks()
+        callbacks.add('a')
+        callbacks.add('a')
+        self.assertIn('a', callbacks)
+        callbacks.discard('a')
+        self.assertNotIn('a', callbacks)
+        self.assertEqual(callbacks.entries(), [])
+        callbacks.discard('a')
+
+
+    def test_unhashable(self):
+        """
+        Bound methods of unhashable objects can be added and removed.
+        """
+        callbacks = _Callbacks()
+        called = []
+        callbacks.add(called.append)
+        callbacks.add(called.append)
+        self.assertEqual(len(callbacks), 1)
+        callbacks.remove(called.append)
+        callbacks.remove(called.append)
+        self.assertEqual(len(callbacks), 0)
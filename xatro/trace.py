@@ -0,0 +1,110 @@
+from twisted.python import log
+
+from collections import deque
+
+from xatro.event import ActionPerformed
+
+
+
+class EventTracer(object):
+    """
+    I decide which world events get logged, and remember the last few events
+    so they can be dumped when debugging.
+
+    Nothing is formatted unless it is going to be logged, so a tracer that is
+    turned L{OFF} costs next to nothing per event.
+
+    @ivar level: One of L{OFF}, L{ACTIONS} (only log L{ActionPerformed}
+        events) or L{EVENTS} (log every event).
+    @ivar sample: Only log one out of every C{sample} events that C{level}
+        allows.
+    @ivar recent: The last few events received, whether they were logged or
+        not.
+    """
+
+    OFF = 0
+    ACTIONS = 1
+    EVENTS = 2
+
+    levels = {
+        'off': OFF,
+        'actions': ACTIONS,
+        'events': EVENTS,
+    }
+
+
+    def __init__(self, level=OFF, sample=1, keep=0):
+        """
+        @param level: Initial C{level}.  Either a level or the name of one in
+            L{levels}.
+        @param sample: Initial C{sample} rate.
+        @param keep: How many recent events to remember for L{dump}.
+
+        @raise ValueError: If C{level} is a name not in L{levels}, or
+            C{sample} is less than 1.
+        """
+        if isinstance(level, basestring):
+            level = parseLevel(level)
+        if sample < 1:
+            raise ValueError('Trace sample rate must be at least 1, not %r' % (
+                             sample,))
+        self.level = level
+        self.sample = sample
+        self.recent = deque(maxlen=keep)
+        self._seen = 0
+
+
+    def eventReceived(self, event):
+        """
+        An event happened in the world.
+        """
+        self.recent.append(event)
+        if not self.level:
+            return
+        if self.level == self.ACTIONS and type(event) is not ActionPerformed:
+            return
+        self._seen += 1
+        if self._seen % self.sample:
+            return
+        log.msg(event)
+
+
+    def dump(self):
+        """
+        Log the last few events received.
+
+        @return: A list of the events logged.
+        """
+        events = list(self.recent)
+        log.msg('Last %d events:' % (len(events),))
+        for event in events:
+            log.msg(event)
+        return events
+
+
+
+def parseLevel(name):
+    """
+    Get the L{EventTracer} level with the given name.
+
+    @raise ValueError: If there's no such level.
+    """
+    try:
+        return EventTracer.levels[name]
+    except KeyError:
+        raise ValueError('Unknown trace level %r (choose from %s)' % (
+                         name, ', '.join(sorted(EventTracer.levels))))
+
+
+
+def parseSample(value):
+    """
+    Parse an L{EventTracer} C{sample} rate.
+
+    @raise ValueError: If it isn't a whole number of at least 1.
+    """
+    sample = int(value)
+    if sample < 1:
+        raise ValueError('Trace sample rate must be at least 1, not %d' % (
+                         sample,))
+    return sample
@@ -138,6 +138,8 @@ class ToStringTransformer(object):
         return '%s joined team %s' % (action.thing, action.team_name)
 
 
+ToStringTransformer.router.precompute()
+
 
 
 class DictTransformer(object):
@@ -358,3 +360,5 @@ class DictTransformer(object):
             'subject': action.thing,
             'portal': action.portal,
         }
+
+DictTransformer.router.precompute()
@@ -3,6 +3,9 @@ from twisted.internet import defer
 from klein import Klein
 
 import json
+from collections import deque
+from itertools import islice
+from uuid import uuid4
 
 from xatro.transformer import DictTransformer
 from xatro.state import State
@@ -24,26 +27,88 @@ def toJson(thing):
 
 class GameObserver(object):
     """
-    I observe a single game and maintain my own copy of the state of the game.
+    I observe a single game and maintain my own copy of the state of the game,
+    unless told to L{shareState} with the game.
+
+    Each event is encoded once into an SSE frame which is written to every
+    observer.  Frames carry an id made of a sequence number, so that clients
+    reconnecting with a C{Last-Event-ID} are sent just the events they missed
+    (if they are still in my log) instead of the whole state of the game.
+    Once told to L{numberBy} a world, the sequence number is the world's (the
+    same one its event log and snapshots use).
     """
 
     app = Klein()
 
 
-    def __init__(self, static_root):
+    def __init__(self, static_root, snapshot_every=100, log_size=1000):
+        """
+        @param snapshot_every: Rebuild the cached snapshot of the state of the
+            game sent to new observers at most once per this many events.
+        @param log_size: Number of recent event frames to keep for replaying
+            to reconnecting or newly connected observers.
+        """
         self._state = State()
+        self._objects = self._state.state
         self._transformer = DictTransformer()
         self.static_root = static_root
         self._observers = []
+        self.snapshot_every = snapshot_every
+        self._run = uuid4().hex[:8]
+        self._world = None
+        self._sequence = 0
+        self._log = deque(maxlen=log_size)
+        self._snapshot = None
+
+
+    def numberBy(self, world):
+        """
+        Number events by C{world}'s L{World.sequence} instead of counting
+        them myself.  I must be C{world}'s C{event_receiver}.
+        """
+        self._world = world
+        self._catchUp()
+
+
+    def _catchUp(self):
+        """
+        If my world has numbered events I didn't receive (such as ones it was
+        recovered from), forget the events I've logged, since clients that
+        saw them missed some that I can't send.
+        """
+        if self._world is None or self._world.sequence == self._sequence:
+            return
+        self._log.clear()
+        self._snapshot = None
+        self._sequence = self._world.sequence
+
+
+    def shareState(self, objects):
+        """
+        Stop keeping my own copy of the state of the game.
+
+        @param objects: A dict of object id to object kept up to date by
+            someone else, such as L{World.objects}.  It must already be up to
+            date by the time I receive each event.
+        """
+        self._state = None
+        self._objects = objects
 
 
     def eventReceived(self, event):
         """
         Game event received.
         """
-        self._state.eventReceived(event)
+        if self._state is not None:
+            self._state.eventReceived(event)
+        self._sequence += 1
+        self._catchUp()
+        if not (self._observers or self._log.maxlen):
+            return
         message = self._transformer.transform(event)
-        self.sendMessage('ev', json.dumps(message))
+        frame = self.sse('ev', toJson(message), self._eventId(self._sequence))
+        self._log.append(frame)
+        self.broadcast(frame)
 
 
     @app.route('/game')
@@ -60,25 +125,88 @@ class GameObserver(object):
         SSE stream of events.
         """
         self._observers.append(request)
-        request.notifyFinish().addCallback(self._removeRequest)
+        request.notifyFinish().addBoth(lambda _: self._removeRequest(request))
 
         request.setHeader('Content-Type', 'text/event-stream')
-        # send the current state of the game.
-        request.write(self.sse('state', json.dumps(self._state.state)))
+        self._catchUp()
+        last = self._parseEventId(request.getHeader('last-event-id'))
+        if last is None or not self._logged(last):
+            # send the state of the game, then whatever happened since.
+            last, frame = self.snapshot()
+            request.write(frame)
+        for frame in self._framesSince(last):
+            request.write(frame)
         return defer.Deferred()
 
 
-    def sse(self, key, value):
-        return 'event: %s\ndata: %s\n\n' % (key, value)
+    def snapshot(self):
+        """
+        Get a recent snapshot of the state of the game, rebuilding it if it
+        is more than C{snapshot_every} events old or if the events since it
+        are no longer all logged.
+
+        @return: A tuple of the sequence number of the last event included in
+            the snapshot and the snapshot's SSE frame.
+        """
+        if (self._snapshot is None
+                or self._sequence - self._snapshot[0] >= self.snapshot_every
+                or not self._logged(self._snapshot[0])):
+            frame = self.sse('state', toJson(self._objects),
+                             self._eventId(self._sequence))
+            self._snapshot = (self._sequence, frame)
+        return self._snapshot
+
+
+    def _eventId(self, sequence):
+        return '%s.%d' % (self._run, sequence)
+
+
+    def _parseEventId(self, event_id):
+        """
+        Get the sequence number from an event id I made, or C{None} if I
+        didn't make it (such as one from before a restart).
+        """
+        try:
+            run, sequence = event_id.split('.')
+            sequence = int(sequence)
+        except (AttributeError, ValueError):
+            return None
+        if run != self._run or not 0 <= sequence <= self._sequence:
+            return None
+        return sequence
+
+
+    def _logged(self, sequence):
+        """
+        Return C{True} if all the events after C{sequence} are in the log.
+        """
+        return sequence >= self._sequence - len(self._log)
+
+
+    def _framesSince(self, sequence):
+        missed = self._sequence - sequence
+        return islice(self._log, len(self._log) - missed, None)
+
+
+    def sse(self, key, value, event_id=None):
+        if event_id is None:
+            return 'event: %s\ndata: %s\n\n' % (key, value)
+        return 'id: %s\nevent: %s\ndata: %s\n\n' % (event_id, key, value)
 
 
     def sendMessage(self, key, value):
         """
         Send an SSE-formatted message to all requests.
         """
-        msg = self.sse(key, value)
+        self.broadcast(self.sse(key, value))
+
+
+    def broadcast(self, frame):
+        """
+        Write an already encoded SSE frame to all requests.
+        """
         for o in self._observers:
-            o.write(msg)
+            o.write(frame)
 
 
     def _removeRequest(self, request):
@@ -0,0 +1,285 @@
+from twisted.trial.unittest import TestCase
+from twisted.python.filepath import FilePath
+from twisted.internet import defer
+
+from mock import MagicMock
+import json
+
+from xatro.web.observatory import GameObserver
+from xatro.world import World
+from xatro.event import AttrSet, Created
+
+
+
+class FakeRequest(object):
+
+
+    def __init__(self, last_event_id=None):
+        self.written = []
+        self.headers = {}
+        self.finished = defer.Deferred()
+        self.last_event_id = last_event_id
+
+
+    def getHeader(self, name):
+        if name.lower() == 'last-event-id':
+            return self.last_event_id
+
+
+    def notifyFinish(self):
+        return self.finished
+
+
+    def setHeader(self, name, value):
+        self.headers[name] = value
+
+
+    def write(self, data):
+        self.written.append(data)
+
+
+
+class GameObserverTest(TestCase):
+
+
+    def observer(self, **kwargs):
+        return GameObserver(FilePath(self.mktemp()), **kwargs)
+
+
+    def test_events(self):
+        """
+        A request for events is sent the current state of the game first.
+        """
+        o = self.observer()
+        o.eventReceived(Created('foo'))
+        request = FakeRequest()
+
+        o.events(request)
+
+        self.assertEqual(request.headers['Content-Type'], 'text/event-stream')
+        self.assertEqual(request.written, [
+            o.sse('state', json.dumps({'foo': {'id': 'foo'}}), o._eventId(1)),
+        ])
+
+
+    def test_eventReceived(self):
+        """
+        Each event is encoded once and the same frame is written to every
+        observer.
+        """
+        o = self.observer()
+        r1 = FakeRequest()
+        r2 = FakeRequest()
+        o.events(r1)
+        o.events(r2)
+
+        o.eventReceived(Created('foo'))
+
+        expected = o.sse('ev', json.dumps(o._transformer.transform(
+                         Created('foo'))), o._eventId(1))
+        self.assertEqual(r1.written[-1], expected)
+        self.assertIdentical(r1.written[-1], r2.written[-1])
+
+
+    def test_eventReceivedNoObservers(self):
+        """
+        Events aren't encoded when no one is observing and there's no log,
+        though they still update the state.
+        """
+        o = self.observer(log_size=0)
+        o._transformer = MagicMock()
+
+        o.eventReceived(Created('foo'))
+
+        self.assertEqual(o._transformer.transform.call_count, 0)
+        self.assertEqual(o._state.state, {'foo': {'id': 'foo'}})
+
+
+    def test_requestFinished(self):
+        """
+        Finished requests stop being written to, whether they finished
+        cleanly or not.
+        """
+        o = self.observer()
+        r1 = FakeRequest()
+        r2 = FakeRequest()
+        o.events(r1)
+        o.events(r2)
+
+        r1.finished.callback(None)
+        r2.finished.errback(Exception('connection lost'))
+
+        o.eventReceived(Created('foo'))
+        self.assertEqual(len(r1.written), 1)
+        self.assertEqual(len(r2.written), 1)
+
+
+    def test_shareState(self):
+        """
+        An observer sharing the world's state doesn't keep its own copy.
+        """
+        o = self.observer()
+        world = World(o.eventReceived)
+        o.shareState(world.objects)
+        self.assertEqual(o._state, None)
+
+        thing = world.create('thing')['id']
+        request = FakeRequest()
+        o.events(request)
+
+        self.assertEqual(request.written, [
+            o.sse('state', json.dumps(world.objects), o._eventId(2)),
+        ])
+
+        world.setAttr(thing, 'hp', 3)
+        expected = o.sse('ev', json.dumps(o._transformer.transform(
+                         AttrSet(thing, 'hp', 3))), o._eventId(3))
+        self.assertEqual(request.written[-1], expected)
+
+
+    def test_numberBy(self):
+        """
+        An observer can number events the same way as its world, including
+        when the world was recovered with events it never saw.
+        """
+        o = self.observer()
+        world = World(o.eventReceived)
+        world.restore({'sequence': 5, 'state': world.snapshot()['state']})
+        o.shareState(world.objects)
+        o.numberBy(world)
+        self.assertEqual(o.snapshot()[0], 5)
+
+        thing = world.create('thing')['id']
+        self.assertEqual(world.sequence, 7)
+        self.assertEqual(o._log[-1], o.sse('ev', json.dumps(
+            o._transformer.transform(AttrSet(thing, 'kind', 'thing'))),
+            o._eventId(7)))
+
+        # events numbered behind the observer's back are never replayed
+        # across the gap
+        world.replay(9, Created('other'))
+        request = FakeRequest(o._eventId(7))
+        o.events(request)
+        self.assertEqual(request.written, [o.snapshot()[1]])
+        self.assertEqual(o.snapshot()[0], 9)
+
+        world.create('more')
+        request = FakeRequest(o._eventId(9))
+        o.events(request)
+        self.assertEqual(request.written, list(o._log))
+        self.assertEqual(len(request.written), 2)
+
+
+    def test_shareCompactState(self):
+        """
+        Compactly stored objects are sent as JSON objects.
+        """
+        o = self.observer()
+        world = World(o.eventReceived, compact=True)
+        o.shareState(world.objects)
+        thing = world.create('thing')['id']
+
+        request = FakeRequest()
+        o.events(request)
+
+        self.assertEqual(request.written, [
+            o.sse('state', json.dumps({thing: {'id': thing, 'kind': 'thing'}}),
+                  o._eventId(2)),
+        ])
+
+
+    def test_sse(self):
+        """
+        SSE frames have an id if given one.
+        """
+        o = self.observer()
+        self.assertEqual(o.sse('ev', '{}'), 'event: ev\ndata: {}\n\n')
+        self.assertEqual(o.sse('ev', '{}', 'x.1'),
+                         'id: x.1\nevent: ev\ndata: {}\n\n')
+
+
+    def test_snapshotCached(self):
+        """
+        The snapshot sent to new observers is only rebuilt once it is
+        C{snapshot_every} events old.  Events since the snapshot are sent
+        after it.
+        """
+        o = self.observer(snapshot_every=3)
+        o.eventReceived(Created('foo'))
+        o.events(FakeRequest())
+        snapshot = o.snapshot()
+
+        o.eventReceived(Created('bar'))
+        o.eventReceived(Created('baz'))
+        self.assertIdentical(o.snapshot(), snapshot)
+
+        request = FakeRequest()
+        o.events(request)
+        self.assertEqual(request.written, [
+            o.sse('state', json.dumps({'foo': {'id': 'foo'}}), o._eventId(1)),
+            o._log[1],
+            o._log[2],
+        ])
+
+        o.eventReceived(Created('qux'))
+        self.assertEqual(o.snapshot()[0], 4)
+
+
+    def test_snapshotNotLogged(self):
+        """
+        The snapshot is rebuilt if the events since it have fallen out of
+        the log.
+        """
+        o = self.observer(snapshot_every=10, log_size=2)
+        o.snapshot()
+        o.eventReceived(Created('foo'))
+        o.eventReceived(Created('bar'))
+        self.assertEqual(o.snapshot()[0], 0)
+        o.eventReceived(Created('baz'))
+        self.assertEqual(o.snapshot()[0], 3)
+
+
+    def test_lastEventId(self):
+        """
+        A client reconnecting with a C{Last-Event-ID} is sent only the events
+        it missed.
+        """
+        o = self.observer()
+        o.eventReceived(Created('foo'))
+        o.eventReceived(Created('bar'))
+        o.eventReceived(Created('baz'))
+
+        request = FakeRequest(o._eventId(1))
+        o.events(request)
+        self.assertEqual(request.written, [o._log[1], o._log[2]])
+
+        request = FakeRequest(o._eventId(3))
+        o.events(request)
+        self.assertEqual(request.written, [])
+
+
+    def test_lastEventIdNotLogged(self):
+        """
+        If the events a client missed are no longer logged, it is sent a
+        snapshot instead.
+        """
+        o = self.observer(log_size=1)
+        o.eventReceived(Created('foo'))
+        o.eventReceived(Created('bar'))
+
+        request = FakeRequest(o._eventId(0))
+        o.events(request)
+        self.assertEqual(request.written, [o.snapshot()[1]])
+
+
+    def test_lastEventIdUnknown(self):
+        """
+        Event ids from some other run (such as before a restart), from the
+        future or which aren't event ids at all get a snapshot.
+        """
+        o = self.observer()
+        o.eventReceived(Created('foo'))
+        for event_id in ['xxx.0', o._eventId(2), 'garbage', '%s.x' % (o._run,)]:
+            request = FakeRequest(event_id)
+            o.events(request)
+            self.assertEqual(request.written, [o.snapshot()[1]], event_id)
@@ -1,15 +1,45 @@
-from collections import namedtuple
+from twisted.internet import defer, threads
+
+from collections import namedtuple, deque
 from uuid import uuid4
 from hashlib import sha1
+import math
+import multiprocessing
+import signal
 
 
 Work = namedtuple('Work', ['goal', 'nonce'])
 
+MAX_SHA = int('f'*40, 16)
+
 
 class InvalidSolution(Exception): pass
 
 
 
+def digestThreshold(goal):
+    """
+    Get the SHA-1 digest a hash must be greater than to meet C{goal}.
+
+    Digests are big-endian, so comparing them as strings is the same as
+    comparing them as numbers.
+    """
+    if goal < 0:
+        return ''
+    elif goal >= MAX_SHA:
+        return '\xff' * 20
+    return ('%040x' % (goal,)).decode('hex')
+
+
+def expectedHashes(work):
+    """
+    Get the number of hashes it takes on average to solve C{work}.
+    """
+    solutions = min(max(MAX_SHA - work.goal, 1), MAX_SHA + 1)
+    return float(MAX_SHA + 1) / solutions
+
+
+
 class WorkMaker(object):
     """
     I make work and verify its completeness.
@@ -18,11 +48,15 @@ class WorkMaker(object):
     @ivar scale: Default scale if none is provided to L{makeGoal}.
     """
 
-    MAX_SHA = int('f'*40, 16)
+    MAX_SHA = MAX_SHA
+
+    # most goals to remember the threshold digest of
+    max_thresholds = 1024
 
     def __init__(self, difficulty=10, scale=10000):
         self.difficulty = difficulty
         self.scale = scale
+        self._thresholds = {}
 
 
     def makeGoal(self, difficulty=None, scale=None):
@@ -70,5 +104,410 @@ class WorkMaker(object):
         Verify that the given C{answer} produces a hash greater than the
         threshold defined by C{difficulty} and C{scale}.
         """
-        result = int(sha1(nonce + answer).hexdigest(), 16)
-        return result > goal
\ No newline at end of file
+        threshold = self._thresholds.get(goal)
+        if threshold is None:
+            threshold = self._threshold(goal)
+        return sha1(nonce + answer).digest() > threshold
+
+
+    def _threshold(self, goal):
+        threshold = digestThreshold(goal)
+        if len(self._thresholds) >= self.max_thresholds:
+            self._thresholds.clear()
+        self._thresholds[goal] = threshold
+        return threshold
+
+
+
+class ReplayCache(object):
+    """
+    I remember solutions to work which have been used, so that they can't be
+    used again, for C{ttl} seconds or until C{size} more recent ones have
+    been used.
+
+    @ivar clock: Provider of C{seconds} used to expire solutions.
+    """
+
+
+    def __init__(self, size=100000, ttl=3600.0, clock=None):
+        """
+        @param clock: C{clock}, by default the reactor.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.size = size
+        self.ttl = ttl
+        # (nonce, answer) -> time used
+        self._used = {}
+        # (time used, (nonce, answer)) oldest first
+        self._order = deque()
+
+
+    def __contains__(self, key):
+        """
+        Has the C{(nonce, answer)} pair C{key} been used recently?
+        """
+        used = self._used.get(key)
+        return used is not None and used + self.ttl > self.clock.seconds()
+
+
+    def __len__(self):
+        return len(self._used)
+
+
+    def add(self, key):
+        """
+        Note that the C{(nonce, answer)} pair C{key} has been used.
+        """
+        now = self.clock.seconds()
+        self._used[key] = now
+        self._order.append((now, key))
+        self._expire(now)
+
+
+    def _expire(self, now):
+        used = self._used
+        order = self._order
+        oldest = now - self.ttl
+        while order and (len(order) > self.size or order[0][0] <= oldest):
+            when, key = order.popleft()
+            if used.get(key) == when:
+                del used[key]
+
+
+
+class AdaptiveWorkScheduler(object):
+    """
+    I hand out work to bots, making it harder for bots that act more often
+    than C{target_rate} and easier for bots that act less often.
+
+    Each bot is given work with a scale of its own (see
+    L{WorkMaker.makeGoal}); solving it takes about C{scale / difficulty}
+    hashes on average, but checking a solution always takes one, so however
+    hard a noisy bot is made to work the server's cost per action stays the
+    same.
+
+    A bot keeps the same work until it does an action (see L{actionDone}),
+    after which it gets new work with its scale adjusted by how its recent
+    action rate compares to C{target_rate}.
+
+    @ivar clock: Provider of C{seconds} used to measure action rates.
+    """
+
+
+    def __init__(self, work_maker=None, target_rate=1.0, window=10.0,
+                 min_scale=None, max_scale=None, step=2.0, clock=None):
+        """
+        @param work_maker: The L{WorkMaker} to get work from.
+        @param target_rate: Actions per second each bot should settle at.
+        @param window: Seconds over which a bot's action rate is averaged.
+        @param min_scale: Easiest scale to give anyone.  Defaults to the
+            work maker's scale.
+        @param max_scale: Hardest scale to give anyone.  Defaults to 1000
+            times C{min_scale}.
+        @param step: Most a bot's scale changes by (up or down) from one
+            piece of work to the next.
+        @param clock: C{clock}, by default the reactor.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.work_maker = work_maker or WorkMaker()
+        self.target_rate = target_rate
+        self.window = window
+        self.min_scale = min_scale or self.work_maker.scale
+        self.max_scale = max_scale or self.min_scale * 1000
+        self.step = step
+        # bot id -> [scale, rate, time of last action, outstanding work]
+        self._bots = {}
+
+
+    def workFor(self, bot_id):
+        """
+        Get the work C{bot_id} has to do before its next action.
+        """
+        state = self._bots.get(bot_id)
+        if state is None:
+            state = self._bots[bot_id] = [self.min_scale, 0.0, None, None]
+        work = state[3]
+        if work is None:
+            self._adjust(state)
+            work = state[3] = self.work_maker.getWork(None, int(state[0]))
+        return work
+
+
+    def actionDone(self, bot_id):
+        """
+        Note that C{bot_id} did an action, using up its work.
+        """
+        state = self._bots.get(bot_id)
+        if state is None or state[3] is None:
+            return
+        state[1] = self._rate(state) + 1.0 / self.window
+        state[2] = self.clock.seconds()
+        state[3] = None
+
+
+    def rate(self, bot_id):
+        """
+        Get the recent action rate of C{bot_id} in actions per second.
+        """
+        state = self._bots.get(bot_id)
+        if state is None:
+            return 0.0
+        return self._rate(state)
+
+
+    def scale(self, bot_id):
+        """
+        Get the scale of the work C{bot_id} is being given.
+        """
+        state = self._bots.get(bot_id)
+        if state is None:
+            return self.min_scale
+        return state[0]
+
+
+    def forget(self, bot_id):
+        """
+        Forget everything about C{bot_id}.
+        """
+        self._bots.pop(bot_id, None)
+
+
+    def _rate(self, state):
+        """
+        Decay a bot's action rate to now.
+        """
+        if state[2] is None:
+            return state[1]
+        elapsed = self.clock.seconds() - state[2]
+        return state[1] * math.exp(-elapsed / self.window)
+
+
+    def _adjust(self, state):
+        """
+        Scale a bot's work by how its action rate compares to the target.
+        The square root damps the overshoot caused by the rate lagging behind
+        changes in scale.
+        """
+        factor = math.sqrt(self._rate(state) / self.target_rate)
+        factor = min(max(factor, 1.0 / self.step), self.step)
+        state[0] = min(max(state[0] * factor, self.min_scale), self.max_scale)
+
+
+
+class InlineVerifier(object):
+    """
+    I verify solutions to work right away, using a L{WorkMaker}.
+    """
+
+
+    def __init__(self, work_maker):
+        self.work_maker = work_maker
+
+
+    def verify(self, work, result):
+        """
+        Determine if C{result} is an acceptable solution for C{work}.
+
+        @return: A L{Deferred} which has already fired with C{True} if it's
+            acceptable, else C{False}.
+        """
+        return defer.succeed(self.work_maker.isResult(work, result))
+
+
+
+class BatchVerifier(object):
+    """
+    I collect solutions to work as they come in and verify them in batches,
+    so that a flood of solutions can't tie up the reactor.
+
+    Batches are checked on later turns of the reactor, at most C{batch_size}
+    per turn, or in a thread pool if I'm given one.
+
+    @ivar clock: The reactor, used to schedule batches and to run them in
+        C{threadpool}.
+    """
+
+
+    def __init__(self, work_maker, batch_size=100, threadpool=None,
+                 clock=None):
+        """
+        @param work_maker: The L{WorkMaker} that checks each solution.
+        @param batch_size: Most solutions to check at a time.
+        @param threadpool: A started C{ThreadPool} to check batches in, or
+            C{None} to check them in the reactor thread.
+        @param clock: C{clock}, by default the reactor.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.work_maker = work_maker
+        self.batch_size = batch_size
+        self.threadpool = threadpool
+        self._pending = deque()
+        self._call = None
+
+
+    def verify(self, work, result):
+        """
+        Determine if C{result} is an acceptable solution for C{work}.
+
+        @return: A L{Deferred} which fires with C{True} if it's acceptable,
+            else C{False}.
+        """
+        d = defer.Deferred()
+        self._pending.append((work, result, d))
+        if self._call is None:
+            self._call = self.clock.callLater(0, self._checkPending)
+        return d
+
+
+    def _checkPending(self):
+        self._call = None
+        pending = self._pending
+        batch = [pending.popleft()
+                 for i in xrange(min(self.batch_size, len(pending)))]
+        if pending:
+            self._call = self.clock.callLater(0, self._checkPending)
+
+        pairs = [(work, result) for work, result, d in batch]
+        deferreds = [d for work, result, d in batch]
+        if self.threadpool is None:
+            d = defer.maybeDeferred(self._checkBatch, pairs)
+        else:
+            d = threads.deferToThreadPool(self.clock, self.threadpool,
+                                          self._checkBatch, pairs)
+        d.addCallbacks(self._deliver, self._fail,
+                       callbackArgs=(deferreds,), errbackArgs=(deferreds,))
+
+
+    def _checkBatch(self, pairs):
+        isResult = self.work_maker.isResult
+        return [isResult(work, result) for work, result in pairs]
+
+
+    def _deliver(self, results, deferreds):
+        for d, result in zip(deferreds, results):
+            d.callback(result)
+
+
+    def _fail(self, err, deferreds):
+        for d in deferreds:
+            d.errback(err)
+
+
+
+def searchAnswers(work, start=0, stop=None, step=1):
+    """
+    Look for a solution to C{work} among the answers C{start}, C{start +
+    step}, ... up to but not including C{stop} (or forever if C{stop} is
+    C{None}).  Answer number C{i} is C{i} in hex.
+
+    @return: The first answer that solves the work, or C{None} if none do.
+    """
+    threshold = digestThreshold(work.goal)
+    # the nonce is hashed once, and each answer is added to a copy of it
+    prefix = sha1(work.nonce)
+    copy = prefix.copy
+    i = start
+    while stop is None or i < stop:
+        answer = '%x' % (i,)
+        h = copy()
+        h.update(answer)
+        if h.digest() > threshold:
+            return answer
+        i += step
+    return None
+
+
+def _searchChunk(args):
+    work, start, stop = args
+    return searchAnswers(work, start, stop)
+
+
+def _initSearchProcess():
+    # A handler inherited from the parent (such as the reactor's) can't run
+    # while the process waits for a chunk, so it could never be terminated.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Leave interrupting to the parent.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+
+class StreamSolver(object):
+    """
+    I solve work by trying answers one after another in this process.
+    """
+
+
+    def solve(self, work):
+        """
+        Find an answer to C{work}.  Blocks until one is found.
+        """
+        return searchAnswers(work)
+
+
+    def close(self):
+        pass
+
+
+
+class ProcessSolver(object):
+    """
+    I solve work by splitting the answers to try between a pool of
+    processes.
+
+    Each round, every process searches its own C{chunk_size} answers; the
+    first answer found in the round wins.
+    """
+
+
+    def __init__(self, processes=None, chunk_size=50000):
+        """
+        @param processes: Number of processes to search with.  Defaults to
+            the number of CPUs.
+        @param chunk_size: Number of answers each process tries at a time.
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self._pool = multiprocessing.Pool(self.processes, _initSearchProcess)
+
+
+    def solve(self, work):
+        """
+        Find an answer to C{work}.  Blocks until one is found.
+        """
+        start = 0
+        while True:
+            stop = start + self.chunk_size * self.processes
+            answer = self.search(work, start, stop)
+            if answer is not None:
+                return answer
+            start = stop
+
+
+    def search(self, work, start, stop):
+        """
+        Look for a solution to C{work} among the answers from C{start} up to
+        C{stop}, with each process searching an equal part of them.
+
+        @return: The first answer found, or C{None} if none do.
+        """
+        size = -(-(stop - start) // self.processes)
+        chunks = [(work, i, min(i + size, stop))
+                  for i in xrange(start, stop, size)]
+        for answer in self._pool.map(_searchChunk, chunks):
+            if answer is not None:
+                return answer
+        return None
+
+
+    def close(self):
+        """
+        Stop my processes.
+        """
+        self._pool.terminate()
+        self._pool.join()
@@ -4,26 +4,203 @@ import traceback
 
 from uuid import uuid4
 
-from collections import defaultdict
-from functools import wraps
+from collections import deque, OrderedDict
 from weakref import WeakKeyDictionary
 
 from xatro.event import Created, Destroyed, AttrSet, ItemAdded, ItemRemoved
 from xatro.event import ActionPerformed, AttrDel
-from xatro.state import State
+from xatro.state import State, CompactState
 
 
-def memoize(f):
-    # XXX make this faster if it's too slow.
-    data = {}
-    @wraps(f)
-    def deco(*args, **kwargs):
-        key = (args, tuple(kwargs.items()))
-        if key in data:
-            return data[key]
-        data[key] = f(*args, **kwargs)
-        return data[key]
-    return deco
+class _CallMemory(object):
+    """
+    I remember which function calls have been made during a single drain of
+    a L{World}'s event queue.
+
+    Hashable calls are remembered in a set so that checking is O(1).  Calls
+    that can't be hashed (such as the bound C{append} of a C{list}) fall back
+    to a list.
+    """
+
+
+    def __init__(self):
+        self._hashable = set()
+        self._unhashable = []
+
+
+    def add(self, key):
+        """
+        Remember C{key}.
+
+        @return: C{True} if C{key} was not already remembered, else C{False}.
+        """
+        try:
+            if key in self._hashable:
+                return False
+            self._hashable.add(key)
+        except TypeError:
+            if key in self._unhashable:
+                return False
+            self._unhashable.append(key)
+        return True
+
+
+
+def _callbackKey(func):
+    """
+    Get a hashable key for a callback.  Bound methods of unhashable objects
+    (such as the C{append} of a C{list}) are keyed by the identity of the
+    object they are bound to.
+    """
+    try:
+        hash(func)
+        return func
+    except TypeError:
+        return (id(func.__self__), func.__name__)
+
+
+
+class _Callbacks(object):
+    """
+    I am an ordered collection of callbacks with O(1) addition and removal.
+
+    A callback added more than once is kept in the position it was first
+    added and must be removed as many times as it was added, but it is only
+    listed once.
+
+    Each callback may be annotated with the id of the world object whose
+    receiver it is (see L{World.receiverFor}).
+    """
+
+
+    def __init__(self):
+        self._entries = OrderedDict()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, func):
+        return _callbackKey(func) in self._entries
+
+
+    def add(self, func, receiver_id=None):
+        """
+        Add a callback.
+        """
+        key = _callbackKey(func)
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = [func, receiver_id, 1]
+        else:
+            entry[2] += 1
+
+
+    def remove(self, func):
+        """
+        Remove a callback.
+
+        @raise ValueError: If the callback was never added.
+        """
+        key = _callbackKey(func)
+        entry = self._entries.get(key)
+        if entry is None:
+            raise ValueError(func)
+        entry[2] -= 1
+        if not entry[2]:
+            del self._entries[key]
+
+
+    def discard(self, func):
+        """
+        Remove a callback no matter how many times it was added, if it was.
+        """
+        self._entries.pop(_callbackKey(func), None)
+
+
+    def entries(self):
+        """
+        Return a list of C{(callback, receiver_id)} for each callback in the
+        order they were added.
+        """
+        return [(func, receiver_id) for func, receiver_id, count
+                in self._entries.itervalues()]
+
+
+
+class _Watchers(object):
+    """
+    I keep track of Deferreds waiting for something to happen to world
+    objects.
+
+    Nothing is stored for an object until something waits on it, and what is
+    stored is dropped as soon as nothing is waiting anymore.
+    """
+
+
+    def __init__(self):
+        self._waiting = {}
+
+
+    def __len__(self):
+        """
+        Return the number of objects being waited on.
+        """
+        return len(self._waiting)
+
+
+    def wait(self, object_id, key):
+        """
+        Return a Deferred which will fire the next time L{fire} is called with
+        this C{object_id} and C{key}.
+        """
+        def _cancel(d):
+            self._remove(object_id, key, d)
+        d = defer.Deferred(_cancel)
+        self._waiting.setdefault(object_id, {}).setdefault(key, []).append(d)
+        return d
+
+
+    def fire(self, object_id, key, result):
+        """
+        Fire all the Deferreds waiting on C{object_id} and C{key} with
+        C{result}.
+        """
+        by_key = self._waiting.get(object_id)
+        if by_key is None:
+            return
+        waiting = by_key.get(key)
+        if waiting is None:
+            return
+        while waiting:
+            waiting.pop(0).callback(result)
+        self._prune(object_id, key, waiting)
+
+
+    def forget(self, object_id):
+        """
+        Stop keeping track of anything waiting on C{object_id}.  The Deferreds
+        will never fire.
+        """
+        self._waiting.pop(object_id, None)
+
+
+    def _remove(self, object_id, key, d):
+        waiting = self._waiting.get(object_id, {}).get(key)
+        if waiting and d in waiting:
+            waiting.remove(d)
+            self._prune(object_id, key, waiting)
+
+
+    def _prune(self, object_id, key, waiting):
+        if waiting:
+            return
+        by_key = self._waiting.get(object_id)
+        if by_key is not None and by_key.get(key) is waiting:
+            del by_key[key]
+            if not by_key:
+                del self._waiting[object_id]
 
 
 
@@ -33,27 +210,48 @@ class World(object):
     """
 
 
-    def __init__(self, event_receiver, engine=None, auth=None):
+    def __init__(self, event_receiver, engine=None, auth=None, tracer=None,
+                 compact=False, event_log=None, rate_limiter=None):
         """
         @param event_receiver: Function to be called with every emitted event.
         @param engine: Game engine.
         @param auth: An authenticator (for teams).
+        @param tracer: An optional L{EventTracer} for logging events.
+        @param compact: If C{True} then objects will be stored in the more
+            memory-efficient L{CompactState}.
+        @param event_log: An optional L{EventLog} to which every event is
+            appended along with its sequence number.
+        @param rate_limiter: An optional L{RateLimiter} which every action
+            given to L{execute} must get past.
         """
         self.engine = engine
         self.auth = auth
-        
-        self._state = State()
-        self._event_queue = []
+        self.tracer = tracer
+        self.event_log = event_log
+        self.rate_limiter = rate_limiter
+        self.sequence = 0
+
+        if compact:
+            self._state = CompactState(tracer)
+        else:
+            self._state = State(tracer)
+        self._event_queue = deque()
         self._event_queue_running = False
         self._envelopes = WeakKeyDictionary()
         self._world_envelopes = {}
         self.objects = self._state.state
         self.event_receiver = event_receiver
-        self._subscribers = defaultdict(lambda: [])
-        self._receivers = defaultdict(lambda: [])
-        self._on_become = defaultdict(lambda: [])
-        self._on_change = defaultdict(lambda: [])
-        self._on_event = defaultdict(lambda: [])
+        self._subscribers = {}
+        self._receivers = {}
+        self._receiver_ids = {}
+        # receiver object id -> ids of the objects its receiver is subscribed
+        # to
+        self._subscriptions = {}
+        self._emitter_cache = {}
+        self._receiver_cache = {}
+        self._on_become = _Watchers()
+        self._on_change = _Watchers()
+        self._on_event = _Watchers()
 
 
     def execute(self, action):
@@ -62,6 +260,11 @@ class World(object):
 
         @param action: An L{IAction}-implementing instance.
         """
+        if self.rate_limiter is not None:
+            try:
+                self.rate_limiter.check(self, action)
+            except Exception:
+                return defer.fail()
         d = defer.maybeDeferred(self.engine.execute, self, action)
         return d.addCallback(self._executionFinished, action)
 
@@ -99,13 +302,32 @@ class World(object):
         self.emit(Destroyed(object_id), object_id)
         
         # remove all functions receiving emissions from this object.
-        if object_id in self._subscribers:
-            self._subscribers.pop(object_id)
+        subscribers = self._subscribers.pop(object_id, None)
+        if subscribers is not None:
+            for func, receiver_id in subscribers.entries():
+                if receiver_id is not None:
+                    self._subscriptions[receiver_id].discard(object_id)
+
+        # stop this object receiving emissions from others (such as the
+        # square it's on).
+        receiver = self._receiver_cache.get(object_id)
+        for emitter_id in self._subscriptions.pop(object_id, ()):
+            self._subscribers[emitter_id].discard(receiver)
 
         # remove all functions handling events received by this object.
         if object_id in self._receivers:
             self._receivers.pop(object_id)
 
+        # forget the emitter and receiver made for this object.
+        self._emitter_cache.pop(object_id, None)
+        receiver = self._receiver_cache.pop(object_id, None)
+        if receiver is not None:
+            self._receiver_ids.pop(receiver)
+
+        # forget how fast this object has been acting.
+        if self.rate_limiter is not None:
+            self.rate_limiter.forget(object_id)
+
 
     def get(self, object_id):
         """
@@ -114,19 +336,90 @@ class World(object):
         return self.objects[object_id]
 
 
+    def byKind(self, kind):
+        """
+        Get the set of ids of all the objects of a kind.
+        """
+        return self._state.byKind(kind)
+
+
+    def contentsSummary(self, object_id):
+        """
+        Get a dictionary of C{kind} to the number of things of that kind in
+        the C{contents} of an object.
+        """
+        return self._state.summary(object_id)
+
+
+    def boardRevision(self):
+        """
+        Get a number which changes whenever a square, or what is in a square,
+        changes.
+        """
+        return self._state.board_revision
+
+
+    def snapshot(self):
+        """
+        Get the state of the world, and the sequence number of the last event
+        that went into it, as plain data which can be given to L{restore}.
+
+        The result shares structure with me, so serialize it before emitting
+        anything else.
+        """
+        return {
+            'sequence': self.sequence,
+            'state': self._state.snapshot(),
+        }
+
+
+    def restore(self, snapshot):
+        """
+        Replace the state of the world with that from a L{snapshot}.
+
+        Nobody is told about this: not the engine, nor subscribers, nor my
+        C{event_receiver}.
+        """
+        self._state.restore(snapshot['state'])
+        self.sequence = snapshot['sequence']
+
+
+    def replay(self, sequence, event):
+        """
+        Apply an event from a log to the state of the world, without emitting
+        it.
+
+        @param sequence: The event's sequence number.
+        """
+        self._state.eventReceived(event)
+        self.sequence = sequence
+
+
+    def resubscribe(self):
+        """
+        Subscribe objects to each other's events as L{create} and C{Move}
+        would have, according to the state of the world.
+
+        Call this once on a world whose state was built by L{restore} and
+        L{replay}, which don't set up subscriptions.
+        """
+        for object_id, obj in self.objects.items():
+            self.subscribeTo(object_id, self.receiverFor(object_id))
+            location = obj.get('location')
+            if location:
+                self.subscribeTo(location, self.receiverFor(object_id))
+                self.subscribeTo(object_id, self.receiverFor(location))
+                self.receiveFor(location, self.emitterFor(location))
+
+
     def setAttr(self, object_id, attr_name, value):
         """
         Set the value of an object's attribute.
         """
         self.emit(AttrSet(object_id, attr_name, value), object_id)
         
-        on_become = self._on_become[(object_id, attr_name, value)]
-        while on_become:
-            on_become.pop(0).callback(value)
-
-        on_change = self._on_change[(object_id, attr_name)]
-        while on_change:
-            on_change.pop(0).callback(value)
+        self._on_become.fire(object_id, (attr_name, value), value)
+        self._on_change.fire(object_id, attr_name, value)
 
 
     def delAttr(self, object_id, attr_name):
@@ -161,6 +454,10 @@ class World(object):
         notifications about events particular to objects.
 
         All events will be sent to my C{event_receiver}.
+
+        Events are numbered in the order they are applied to the state of the
+        world; while an event is being processed, C{sequence} is its number.
+        An event passed along by another object isn't numbered again.
         """
         self._event_queue.append((event, object_id))
 
@@ -169,108 +466,187 @@ class World(object):
             return
 
         self._event_queue_running = True
-        called_list = []
+        called = _CallMemory()
         while self._event_queue:
-            event, object_id = self._event_queue.pop(0)
-            
+            event, object_id = self._event_queue.popleft()
+
             # update state
-            self._callOnce(called_list, self._state.eventReceived, event)
+            if called.add((self._state.eventReceived, (event,), ())):
+                self.sequence += 1
+                if self.event_log is not None:
+                    self.event_log.append(self.sequence, event)
+                self._state.eventReceived(event)
 
             # inform game engine
             if self.engine:
-                self._callOnce(called_list,
+                self._callOnce(called,
                                self.engine.worldEventReceived, self, event)
 
             try:
-                self._callOnce(called_list, self.event_receiver, event)
+                self._callOnce(called, self.event_receiver, event)
             except:
                 log.msg('Error in event receiver %r for event %r' % (
                         self.event_receiver, event))
                 log.msg(traceback.format_exc())
 
-            for func in self._subscribers[object_id]:
-                try:
-                    self._callOnce(called_list, func, event)
-                except:
-                    log.msg('Error in subscriber %r for %r for event %r' % (
-                            func, object_id, event))
-                    log.msg(traceback.format_exc())
-            
+            subscribers = self._subscribers.get(object_id)
+            if subscribers:
+                self._deliver(called, subscribers, event, object_id)
+
             # notify Deferreds waiting for this particular event
-            events = self._on_event[(object_id, event)]
-            while events:
-                events.pop(0).callback(event)
+            self._on_event.fire(object_id, event, event)
+
+            if type(event) is Destroyed:
+                # nothing more can happen to a destroyed object
+                self._on_become.forget(event.id)
+                self._on_change.forget(event.id)
+                self._on_event.forget(event.id)
         self._event_queue_running = False
 
 
-    def _callOnce(self, called_list, func, *args, **kwargs):
+    def _callOnce(self, called, func, *args, **kwargs):
         """
         Call the given function with the given arguments only once,
-        using C{called_list} as the memory for which functions have been
-        called.
+        using C{called} (a L{_CallMemory}) as the memory for which functions
+        have been called.
         """
-        key = (func, args, kwargs)
-        if key in called_list:
-            return
-        called_list.append(key)
-        func(*args, **kwargs)
+        if called.add((func, args, tuple(kwargs.items()))):
+            func(*args, **kwargs)
+
+
+    def _deliver(self, called, subscribers, event, object_id):
+        """
+        Deliver an event emitted by C{object_id} to all its C{subscribers} in
+        a single pass.
+
+        Subscribers that are the receivers of other objects (such as the
+        occupants of a square) have the event handed straight to the functions
+        receiving for those objects rather than going through
+        L{eventReceived}.
+        """
+        args = (event,)
+        receivers = self._receivers
+        for func, receiver_id in subscribers.entries():
+            if not called.add((func, args, ())):
+                continue
+            try:
+                if receiver_id is None:
+                    func(event)
+                elif receiver_id in receivers:
+                    for receive, _ in receivers[receiver_id].entries():
+                        receive(event)
+            except:
+                log.msg('Error in subscriber %r for %r for event %r' % (
+                        func, object_id, event))
+                log.msg(traceback.format_exc())
 
 
-    @memoize
     def emitterFor(self, object_id):
         """
         Get a function that will take a single argument and emit events for
         a particular object.
+
+        The same function is returned each time until the object is destroyed.
         """
-        def f(event):
-            self.emit(event, object_id)
+        f = self._emitter_cache.get(object_id)
+        if f is None:
+            def f(event):
+                self.emit(event, object_id)
+            self._emitter_cache[object_id] = f
         return f
 
 
     def subscribeTo(self, object_id, callback):
         """
         Subscribe to the events emitted by the given object.
+
+        Subscribing the receiver of another object (see L{receiverFor}) is how
+        one object comes to receive everything another emits.
         """
-        self._subscribers[object_id].append(callback)
+        receiver_id = self._receiverId(callback)
+        if object_id not in self._subscribers:
+            self._subscribers[object_id] = _Callbacks()
+        self._subscribers[object_id].add(callback, receiver_id)
+        if receiver_id is not None:
+            self._subscriptions.setdefault(receiver_id, set()).add(object_id)
 
 
     def unsubscribeFrom(self, object_id, callback):
         """
         Unsubscribe from the events emitted by the given object.
         """
-        self._subscribers[object_id].remove(callback)
+        if object_id not in self._subscribers:
+            raise ValueError(callback)
+        subscribers = self._subscribers[object_id]
+        subscribers.remove(callback)
+        receiver_id = self._receiverId(callback)
+        if receiver_id is not None and callback not in subscribers:
+            self._subscriptions[receiver_id].discard(object_id)
+
+
+    def _receiverId(self, callback):
+        """
+        Get the id of the object C{callback} is the receiver of, or C{None} if
+        it isn't one made by L{receiverFor}.
+        """
+        try:
+            return self._receiver_ids.get(callback)
+        except TypeError:
+            return None
 
 
     def eventReceived(self, event, object_id):
         """
         Receive an event for a particular object.
         """
-        for func in self._receivers[object_id]:
-            func(event)
+        receivers = self._receivers.get(object_id)
+        if receivers:
+            for func, _ in receivers.entries():
+                func(event)
 
 
-    @memoize
     def receiverFor(self, object_id):
         """
         Get a function that will take a single argument and call
         L{eventReceived} for the given object.
+
+        The same function is returned each time until the object is destroyed.
         """
-        def f(event):
-            self.eventReceived(event, object_id)
+        f = self._receiver_cache.get(object_id)
+        if f is None:
+            def f(event):
+                self.eventReceived(event, object_id)
+            self._receiver_cache[object_id] = f
+            self._receiver_ids[f] = object_id
         return f
 
 
+    def cachedClosureCount(self):
+        """
+        Return the number of functions made by L{emitterFor} and
+        L{receiverFor} that are still being held on to.
+        """
+        return len(self._emitter_cache) + len(self._receiver_cache)
+
+
     def receiveFor(self, object_id, callback):
         """
         Subscribe to the events received by the given object.
+
+        A callback subscribed more than once is still only called once for
+        each event received.
         """
-        self._receivers[object_id].append(callback)
+        if object_id not in self._receivers:
+            self._receivers[object_id] = _Callbacks()
+        self._receivers[object_id].add(callback)
 
 
     def stopReceivingFor(self, object_id, callback):
         """
         Unsubscribe from the events received by the given object.
         """
+        if object_id not in self._receivers:
+            raise ValueError(callback)
         self._receivers[object_id].remove(callback)
 
 
@@ -283,30 +659,14 @@ class World(object):
         Return a Deferred which will fire when the given attribute becomes
         the given value.
         """
-        key = (object_id, attr_name, target)
-        def _cancel(d):
-            self._on_become[key].remove(d)
-            if not self._on_become[key]:
-                del self._on_become[key]
-
-        d = defer.Deferred(_cancel)
-        self._on_become[key].append(d)
-        return d
+        return self._on_become.wait(object_id, (attr_name, target))
 
 
     def onNextChange(self, object_id, attr_name):
         """
         Return a Deferred which will fire when the given attribute next changes.
         """
-        key = (object_id, attr_name)
-        def _cancel(d):
-            self._on_change[key].remove(d)
-            if not self._on_change[key]:
-                del self._on_change[key]
-
-        d = defer.Deferred(_cancel)
-        self._on_change[key].append(d)
-        return d
+        return self._on_change.wait(object_id, attr_name)
 
 
     def onEvent(self, object_id, event):
@@ -314,15 +674,7 @@ class World(object):
         Return a Deferred which will fire when the given object emits the given
         event.
         """
-        key = (object_id, event)
-        def _cancel(d):
-            self._on_event[key].remove(d)
-            if not self._on_event[key]:
-                del self._on_event[key]
-
-        d = defer.Deferred(_cancel)
-        self._on_event[key].append(d)
-        return d
+        return self._on_event.wait(object_id, event)
 
 
     # envelopes